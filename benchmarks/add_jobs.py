@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Measure how 'lgit add .' scales with the number of jobs."""
+from argparse import ArgumentParser
+from os import cpu_count, environ, makedirs, urandom
+from os.path import abspath, dirname, join
+from shutil import rmtree
+from subprocess import run
+from tempfile import mkdtemp
+from time import perf_counter
+
+LGIT = join(dirname(dirname(abspath(__file__))), 'lgit.py')
+
+
+def parse_arguments():
+    """Parse command-line to options of the benchmark."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=2000,
+                        help='number of files to add (default: 2000)')
+    parser.add_argument('--size', type=int, default=65536,
+                        help='size of each file in bytes (default: 65536)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs for each job count (default: 3)')
+    parser.add_argument('--jobs', type=int, nargs='+',
+                        help='job counts to measure (default: 1, 2, 4... up '
+                        'to the number of cores)')
+    return parser.parse_args()
+
+
+def create_files(directory, number, size):
+    """Create number of files with random contents in directory."""
+    for i in range(number):
+        sub_directory = join(directory, 'dir%02d' % (i % 50))
+        makedirs(sub_directory, exist_ok=True)
+        with open(join(sub_directory, 'file%05d' % i), 'wb') as file:
+            file.write(urandom(size))
+
+
+def time_add(directory, jobs):
+    """Time 'lgit add .' with jobs in a fresh lgit repository.
+
+    Returns: The elapsed time in seconds.
+    """
+    rmtree(join(directory, '.lgit'), ignore_errors=True)
+    env = dict(environ, LOGNAME=environ.get('LOGNAME', 'benchmark'))
+    run(['python3', LGIT, 'init'], cwd=directory, env=env, check=True)
+    start = perf_counter()
+    run(['python3', LGIT, 'add', '.', '-j', str(jobs)], cwd=directory,
+        env=env, check=True)
+    return perf_counter() - start
+
+
+def main():
+    """Run the benchmark and print a table of the results."""
+    args = parse_arguments()
+    list_jobs = args.jobs
+    if not list_jobs:
+        list_jobs = [1]
+        while list_jobs[-1] * 2 <= cpu_count():
+            list_jobs.append(list_jobs[-1] * 2)
+    directory = mkdtemp(prefix='lgit-bench-')
+    try:
+        create_files(directory, args.files, args.size)
+        print('%d files of %d bytes, %d cores' % (args.files, args.size,
+                                                  cpu_count()))
+        print('%6s %10s %8s' % ('jobs', 'seconds', 'speedup'))
+        baseline = None
+        for jobs in list_jobs:
+            elapsed = min(time_add(directory, jobs)
+                          for _ in range(args.repeat))
+            baseline = baseline or elapsed
+            print('%6d %10.3f %7.2fx' % (jobs, elapsed, baseline / elapsed))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
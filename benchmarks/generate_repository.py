@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Generate a synthetic lgit repository of a given size."""
+from argparse import ArgumentParser
+from os import environ, makedirs
+from os.path import abspath, dirname, join
+from random import Random
+from subprocess import DEVNULL, run
+
+LGIT = join(dirname(dirname(abspath(__file__))), 'lgit.py')
+SIZE_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+
+def add_generator_arguments(parser):
+    """Add the options describing the repository to an argument parser."""
+    parser.add_argument('--files', type=int, default=1000,
+                        help='number of files (default: 1000)')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='depth of the directory tree (default: 3)')
+    parser.add_argument('--fanout', type=int, default=8,
+                        help='subdirectories of each directory (default: 8)')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='typical size of a file in bytes, the mean or '
+                        'the median of the distribution (default: 4096)')
+    parser.add_argument('--size-distribution', choices=SIZE_DISTRIBUTIONS,
+                        default='lognormal',
+                        help='distribution of the file sizes (default: '
+                        'lognormal)')
+    parser.add_argument('--commits', type=int, default=20,
+                        help='number of commits (default: 20)')
+    parser.add_argument('--changes', type=int, default=10,
+                        help='files changed by each commit after the first '
+                        'one (default: 10)')
+    parser.add_argument('--branches', type=int, default=2,
+                        help='number of branches besides master (default: 2)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random generator (default: 0)')
+
+
+def run_lgit(directory, *arguments):
+    """Run a lgit command in directory, hiding its output."""
+    env = dict(environ, LOGNAME=environ.get('LOGNAME', 'benchmark'))
+    run(['python3', LGIT] + list(arguments), cwd=directory, env=env,
+        stdout=DEVNULL, check=True)
+
+
+def _file_size(args, rng):
+    """Draw the size of a file from the distribution of args."""
+    if args.size_distribution == 'fixed':
+        return args.size
+    if args.size_distribution == 'uniform':
+        return rng.randint(0, 2 * args.size)
+    # A long tail of big files, like in most source trees:
+    return int(rng.lognormvariate(0, 1) * args.size)
+
+
+def _write_random_file(path, size, rng):
+    """Write size random bytes (of printable lines) into path."""
+    with open(path, 'wb') as file:
+        while size > 0:
+            line = b'%x\n' % rng.getrandbits(256)
+            file.write(line[:size])
+            size -= len(line)
+
+
+def generate_files(directory, args, rng):
+    """Create the files of the working directory.
+
+    Returns:
+        The list of the pathnames of the files, relative to directory.
+    """
+    paths = []
+    for i in range(args.files):
+        parts = ['d%d' % rng.randrange(args.fanout)
+                 for _ in range(rng.randint(0, args.depth))]
+        paths.append('/'.join(parts + ['file%06d' % i]))
+    for path in paths:
+        makedirs(dirname(join(directory, path)), exist_ok=True)
+        _write_random_file(join(directory, path), _file_size(args, rng), rng)
+    return paths
+
+
+def modify_files(directory, paths, number, rng):
+    """Append a line to number of random files.
+
+    Returns:
+        The list of the modified files.
+    """
+    changed = rng.sample(paths, min(number, len(paths)))
+    for path in changed:
+        with open(join(directory, path), 'ab') as file:
+            file.write(b'%x\n' % rng.getrandbits(64))
+    return changed
+
+
+def build_history(directory, paths, args, rng):
+    """Make the commits after the first one, and create the branches.
+
+    The branches are created at commits spread over the history, the
+    first one at the first commit.
+    """
+    interval = max((args.commits - 1) // max(args.branches, 1), 1)
+    branches = 0
+    for number in range(1, args.commits):
+        if branches < args.branches and (number - 1) % interval == 0:
+            run_lgit(directory, 'branch', 'branch%d' % branches)
+            branches += 1
+        changed = modify_files(directory, paths, args.changes, rng)
+        run_lgit(directory, 'add', *changed)
+        run_lgit(directory, 'commit', '-m', 'commit %d' % number)
+    for number in range(branches, args.branches):
+        run_lgit(directory, 'branch', 'branch%d' % number)
+
+
+def main():
+    """Generate a repository in the given directory."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('directory', help='where to generate the repository')
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+    rng = Random(args.seed)
+    makedirs(args.directory, exist_ok=True)
+    paths = generate_files(args.directory, args, rng)
+    run_lgit(args.directory, 'init')
+    run_lgit(args.directory, 'add', '.')
+    run_lgit(args.directory, 'commit', '-m', 'commit 0')
+    build_history(args.directory, paths, args, rng)
+
+
+if __name__ == '__main__':
+    main()
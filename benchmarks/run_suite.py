@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Time the lgit commands on a synthetic repository, with JSON results.
+
+Each round generates the same repository (the generator is seeded) in a
+new directory and times, through lgit.py:
+
+    init, add (all files), commit (first commit), status (clean tree),
+    status (dirty tree), add (dirty files), commit, log, ls-files, branch
+    (create), branch (list), checkout (to an old branch and back)
+
+The results of two revisions are compared with --compare.
+"""
+from argparse import ArgumentParser
+from json import dump, load
+from os import environ
+from os.path import dirname
+from platform import platform, python_version
+from random import Random
+from shutil import rmtree
+from statistics import median
+from subprocess import DEVNULL, PIPE, run
+from sys import stdout
+from tempfile import mkdtemp
+from time import perf_counter
+
+from generate_repository import (LGIT, add_generator_arguments, build_history,
+                                 generate_files, modify_files)
+
+STEPS = ('init', 'add', 'commit', 'status_clean', 'status_dirty',
+         'add_dirty', 'commit_dirty', 'log', 'ls_files', 'branch_create',
+         'branch_list', 'checkout_branch', 'checkout_master')
+
+
+def parse_arguments():
+    """Parse command-line to options of the benchmark."""
+    parser = ArgumentParser(description=__doc__)
+    add_generator_arguments(parser)
+    parser.add_argument('--dirty', type=float, default=0.01,
+                        help='fraction of files changed for the dirty '
+                        'status (default: 0.01)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of rounds (default: 3)')
+    parser.add_argument('--output', metavar='<file>',
+                        help='write the results there instead of stdout')
+    parser.add_argument('--compare', metavar='<file>',
+                        help='results of another revision to compare with')
+    return parser.parse_args()
+
+
+def time_lgit(directory, *arguments):
+    """Time a lgit command in directory.
+
+    Returns: The elapsed time in seconds.
+    """
+    env = dict(environ, LOGNAME=environ.get('LOGNAME', 'benchmark'))
+    start = perf_counter()
+    run(['python3', LGIT] + list(arguments), cwd=directory, env=env,
+        stdout=DEVNULL, check=True)
+    return perf_counter() - start
+
+
+def run_round(args):
+    """Generate a repository and time every step once.
+
+    Returns: A dictionary of step -> elapsed time in seconds.
+    """
+    rng = Random(args.seed)
+    directory = mkdtemp(prefix='lgit-bench-')
+    times = {}
+    try:
+        paths = generate_files(directory, args, rng)
+        times['init'] = time_lgit(directory, 'init')
+        times['add'] = time_lgit(directory, 'add', '.')
+        times['commit'] = time_lgit(directory, 'commit', '-m', 'commit 0')
+        build_history(directory, paths, args, rng)
+        times['status_clean'] = time_lgit(directory, 'status')
+        modify_files(directory, paths, max(int(len(paths) * args.dirty), 1),
+                     rng)
+        times['status_dirty'] = time_lgit(directory, 'status')
+        times['add_dirty'] = time_lgit(directory, 'add', '.')
+        times['commit_dirty'] = time_lgit(directory, 'commit', '-m', 'dirty')
+        times['log'] = time_lgit(directory, 'log')
+        times['ls_files'] = time_lgit(directory, 'ls-files')
+        times['branch_create'] = time_lgit(directory, 'branch', 'benchmark')
+        times['branch_list'] = time_lgit(directory, 'branch')
+        if args.branches:
+            times['checkout_branch'] = time_lgit(directory, 'checkout',
+                                                 'branch0')
+            times['checkout_master'] = time_lgit(directory, 'checkout',
+                                                 'master')
+    finally:
+        rmtree(directory)
+    return times
+
+
+def get_revision():
+    """Get the git revision of lgit, or None outside of a git checkout."""
+    try:
+        result = run(['git', 'describe', '--always', '--dirty'],
+                     cwd=dirname(LGIT), stdout=PIPE, stderr=DEVNULL,
+                     universal_newlines=True)
+    except FileNotFoundError:
+        return None
+    return result.stdout.strip() or None
+
+
+def compare_results(results, other):
+    """Print the ratio of the median times of results to the other ones."""
+    print('%-16s %10s %10s %8s' % ('step', 'before', 'after', 'ratio'))
+    for step in STEPS:
+        if step in results['steps'] and step in other['steps']:
+            before = other['steps'][step]['median']
+            after = results['steps'][step]['median']
+            print('%-16s %10.3f %10.3f %7.2fx' % (step, before, after,
+                                                  after / before))
+
+
+def main():
+    """Run the benchmark and write its results as JSON."""
+    args = parse_arguments()
+    rounds = [run_round(args) for _ in range(max(args.repeat, 1))]
+    parameters = {name: value for name, value in vars(args).items()
+                  if name not in ('output', 'compare')}
+    results = {'revision': get_revision(), 'python': python_version(),
+               'platform': platform(), 'parameters': parameters,
+               'steps': {}}
+    for step in STEPS:
+        runs = [times[step] for times in rounds if step in times]
+        if runs:
+            results['steps'][step] = {'runs': runs, 'min': min(runs),
+                                      'median': median(runs)}
+    if args.output:
+        with open(args.output, 'w') as file:
+            dump(results, file, indent=2)
+    else:
+        dump(results, stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as file:
+            compare_results(results, load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,139 +1,456 @@
-"""Implement git's branches and merging."""
+"""Implement git's branches, merging and stashing.
+
+A stash is a file of .lgit/stash, named after the time it was made (the
+newest one is stash@{0}):
+
+    branch <the current branch>
+    head <the last commit>
+    index <the SHA1 of the tree of the index>
+    message <the message shown by 'stash list'>
+
+    <SHA1 in the last commit> <staged SHA1> <working SHA1> <pathname>
+    ...
+
+with one line per file which differs from the last commit, and '-' for a
+missing SHA1 (a file added, removed, or missing in the working directory).
+The tree of the index is written from the cache of the index, and only the
+working files which differ from their staged contents are stored: the cost
+of a stash follows the number of changed files, not the size of the tree.
+"""
 from os import listdir, rmdir, unlink
 from os.path import dirname, exists
 
-from functions import (format_mtime, get_current_branch, make_directory,
-                       read_file, write_file)
+from commits import find_merge_base, read_commit
+from fsmonitor import query_changed_paths
+from functions import (EMPTY_HASH, get_stat_data,
+                       get_timestamp_of_current_time, hashing_sha1_file,
+                       is_stat_clean, make_directory, read_file, write_file)
+from index import Index, IndexEntry
+from merge import merge_contents
+from objects import (copy_object_to_file, read_object, store_file,
+                     store_object)
+from refs import (branch_exists, get_branch_commit, get_current_branch,
+                  set_current_branch, update_branch)
+from repository import LgitError, Repository
+from tracing import span
+from trees import diff_snapshot_and_tree, diff_snapshots, write_tree
 
 
 def execute_lgit_branch(args, lgit_path):
     """List or create branches."""
-
-    def _create_branch(name):
-        """Create a new branch."""
-        # If branch name exists:
-        if exists(lgit_path + '/.lgit/refs/heads/' + name):
-            exit("fatal: A branch named '%s' already exists." % name)
-        # Create new branch:
-        snapshots = listdir(lgit_path + '/.lgit/snapshots')
-        with open(lgit_path + '/.lgit/refs/heads/%s' % name, 'w') as branch:
-            if snapshots:
-                branch.write(max(snapshots))
-
-    def _list_branches():
-        """List all existing branches."""
-        branch = get_current_branch(lgit_path + '/.lgit/HEAD')
-        for file in sorted(listdir(lgit_path + '/.lgit/refs/heads')):
-            if file == branch:
-                print('*', file)
-            else:
-                print(' ', file)
-
+    repository = Repository(lgit_path)
     if args.branch_name:
-        # If call branch command without ever have commit yet:
-        if not listdir(lgit_path + '/.lgit/refs/heads'):
-            exit("fatal: Not a valid object name: 'master'.")
-        _create_branch(args.branch_name)
+        try:
+            repository.create_branch(args.branch_name)
+        except LgitError as error:
+            exit(str(error))
     else:
-        _list_branches()
+        current_branch = repository.current_branch()
+        for branch in repository.branches():
+            print('*' if branch == current_branch else ' ', branch)
+
+
+def _report_error(list_file, command='checkout'):
+    """Print error with the files would be overwitten."""
+    print('''error: Your local changes to the following files would be
+        overwritten by %s:''' % command)
+    for file_name in list_file:
+        print('\t' + file_name)
+    print('''Please, commit your changes or stash them before you can
+        %s.''' % ('switch branches' if command == 'checkout' else command))
+    print('Aborting')
+
+
+def _remove_working_file(file_name):
+    """Remove a file and the directories it leaves empty."""
+    try:
+        unlink(file_name)
+    except FileNotFoundError:
+        pass
+    # If there's any empty directory in directory 'file_name':
+    try:
+        while '/' in file_name:
+            file_name = dirname(file_name)
+            rmdir(file_name)
+    except OSError:
+        pass
+
+
+def _create_working_file(lgit_path, file_path, hash_value):
+    """Write the contents of an object as a working file."""
+    # Create tree directory that the file in it:
+    if '/' in file_path:
+        make_directory(dirname(file_path))
+    # Create new file:
+    copy_object_to_file(lgit_path, hash_value, file_path)
+
+
+def _find_overwritten_files(index, changes):
+    """Find the files whose local changes would be overwritten.
+
+    Args:
+        index: The Index of the lgit directory.
+        changes: The (pathname, old SHA1, new SHA1) of the files which
+            are going to be replaced.
+
+    Returns:
+        The list of the files.
+    """
+    error_files = []
+    for file_name, _, hash_value in changes:
+        entry = index.get(file_name)
+        if entry is None:
+            # An untracked file would be replaced:
+            if hash_value and exists(file_name):
+                error_files.append(file_name)
+            continue
+        file_stat = get_stat_data(file_name)
+        if file_stat and not is_stat_clean(entry.stat_data, file_stat,
+                                           index.mtime_ns):
+            entry.working_hash = hashing_sha1_file(file_name)
+            entry.set_stat_data(file_stat)
+            index.changed = True
+        if entry.committed_hash != entry.working_hash or (
+                entry.committed_hash != entry.staged_hash):
+            error_files.append(file_name)
+    return error_files
+
+
+def _update_working_files(lgit_path, index, changes, committed=True):
+    """Update the files which differ, then write the index once.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        index: The Index of the lgit directory.
+        changes: The (pathname, old SHA1, new SHA1) of the files to update,
+            with None as new SHA1 for a file to remove.
+        committed: If the new SHA1s are the ones of the last commit, else
+            they are only staged.
+    """
+    # Remove files first, a file may be replaced by a directory:
+    for file_name, _, hash_value in changes:
+        if hash_value is None and index.remove(file_name):
+            _remove_working_file(file_name)
+    for file_name, old_hash, hash_value in changes:
+        if hash_value is not None:
+            _create_working_file(lgit_path, file_name, hash_value)
+            index.add(IndexEntry(
+                file_name, hash_value, get_stat_data(file_name),
+                hash_value if committed else old_hash or EMPTY_HASH))
+    index.flush()
+
+
+def _switch_working_tree(lgit_path, index, old_commit, new_commit,
+                         command='checkout'):
+    """Update the working directory and the index from a commit to another.
+
+    Only the files which differ between the commits are written. Nothing
+    is written if local changes would be overwritten: the command is then
+    aborted.
+    """
+    with span('diff snapshots'):
+        changes = list(diff_snapshots(lgit_path, old_commit, new_commit))
+    # List files has change without 'commit' command:
+    with span('find overwritten files'):
+        error_files = _find_overwritten_files(index, changes)
+    if error_files:
+        _report_error(error_files, command)
+        index.flush()
+        exit(1)
+    with span('update working files', files=len(changes)):
+        _update_working_files(lgit_path, index, changes)
 
 
 def execute_lgit_checkout(args, lgit_path):
     """Switch branches or restore working tree files."""
+    current_stage = get_branch_commit(lgit_path)
+    if current_stage is None:
+        print('fatal: You are on a branch yet to be born')
+    elif not branch_exists(lgit_path, args.branch_name):
+        print("error: pathspec '%s' did not match any file(s) known to git"
+              % args.branch_name)
+    else:
+        branch = get_current_branch(lgit_path)
+        if args.branch_name == branch:
+            if branch != 'master':
+                print("Already on '%s'" % branch)
+        else:
+            last_commit = get_branch_commit(lgit_path, args.branch_name)
+            if last_commit != current_stage:
+                _switch_working_tree(lgit_path, Index.load(lgit_path),
+                                     current_stage, last_commit)
+            set_current_branch(lgit_path, args.branch_name)
+            print("Switch to branch '%s'" % args.branch_name)
+
+
+def execute_lgit_merge(args, lgit_path):
+    """Join the history of another branch into the current branch."""
+    branch = get_current_branch(lgit_path)
+    head = get_branch_commit(lgit_path)
+    other = get_branch_commit(lgit_path, args.branch_name)
+    if other is None:
+        exit('merge: %s - not something we can merge' % args.branch_name)
+    if head is None:
+        exit('fatal: You are on a branch yet to be born')
+    if exists(lgit_path + '/.lgit/MERGE_HEAD'):
+        exit('fatal: You have not concluded your merge (MERGE_HEAD exists).')
+    index = Index.load(lgit_path)
+    with span('find merge base'):
+        base = find_merge_base(lgit_path, head, other)
+    if base == other:
+        print('Already up to date.')
+        return
+    # Like git, refuse to put staged changes in the merge:
+    staged_files = [path for path, _, _ in diff_snapshot_and_tree(
+        lgit_path, head, write_tree(lgit_path, index))]
+    if staged_files:
+        _report_error(staged_files, 'merge')
+        index.flush()
+        exit(1)
+    if base == head:
+        # Only the files which differ are written, then the branch moves:
+        print('Updating %s..%s' % (head, other))
+        print('Fast-forward')
+        _switch_working_tree(lgit_path, index, head, other, 'merge')
+        update_branch(lgit_path, branch, other)
+        return
+    with span('three-way merge'):
+        updates, conflicts = _merge_trees(lgit_path, base, head, other,
+                                          (branch, args.branch_name))
+    error_files = _find_overwritten_files(
+        index, updates + [(path, None, True) for path, _, _ in conflicts])
+    if error_files:
+        _report_error(error_files, 'merge')
+        index.flush()
+        exit(1)
+    _update_working_files(lgit_path, index, updates, committed=False)
+    write_file(lgit_path + '/.lgit/MERGE_HEAD', other + '\n')
+    if conflicts:
+        for path, contents, kind in conflicts:
+            if contents is not None:
+                # Replace the file, it may be linked to an object:
+                try:
+                    unlink(path)
+                except FileNotFoundError:
+                    pass
+                with open(path, 'wb') as file:
+                    file.write(contents)
+            print('CONFLICT (%s): Merge conflict in %s' % (kind, path))
+        exit('Automatic merge failed; fix conflicts and then commit the '
+             'result.')
+    Repository(lgit_path).commit("Merge branch '%s'" % args.branch_name)
+    print("Merge made by the 'three-way' strategy.")
+
+
+def _merge_trees(lgit_path, base, ours, theirs, labels):
+    """Merge the snapshots of two commits with their merge base.
+
+    Most paths are resolved by their SHA1s: only the files changed on both
+    sides, in different ways, are read and merged line by line.
 
-    def _report_error(list_file):
-        """Print error with the files would be overwitten."""
-        print('''error: Your local changes to the following files would be
-        overwritten by checkout:''')
-        for file_name in list_file:
-            print('\t' + file_name)
-        print('''Please, commit your changes or stash them before you can
-        switch branches.''')
-        print('Aborting')
-
-    def _remove_files_in_index():
-        """Remove all files in lgit's index."""
-        for index in content_index:
-            file_name = index[138:]
-            unlink(file_name)
-            # If there's any empty directory in directory 'file_name':
-            try:
-                while '/' in file_name:
-                    file_name = dirname(file_name)
-                    rmdir(file_name)
-                rmdir(file_name)
-            except OSError:
-                pass
-
-    def _create_working_files(file_path, content):
-        """Create tree of working files."""
-        # Create tree directory that the file in it:
-        if '/' in file_path:
-            parent_paths = file_path.split('/')[:-1]
-            for i in range(len(parent_paths) - 1):
-                make_directory('/'.join(parent_paths[:i + 1]))
-        # Create new file:
-        write_file(file_path, content)
-
-    def _setup_for_new_branch(commit):
-        """Create working files and rewrite index for the current branch."""
-        new_content_index = ''
-        content_snap = read_file(lgit_path +
-                                 '/.lgit/snapshots/%s' % commit).split('\n')
-        for line_snap in content_snap:
-            content = read_file(lgit_path + '/.lgit/objects/%s/%s' %
-                                (line_snap[:2], line_snap[2:40]))
-            file_name = content_snap[41:]
-            _create_working_files(file_name, content)
-            timestamp = format_mtime(file_name)
-            new_content_index += (timestamp + (' ' + line_snap[:40]) * 3 + ' '
-                                  + file_name + '\n')
-            write_file(lgit_path + '/.lgit/index', new_content_index)
-
-    def _update_head_file(branch_name):
-        """Update the HEAD file with the branch_name"""
-        content = 'ref: refs/head/%s' % branch_name
-        write_file(lgit_path + '/.lgit/HEAD', content)
-
-    list_branches = listdir(lgit_path + '/.lgit/refs/heads')
-    if list_branches:
-        if args.branch_name not in list_branches:
-            print("error: pathspec '%s' did not match any file(s) known to git"
-                  % args.branch_name)
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        base, ours, theirs: The names of the merge base, of the last commit
+            of the current branch and of the merged one.
+        labels: The names of the branches, for the conflict markers.
+
+    Returns:
+        The (pathname, SHA1 in ours, merged SHA1) of the files to update
+            (None as merged SHA1 to remove the file), and the (pathname,
+            contents with conflict markers or None to keep the file, kind
+            of conflict) of the conflicts.
+    """
+    our_changes = {path: our_hash for path, _, our_hash
+                   in diff_snapshots(lgit_path, base, ours)}
+    updates = []
+    conflicts = []
+    for path, base_hash, their_hash in diff_snapshots(lgit_path, base,
+                                                      theirs):
+        if path not in our_changes:  # Only changed in theirs.
+            updates.append((path, base_hash, their_hash))
+            continue
+        our_hash = our_changes[path]
+        if our_hash == their_hash:  # The same change on both sides.
+            continue
+        if our_hash is None or their_hash is None:
+            # Removed on a side, changed on the other: keep the change.
+            if our_hash is None:
+                updates.append((path, None, their_hash))
+            conflicts.append((path, None, 'modify/delete'))
+            continue
+        contents, conflict_count = merge_contents(
+            read_object(lgit_path, base_hash) if base_hash else b'',
+            read_object(lgit_path, our_hash),
+            read_object(lgit_path, their_hash), labels)
+        if conflict_count:
+            conflicts.append((path, contents, 'content'))
         else:
-            branch = get_current_branch(lgit_path + '/.lgit/HEAD')
-            if args.branch_name == branch:
-                if branch != 'master':
-                    print("Already on '%s'" % branch)
+            updates.append((path, our_hash,
+                            store_object(lgit_path, contents)))
+    return updates, conflicts
+
+
+def list_stashes(lgit_path):
+    """Get the names of the stashes, newest first."""
+    try:
+        return sorted(listdir(lgit_path + '/.lgit/stash'), reverse=True)
+    except FileNotFoundError:
+        return []
+
+
+def read_stash(lgit_path, name):
+    """Read a stash file.
+
+    Returns:
+        The dictionary of its headers, and the (pathname, SHA1 in the last
+            commit, staged SHA1, working SHA1) of its files, with None for
+            a missing SHA1.
+    """
+    content = read_file(lgit_path + '/.lgit/stash/' + name) or ''
+    header, _, body = content.partition('\n\n')
+    headers = dict(line.split(' ', 1) for line in header.split('\n')
+                   if ' ' in line)
+    files = []
+    for line in body.split('\n'):
+        if line:
+            *hashes, path = line.split(' ', 3)
+            files.append((path, *(None if hash_value == '-' else hash_value
+                                  for hash_value in hashes)))
+    return headers, files
+
+
+def _stash_push(lgit_path):
+    """Save the local changes in a stash, then revert them."""
+    head = get_branch_commit(lgit_path)
+    if head is None:
+        exit('fatal: You do not have the initial commit yet')
+    index = Index.load(lgit_path)
+    # The untracked files aren't looked at: the changed paths are reported
+    # again to the next command, which may walk them.
+    present_paths = {entry.path for entry in index.refresh(
+        query_changed_paths(lgit_path, index, complete=False))}
+    # The tree of the index only writes the directories with staged changes:
+    with span('write index tree'):
+        index_tree = write_tree(lgit_path, index)
+        files = {path: [committed_hash, staged_hash, staged_hash]
+                 for path, committed_hash, staged_hash
+                 in diff_snapshot_and_tree(lgit_path, head, index_tree)}
+    with span('store working files'):
+        for entry in index:
+            if entry.path not in present_paths:
+                working_hash = None
+            elif entry.working_hash != entry.staged_hash:
+                working_hash = store_file(lgit_path, entry.path)
             else:
-                last_commit = read_file(lgit_path + '/.lgit/refs/heads/%s' %
-                                        args.branch_name).split('\n')[0]
-                current_stage = read_file(
-                    lgit_path + '/.lgit/refs/heads/%s' % branch).split('\n')[0]
-                if last_commit != current_stage:
-                    content_index = read_file(lgit_path +
-                                              '/.lgit/index').split('\n')
-                    # List files has change without 'commit' command:
-                    error_files = []
-                    for line in content_index:
-                        file = line[138:]
-                        if line[15:55] != line[97:137]:
-                            error_files.append(file)
-                    if error_files:
-                        _report_error(error_files)
-                        exit()
-                    else:
-                        _remove_files_in_index()
-                        _setup_for_new_branch(last_commit)
-                _update_head_file(args.branch_name)
-                print("Switch to branch '%s'" % args.branch_name)
-    else:
-        print('fatal: You are on a branch yet to be born')
+                continue
+            files.setdefault(entry.path, [entry.staged_hash,
+                                          entry.staged_hash, None])
+            files[entry.path][2] = working_hash
+    if not files:
+        index.flush()
+        print('No local changes to save')
+        return
+    branch = get_current_branch(lgit_path)
+    message = 'WIP on %s: %s %s' % (
+        branch, head, read_commit(lgit_path, head).message.split('\n')[0])
+    lines = ['branch %s' % branch, 'head %s' % head, 'index %s' % index_tree,
+             'message %s' % message, '']
+    for path, hashes in sorted(files.items()):
+        lines.append(' '.join([hash_value or '-' for hash_value in hashes] +
+                              [path]))
+    make_directory(lgit_path + '/.lgit/stash')
+    write_file(lgit_path + '/.lgit/stash/%s'
+               % get_timestamp_of_current_time()[1], '\n'.join(lines) + '\n')
+    # Revert the files to the last commit:
+    with span('update working files', files=len(files)):
+        _update_working_files(lgit_path, index, [
+            (path, None, hashes[0]) for path, hashes in sorted(files.items())])
+    print('Saved working directory and index state %s' % message)
 
 
-def execute_lgit_merge(args, lgit_path):
-    """Merge one branch onto another."""
+def _merge_stashed_hash(lgit_path, base_hash, our_hash, their_hash):
+    """Merge a stashed SHA1 of a file with the one of the current commit.
+
+    Returns:
+        The merged SHA1 (None for no file), or False for a conflict.
+    """
+    if our_hash == base_hash or our_hash == their_hash:
+        return their_hash
+    if their_hash == base_hash:
+        return our_hash
+    if our_hash is None or their_hash is None:
+        return False
+    contents, conflict_count = merge_contents(
+        read_object(lgit_path, base_hash) if base_hash else b'',
+        read_object(lgit_path, our_hash), read_object(lgit_path, their_hash))
+    if conflict_count:
+        return False
+    return store_object(lgit_path, contents)
+
+
+def _stash_pop(lgit_path):
+    """Apply the newest stash to the working directory, then drop it.
+
+    The stashed files which changed since the stash was made are merged;
+    nothing is written if there is a conflict, and the stash is kept.
+    """
+    stashes = list_stashes(lgit_path)
+    if not stashes:
+        exit('error: No stash entries found.')
+    _, files = read_stash(lgit_path, stashes[0])
+    index = Index.load(lgit_path)
+    updates = []
+    conflicts = []
+    for path, base_hash, staged_hash, working_hash in files:
+        entry = index.get(path)
+        current_hash = entry.committed_hash if entry else None
+        if current_hash == EMPTY_HASH:
+            current_hash = None
+        new_staged = _merge_stashed_hash(lgit_path, base_hash, current_hash,
+                                         staged_hash)
+        new_working = _merge_stashed_hash(lgit_path, base_hash, current_hash,
+                                          working_hash)
+        if new_staged is False or new_working is False:
+            conflicts.append(path)
+        else:
+            updates.append((path, current_hash, new_staged, new_working))
+    error_files = _find_overwritten_files(index, [
+        (path, None, new_working)
+        for path, _, _, new_working in updates])
+    if error_files:
+        _report_error(error_files, 'stash pop')
+        index.flush()
+        exit(1)
+    if conflicts:
+        for path in conflicts:
+            print('CONFLICT (content): Merge conflict in %s' % path)
+        index.flush()
+        exit('The stash entry is kept in case you need it again.')
+    with span('update working files', files=len(updates)):
+        for path, current_hash, new_staged, new_working in updates:
+            if new_working is None:
+                _remove_working_file(path)
+            else:
+                _create_working_file(lgit_path, path, new_working)
+            if new_staged is None:
+                index.remove(path)
+                continue
+            entry = IndexEntry(path, new_staged, get_stat_data(path),
+                               current_hash or EMPTY_HASH)
+            entry.working_hash = new_working or EMPTY_HASH
+            index.add(entry)
+        index.flush()
+    unlink(lgit_path + '/.lgit/stash/' + stashes[0])
+    print('Dropped stash@{0} (%s)' % stashes[0])
 
 
 def execute_lgit_stash(args, lgit_path):
     """Stash the changes in a dirty working directory away."""
+    if args.action == 'push':
+        _stash_push(lgit_path)
+    elif args.action == 'pop':
+        _stash_pop(lgit_path)
+    else:
+        for number, name in enumerate(list_stashes(lgit_path)):
+            headers, _ = read_stash(lgit_path, name)
+            print('stash@{%d}: %s' % (number, headers.get('message', '')))
@@ -0,0 +1,95 @@
+"""Split big files into chunks defined by their contents.
+
+A file bigger than the chunking threshold is stored as chunks (blobs) and
+a manifest listing them (see objects.py). The boundaries of the chunks
+depend on the bytes around them, not on their offsets: inserting a byte
+only changes the chunk it is in, the next boundaries are found again at
+the same bytes, so the versions of a file (and different files) share
+their unchanged chunks.
+
+Like a gear hash, each byte is mapped to a pseudo-random bit by a fixed
+table; a boundary is where the bits of the last ANCHOR_SIZE bytes form a
+fixed pattern, at least MIN_CHUNK_SIZE bytes after the previous boundary.
+If the pattern isn't found before MAX_CHUNK_SIZE, the first match of its
+last WEAK_ANCHOR_SIZE bits is taken instead (the bits of very regular
+data, like columns of numbers, rarely form the whole pattern), and a
+chunk is only cut at MAX_CHUNK_SIZE if neither is found (in a run of the
+same byte). The table and the patterns are applied with bytes.translate()
+and bytes.find(), so the bytes are scanned at the speed of C.
+
+The threshold is LGIT_CHUNK_THRESHOLD (in bytes, 0 to never split files),
+by default DEFAULT_CHUNK_THRESHOLD.
+"""
+from hashlib import sha1
+from os import environ
+
+DEFAULT_CHUNK_THRESHOLD = 32 * 1024 * 1024
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+ANCHOR_SIZE = 16  # A boundary every 64 KiB on average, after the minimum.
+WEAK_ANCHOR_SIZE = 10
+READ_SIZE = 1024 * 1024
+
+# Changing the table or the pattern changes all the boundaries: the chunks
+# of the files stored before would not be shared anymore.
+_BIT_TABLE = bytes(sha1(bytes([byte])).digest()[0] & 1 for byte in range(256))
+_ANCHOR = bytes(sha1(b'lgit chunk anchor').digest()[index] & 1
+                for index in range(ANCHOR_SIZE))
+_WEAK_ANCHOR = _ANCHOR[-WEAK_ANCHOR_SIZE:]
+
+
+def get_chunk_threshold():
+    """Get the size above which the files are split, or None to never."""
+    try:
+        threshold = int(environ.get('LGIT_CHUNK_THRESHOLD',
+                                    DEFAULT_CHUNK_THRESHOLD))
+    except ValueError:
+        threshold = DEFAULT_CHUNK_THRESHOLD
+    return threshold if threshold > 0 else None
+
+
+def find_boundary(data, offset=0):
+    """Find the end of the chunk starting at offset in data.
+
+    Args:
+        data: The bytes, with at least MAX_CHUNK_SIZE of them after offset
+            unless they are the end of the file.
+        offset: The start of the chunk.
+
+    Returns:
+        The size of the chunk.
+    """
+    limit = min(len(data) - offset, MAX_CHUNK_SIZE)
+    start = MIN_CHUNK_SIZE - ANCHOR_SIZE
+    if limit <= MIN_CHUNK_SIZE:
+        return limit
+    bits = data[offset + start:offset + limit].translate(_BIT_TABLE)
+    position = bits.find(_ANCHOR)
+    if position >= 0:
+        return start + position + ANCHOR_SIZE
+    # The weak pattern ends after the minimum size too:
+    position = bits.find(_WEAK_ANCHOR, ANCHOR_SIZE - WEAK_ANCHOR_SIZE)
+    if position >= 0:
+        return start + position + WEAK_ANCHOR_SIZE
+    return limit
+
+
+def iter_chunks(file):
+    """Yield the chunks of the contents of a file, in order.
+
+    The file is read by READ_SIZE bytes, so only a few chunks are in
+    memory at once.
+    """
+    buffer = b''
+    while True:
+        data = file.read(READ_SIZE)
+        buffer += data
+        offset = 0
+        while len(buffer) - offset >= MAX_CHUNK_SIZE or (
+                not data and offset < len(buffer)):
+            size = find_boundary(buffer, offset)
+            yield buffer[offset:offset + size]
+            offset += size
+        buffer = buffer[offset:]
+        if not data:  # end of file reached
+            break
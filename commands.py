@@ -1,11 +1,21 @@
 """Present commands in lgit program."""
-from os import environ, listdir, stat, unlink
-from os.path import exists, isdir, isfile, join
-
-from functions import (copy_file_to_another, format_mtime, get_current_branch,
-                       get_files_skip_lgit, get_readable_date,
-                       get_timestamp_of_current_time, hashing_sha1_file,
-                       make_directory, read_file, write_file)
+from collections import OrderedDict
+from os import environ, listdir, unlink
+from os.path import exists, isdir
+
+from commits import write_commit_graph
+from fsmonitor import get_fsmonitor_status, start_fsmonitor, stop_fsmonitor
+from functions import get_readable_date, make_directory
+from history import write_path_history
+from index import Index
+from diff import iter_unified_diff
+from objects import read_object, repack_objects
+from pathspec import Pathspec, is_literal
+from prune import find_garbage, remove_commits
+from refs import pack_refs
+from repository import LgitError, Repository
+from tracing import span
+from trees import diff_snapshots
 
 
 def execute_lgit_init():
@@ -54,103 +64,32 @@ def execute_lgit_init():
 
 def execute_lgit_add(args, lgit_path):
     """Add file contents to the index."""
+    try:
+        Repository(lgit_path).add(args.files, args.jobs)
+    except LgitError as error:
+        exit(str(error))
 
-    def _add_file_to_lgit_database(a_file, hash_value):
-        """Store a copy of the file contents in the lgit database."""
-        dir_path = lgit_path + '/.lgit/objects/%s/' % hash_value[:2]
-        make_directory(dir_path)
-        copy_file_to_another(a_file, dir_path + hash_value[2:])
 
-    def _update_index(a_file, hash_value):
-        """Update the file information in the index file."""
-        timestamp = format_mtime(a_file)
+def execute_lgit_rm(args, lgit_path):
+    """Remove files from the working directory and the index."""
+
+    index = Index.load(lgit_path)
+    pathspec = Pathspec(args.files)
+    # Nothing is removed unless every pattern is fine (only exclusions
+    # stand for '.', everything but them):
+    for pattern in pathspec.patterns or ['.']:
+        if is_literal(pattern) and isdir(pattern) and not args.r:
+            exit("fatal: not removing '%s' recursively without -r"
+                 % pattern.rstrip('/'))
+        if not Pathspec([pattern]).select(index.paths()):
+            exit("fatal: pathspec '%s' did not match any files" % pattern)
+    for path in pathspec.select(index.paths()):
+        index.remove(path)
         try:
-            with open(lgit_path + '/.lgit/index', 'rb+') as index:
-                content_index = index.readlines()
-                index.seek(0)
-                added = False
-                for line in content_index:
-                    # If the file was added:
-                    if line.endswith((a_file + '\n').encode()):
-                        # Update field 1:
-                        index.write(timestamp.encode())
-                        # Update field 2:
-                        index.seek(42, 1)
-                        index.write(hash_value.encode())
-                        added = True
-                    else:
-                        # Move the pointer to next line:
-                        index.seek(len(line), 1)
-                if not added:
-                    empty_hash = ' ' * 40
-                    line_index = '%s %s %s %s %s\n' % (
-                        timestamp, hash_value, hash_value, empty_hash, a_file)
-                    index.write(line_index.encode())
-        except PermissionError:
+            unlink(path)
+        except FileNotFoundError:
             pass
-
-    def _get_all_files_add(list_files):
-        """Get all files to add.
-
-        Args:
-            list_files: List of file can be added.
-
-        Returns: List of files to add.
-
-        """
-        file_paths = []
-        if '.' in list_files or '*' in list_files:
-            file_paths = get_files_skip_lgit()
-        else:
-            for file in list_files:
-                if isfile(file):
-                    file_paths.append(file)
-                elif isdir(file):
-                    files_add_dir = get_files_skip_lgit(file)
-                    for path in files_add_dir:
-                        file_paths.append(join(file, path))
-        return file_paths
-
-    list_files_add = _get_all_files_add(args.files)
-    for file_path in list_files_add:
-        sha1_value = hashing_sha1_file(file_path)
-        _add_file_to_lgit_database(file_path, sha1_value)
-        _update_index(file_path, sha1_value)
-
-
-def execute_lgit_rm(args, lgit_path):
-    """Remove a file from the working directory and the index."""
-
-    def _remove_file_index(a_file):
-        """Remove the information of the tracked a_file.
-
-        Args:
-            a_file: The tracked file.
-
-        Returns:
-            True/False: if a_file exist in the index file.
-
-        """
-        content_index = read_file(lgit_path + '/.lgit/index').split('\n')
-        had_file = False
-        for line in content_index:
-            if line.endswith(a_file):
-                # Remove the index of file:
-                content_index.remove(line)
-                had_file = True
-        write_file(lgit_path + '/.lgit/index', '\n'.join(content_index))
-        return had_file
-
-    for file in args.files:
-        if isdir(file):
-            exit("fatal: not removing '%s' recursively" % file)
-        if exists(file):
-            if _remove_file_index(file):
-                unlink(file)
-            else:
-                exit("fatal: pathspec '%s' did not match any files" % file)
-        else:
-            exit("fatal: pathspec '%s' did not match any files" % file)
+    index.flush()
 
 
 def config_lgit(args, lgit_path):
@@ -164,73 +103,26 @@ def config_lgit(args, lgit_path):
 
 def execute_lgit_commit(args, lgit_path):
     """Create a commit with the changes currently staged."""
-    timestamp_now, ms_timestamp_now = get_timestamp_of_current_time()
-
-    def _create_commit_object(message):
-        """Create the commit object when commit the changes."""
-        # Get the author name for the commits:
-        author = read_file(lgit_path + '/.lgit/config').strip('\n')
-        # If the config file is empty:
-        if not author:
-            exit()
-        try:
-            with open(lgit_path + '/.lgit/commits/%s' % ms_timestamp_now,
-                      'w') as commit:
-                # Write file in the commits directory:
-                commit.write(
-                    '%s\n%s\n\n%s\n\n' % (author, timestamp_now, message))
-        except PermissionError:
-            pass
-
-    def _update_index_and_snapshot():
-        """Update the index file and create snapshots."""
-        try:
-            with open(lgit_path + '/.lgit/index', 'rb+') as index, open(
-                    lgit_path + '/.lgit/snapshots/%s' % ms_timestamp_now,
-                    'ab+') as snapshot:
-                content_index = index.readlines()
-                index.seek(0)
-                for line in content_index:
-                    hash_value = line[56:96]
-                    file_path = line[138:]
-                    # Update the snapshot for the file:
-                    snapshot.write(hash_value + b' ' + file_path)
-                    # Update the field 3:
-                    index.seek(97, 1)
-                    index.write(hash_value)
-                    # Move the pointer to next line:
-                    index.seek(len(line) - 137, 1)
-        except PermissionError:
-            pass
-
-    def _update_branch_head():
-        """Update the head of the current branch."""
-        branch = get_current_branch(lgit_path + '/.lgit/HEAD')
-        try:
-            with open(lgit_path + '/.lgit/refs/heads/%s' % branch,
-                      'w') as file:
-                file.write(ms_timestamp_now)
-        except PermissionError:
-            pass
-
     # If the command 'add' has been never called:
-    if not stat(lgit_path + '/.lgit/index').st_size:
+    if not Index.load(lgit_path):
         display_lgit_status(args, lgit_path)  # Show untracked files.
-    else:
-        _create_commit_object(args.m)
-        _update_index_and_snapshot()
-        _update_branch_head()
+        return
+    try:
+        Repository(lgit_path).commit(args.m)
+    except LgitError as error:
+        exit(str(error))
 
 
 def display_lgit_status(args, lgit_path):
     """Show the working tree status."""
 
+    index = Index.load(lgit_path)
+
     def _print_status_header():
         """Print the header of the status."""
         print('On branch master')
         # If the command 'add' has been never called:
-        if args.command == 'commit' and not stat(lgit_path +
-                                                 '/.lgit/index').st_size:
+        if args.command == 'commit' and not index:
             print('\nInitial commit\n')
         # If the command 'commit' has been never called:
         if args.command == 'status' and not listdir(lgit_path +
@@ -274,80 +166,155 @@ def display_lgit_status(args, lgit_path):
         print('\nnothing added to commit but untracked files present (use '
               '"./lgit.py add" to track)')
 
-    def _update_index(file):
-        """Update the index of the file in the working directory.
-
-        Returns: Index of line that contains the information of file.
-        """
-        content_index = read_file(lgit_path + '/.lgit/index').split('\n')
-        hash_value = hashing_sha1_file(file)
-        timestamp, _ = get_timestamp_of_current_time()
-        try:
-            with open(lgit_path + '/.lgit/index', 'rb+') as index:
-                current_line = None
-                for line in content_index:
-                    if line[138:] == file:
-                        current_line = '%s %s %s' % (timestamp, hash_value,
-                                                     line[56:])
-                        index.write((timestamp + ' ' + hash_value).encode())
-                        break
-                    else:
-                        index.seek(len(line) + 1, 1)
-            return current_line
-        except PermissionError:
-            pass
-
-    def _classify_files():
-        """Classify files in the working directory to 3 groups."""
-        list_files = get_files_skip_lgit()
-        untracked_files = []
-        files_to_be_committed = []
-        files_not_staged_for_commit = []
-        for file in list_files:
-            info_file = _update_index(file)
-            if info_file:
-                if info_file[56:96] != info_file[15:55]:
-                    files_not_staged_for_commit.append(file)
-                if info_file[97:137] != info_file[56:96]:
-                    files_to_be_committed.append(file)
-            else:
-                untracked_files.append(file)
-        return (untracked_files, files_to_be_committed,
-                files_not_staged_for_commit)
-
     _print_status_header()
-    untracked, to_be_committed, not_staged_for_commit = _classify_files()
-    if to_be_committed:
-        _report_changes_to_be_committed(to_be_committed)
-    if not_staged_for_commit:
-        _report_changes_not_staged_for_commit(not_staged_for_commit)
-    if untracked:
-        _report_untracked_files(untracked)
+    status = Repository(lgit_path).status(getattr(args, 'paths', ()))
+    if status.to_be_committed:
+        _report_changes_to_be_committed(status.to_be_committed)
+    if status.not_staged:
+        _report_changes_not_staged_for_commit(status.not_staged)
+    if status.untracked:
+        _report_untracked_files(status.untracked)
 
 
 def list_lgit_files(args, lgit_path):
     """Show information about files in the index and the working tree."""
-    content_index = read_file(lgit_path + '/.lgit/index').split('\n')
-    list_files = []
-    for line in content_index:
-        list_files.append(line[138:])
-    for file in sorted(list_files):
-        if file != '':
-            print(file)
+    for path in Repository(lgit_path).ls_files(args.paths):
+        print(path)
 
 
 def show_lgit_log(args, lgit_path):
-    """Show the commit history."""
-
-    def _display_commit(file):
-        """Display each commit."""
-        content = read_file(lgit_path + '/.lgit/commits/%s' % file).split('\n')
-        print('commit ' + file)
-        print('Author: ' + content[0])
-        print('Date: ' + get_readable_date(file), end='\n\n')
-        print('    %s\n' % content[3])
-
-    list_commits = listdir(lgit_path + '/.lgit/commits')
-    list_commits.sort(reverse=True)
-    for commit in list_commits:
-        _display_commit(commit)
+    """Show the commit history of the current branch."""
+    for commit in Repository(lgit_path).log(args.max_count, args.paths):
+        print('commit ' + commit.id)
+        print('Author: ' + commit.author)
+        print('Date: ' + get_readable_date(commit.id), end='\n\n')
+        print('    %s\n' % commit.message)
+
+
+def show_lgit_diff(args, lgit_path):
+    """Show the changes between the working tree, the index and commits."""
+
+    def _read_contents(hash_value, path, in_working_directory):
+        """Read a version of a file, None for no file.
+
+        Only the files whose SHA1s differ are read, but each of them is
+        read whole: the line diff needs all the lines of both versions,
+        so a file is compared in memory, like git does.
+        """
+        if hash_value is None:
+            return None
+        if in_working_directory:
+            with open(lgit_path + '/' + path, 'rb') as file:
+                return file.read()
+        return read_object(lgit_path, hash_value)
+
+    try:
+        for change in Repository(lgit_path).diff(args.commits, args.cached):
+            for line in iter_unified_diff(
+                    change.path, _read_contents(change.old_hash, change.path,
+                                                False),
+                    _read_contents(change.new_hash, change.path,
+                                   change.in_working_directory),
+                    change.old_hash, change.new_hash):
+                print(line)
+    except LgitError as error:
+        exit(str(error))
+
+
+def execute_lgit_gc(args, lgit_path):
+    """Pack the objects of the lgit database into a single pack.
+
+    With --prune, the unreachable objects and commits older than the grace
+    period are deleted first (see prune.py); with --dry-run, they are only
+    counted.
+    """
+
+    def _find_delta_bases():
+        """Pair each version of a file with its previous version.
+
+        Returns:
+            An ordered dictionary of SHA1 -> SHA1 of the previous version
+                of the same file, in the order the versions appeared.
+        """
+        versions = {}  # The last version of each file.
+        delta_bases = OrderedDict()
+        seen = set()
+
+        def _add_version(hash_value, file_name):
+            previous = versions.get(file_name)
+            versions[file_name] = hash_value
+            # Only the first time a blob is seen, so there is no cycle:
+            if hash_value not in seen:
+                seen.add(hash_value)
+                if previous is not None and previous != hash_value:
+                    delta_bases[hash_value] = previous
+
+        previous = None
+        for snapshot in sorted(listdir(lgit_path + '/.lgit/snapshots')):
+            # Only the files changed since the previous snapshot:
+            for file_name, _, hash_value in diff_snapshots(
+                    lgit_path, previous, snapshot):
+                if hash_value:
+                    _add_version(hash_value, file_name)
+            previous = snapshot
+        for entry in Index.load(lgit_path):
+            _add_version(entry.staged_hash, entry.path)
+        return delta_bases
+
+    if args.depth < 0:
+        exit('fatal: invalid delta depth: %d' % args.depth)
+    if args.grace_period < 0:
+        exit('fatal: invalid grace period: %d' % args.grace_period)
+    garbage_commits, garbage_objects = {}, {}
+    if args.prune or args.dry_run:
+        garbage_commits, garbage_objects = find_garbage(lgit_path,
+                                                        args.grace_period)
+        reclaimed = (sum(garbage_commits.values()) +
+                     sum(garbage_objects.values()))
+        print('%s %d objects and %d commits (%d bytes)' % (
+            'Would prune' if args.dry_run else 'Pruning',
+            len(garbage_objects), len(garbage_commits), reclaimed))
+        if args.dry_run:
+            return
+        remove_commits(lgit_path, garbage_commits)
+    with span('find delta bases'):
+        delta_bases = _find_delta_bases()
+    count, deltas = repack_objects(lgit_path, delta_bases, args.depth,
+                                   garbage_objects)
+    with span('write commit-graph'):
+        write_commit_graph(lgit_path)
+    with span('pack refs'):
+        pack_refs(lgit_path)
+    write_path_history(lgit_path)
+    print('Total %d (delta %d)' % (count, deltas))
+
+
+def execute_lgit_pack_refs(args, lgit_path):
+    """Move the refs of the branches into the packed-refs file."""
+    pack_refs(lgit_path)
+
+
+def execute_lgit_rebuild_path_history(args, lgit_path):
+    """Index again the files changed by every commit."""
+    print('Indexed %d commits' % write_path_history(lgit_path))
+
+
+def execute_lgit_fsmonitor(args, lgit_path):
+    """Start, stop or show the watcher of the working directory."""
+    status = get_fsmonitor_status(lgit_path)
+    if args.action == 'start':
+        if status is not None:
+            exit('fatal: fsmonitor is already running (%s)' %
+                 status['watcher'])
+        if not start_fsmonitor(lgit_path, args.poll):
+            exit('fatal: fsmonitor did not start')
+        print('fsmonitor is watching %s (%s)' % (
+            lgit_path, get_fsmonitor_status(lgit_path)['watcher']))
+    elif args.action == 'stop':
+        if not stop_fsmonitor(lgit_path):
+            exit('fatal: fsmonitor is not running')
+    elif status is None:
+        print('fsmonitor is not running')
+    else:
+        print('fsmonitor is watching %s (%s, %d changed paths)' % (
+            lgit_path, status['watcher'], status['changes']))
@@ -0,0 +1,267 @@
+"""Read and write the commit objects and the commit-graph.
+
+A commit object (.lgit/commits/<commit>) contains the author name, the time
+of the commit, a line 'parent <commit>' for each parent commit, an empty
+line and the commit message. The commits of the first versions of lgit
+have no parent line: their parent is the commit made just before them.
+
+The commit-graph (.lgit/commit-graph) keeps the ancestry of all the commits
+in a single file, so the history is walked without opening the commits:
+
+    header:     'LCGR', version and number of commits (2 unsigned 32-bit)
+    commits:    sorted by name, the name of the commit (21 bytes), its date
+                    (signed 64-bit, seconds since the epoch), its generation
+                    number (1 for a commit without parent, else 1 more than
+                    its highest parent) and the positions of its first 2
+                    parents in the file (unsigned 32-bit, NO_PARENT if none)
+
+All integers are big-endian.
+"""
+from collections import namedtuple
+from datetime import datetime
+from heapq import heapify, heappop, heappush
+from mmap import ACCESS_READ, mmap
+from os import listdir, replace
+from os.path import exists
+from struct import Struct
+
+from functions import LgitError, read_file, write_file
+
+GRAPH_SIGNATURE = b'LCGR'
+GRAPH_VERSION = 1
+GRAPH_HEADER = Struct('>4sII')
+GRAPH_ENTRY = Struct('>21sqIII')
+NO_PARENT = 0xffffffff
+
+Commit = namedtuple('Commit', 'id author timestamp parents message')
+
+
+def read_commit(lgit_path, commit_id):
+    """Read a commit object.
+
+    Returns:
+        The Commit, its parents are the ones written in the commit object.
+    """
+    content = read_file(lgit_path + '/.lgit/commits/%s' % commit_id) or ''
+    header, _, message = content.partition('\n\n')
+    lines = header.split('\n')
+    parents = [line[7:] for line in lines[2:] if line.startswith('parent ')]
+    return Commit(commit_id, lines[0], lines[1] if len(lines) > 1 else '',
+                  parents, message.rstrip('\n'))
+
+
+def write_commit(lgit_path, commit):
+    """Write a commit object and add it to the commit-graph."""
+    parents = ''.join('parent %s\n' % parent for parent in commit.parents)
+    write_file(lgit_path + '/.lgit/commits/%s' % commit.id,
+               '%s\n%s\n%s\n%s\n\n' % (commit.author, commit.timestamp,
+                                       parents, commit.message))
+    add_to_commit_graph(lgit_path, commit.id, commit.parents)
+
+
+def _get_date(commit_id):
+    """Get the date (seconds since the epoch) of a commit from its name."""
+    return int(datetime.strptime(commit_id[:14], '%Y%m%d%H%M%S').timestamp())
+
+
+class CommitGraph:
+    """The commit-graph of a lgit directory, mapped in memory."""
+
+    def __init__(self, lgit_path):
+        self.file_name = lgit_path + '/.lgit/commit-graph'
+        self.map = None
+        self.count = 0
+        if not exists(self.file_name):
+            write_commit_graph(lgit_path)
+        with open(self.file_name, 'rb') as graph:
+            self.map = mmap(graph.fileno(), 0, access=ACCESS_READ)
+        signature, version, self.count = GRAPH_HEADER.unpack_from(self.map)
+        if signature != GRAPH_SIGNATURE or version != GRAPH_VERSION:
+            self.close()
+            raise LgitError('fatal: commit-graph file corrupt')
+
+    def close(self):
+        """Unmap the commit-graph."""
+        self.map.close()
+
+    def _entry(self, position):
+        """Get (name, date, generation, parent positions) of a commit."""
+        commit_id, date, generation, *parents = GRAPH_ENTRY.unpack_from(
+            self.map, GRAPH_HEADER.size + position * GRAPH_ENTRY.size)
+        return (commit_id.decode(), date, generation,
+                [parent for parent in parents if parent != NO_PARENT])
+
+    def find(self, commit_id):
+        """Find the position of a commit, or None if it isn't in the graph."""
+        key = commit_id.encode()
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = GRAPH_HEADER.size + middle * GRAPH_ENTRY.size
+            current = self.map[start:start + 21]
+            if current == key:
+                return middle
+            if current < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def get(self, commit_id):
+        """Get the ancestry of a commit.
+
+        Returns:
+            (date, generation, names of the parents) of the commit, or None
+                if it isn't in the graph.
+        """
+        position = self.find(commit_id)
+        if position is None:
+            return None
+        _, date, generation, parents = self._entry(position)
+        return date, generation, [self._entry(parent)[0]
+                                  for parent in parents]
+
+    def last(self):
+        """Get (name, generation) of the last commit of the graph."""
+        if not self.count:
+            return None, 0
+        commit_id, _, generation, _ = self._entry(self.count - 1)
+        return commit_id, generation
+
+
+def write_commit_graph(lgit_path):
+    """Write the commit-graph with all the commits of the lgit directory."""
+    commits = sorted(listdir(lgit_path + '/.lgit/commits'))
+    positions = {commit_id: i for i, commit_id in enumerate(commits)}
+    generations = []
+    entries = []
+    previous = None
+    for commit_id in commits:
+        parents = read_commit(lgit_path, commit_id).parents
+        if not parents and previous:
+            parents = [previous]  # A commit of the first versions of lgit.
+        parent_positions = [positions[parent] for parent in parents
+                            if parent in positions][:2]
+        generations.append(1 + max((generations[parent]
+                                    for parent in parent_positions),
+                                   default=0))
+        parent_positions += [NO_PARENT] * (2 - len(parent_positions))
+        entries.append(GRAPH_ENTRY.pack(commit_id.encode(),
+                                        _get_date(commit_id),
+                                        generations[-1], *parent_positions))
+        previous = commit_id
+    temp_name = lgit_path + '/.lgit/commit-graph.lock'
+    with open(temp_name, 'wb') as graph:
+        graph.write(GRAPH_HEADER.pack(GRAPH_SIGNATURE, GRAPH_VERSION,
+                                      len(entries)))
+        graph.write(b''.join(entries))
+    replace(temp_name, lgit_path + '/.lgit/commit-graph')
+
+
+def add_to_commit_graph(lgit_path, commit_id, parents):
+    """Append a new commit to the commit-graph.
+
+    The commits are named by their time, so a new commit comes last and is
+    appended. The whole graph is written again if it doesn't.
+    """
+    file_name = lgit_path + '/.lgit/commit-graph'
+    if not exists(file_name):
+        write_commit_graph(lgit_path)
+        return
+    graph = CommitGraph(lgit_path)
+    last_commit, _ = graph.last()
+    positions = [graph.find(parent) for parent in parents]
+    if commit_id == last_commit:
+        graph.close()
+        return
+    if (last_commit and commit_id < last_commit) or None in positions:
+        graph.close()
+        write_commit_graph(lgit_path)
+        return
+    generation = 1 + max((graph.get(parent)[1] for parent in parents),
+                         default=0)
+    count = graph.count
+    graph.close()
+    positions = positions[:2] + [NO_PARENT] * (2 - len(positions[:2]))
+    with open(file_name, 'rb+') as file:
+        file.seek(0, 2)
+        file.write(GRAPH_ENTRY.pack(commit_id.encode(), _get_date(commit_id),
+                                    generation, *positions))
+        file.seek(0)
+        file.write(GRAPH_HEADER.pack(GRAPH_SIGNATURE, GRAPH_VERSION,
+                                     count + 1))
+
+
+def iter_history(lgit_path, head):
+    """Yield the names of a commit and its ancestors, newest first.
+
+    The commits are read from the commit-graph one by one, so the walk
+    stops as soon as the caller has enough commits.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        head: The name of the last commit (or None).
+    """
+    if not head:
+        return
+    graph = CommitGraph(lgit_path)
+    seen = {head}
+    queue = [(_newest_first(head), head)]
+    try:
+        while queue:
+            _, commit_id = heappop(queue)
+            yield commit_id
+            ancestry = graph.get(commit_id)
+            if ancestry is None:  # Not in the graph yet.
+                parents = read_commit(lgit_path, commit_id).parents
+            else:
+                parents = ancestry[2]
+            for parent in parents:
+                if parent not in seen:
+                    seen.add(parent)
+                    heappush(queue, (_newest_first(parent), parent))
+    finally:
+        graph.close()
+
+
+def find_merge_base(lgit_path, commit_a, commit_b):
+    """Find the best common ancestor of two commits.
+
+    The commits are visited from the highest generation number down, so a
+    commit is only visited after all its descendants which were reached:
+    the first one reached from both commits is a common ancestor that no
+    other common ancestor descends from. Only the commits newer than the
+    merge base (and the ones of the same generations) are visited.
+
+    Returns:
+        The name of the merge base, or None if the commits are unrelated.
+    """
+    graph = CommitGraph(lgit_path)
+    if graph.find(commit_a) is None or graph.find(commit_b) is None:
+        graph.close()
+        write_commit_graph(lgit_path)
+        graph = CommitGraph(lgit_path)
+    # Whether each commit was reached from commit_a (1), commit_b (2):
+    reached = {commit_a: 1}
+    reached[commit_b] = reached.get(commit_b, 0) | 2
+    queue = [(-graph.get(commit_id)[1], commit_id) for commit_id in reached]
+    heapify(queue)
+    try:
+        while queue:
+            _, commit_id = heappop(queue)
+            if reached[commit_id] == 3:
+                return commit_id
+            for parent in graph.get(commit_id)[2]:
+                if parent not in reached:
+                    reached[parent] = 0
+                    heappush(queue, (-graph.get(parent)[1], parent))
+                reached[parent] |= reached[commit_id]
+    finally:
+        graph.close()
+    return None
+
+
+def _newest_first(commit_id):
+    """Make a key sorting the commits from the newest to the oldest."""
+    seconds, _, microseconds = commit_id.partition('.')
+    return -int(seconds), -int(microseconds or 0)
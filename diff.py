@@ -0,0 +1,219 @@
+"""Compare two versions of a file line by line, in linear space.
+
+The lines are matched with Myers' algorithm in its linear space form: the
+middle snake of the edit graph (the part of a shortest edit script crossed
+by both a forward and a backward search) splits the comparison in two
+smaller ones, which are compared the same way. The memory used is the two
+vectors of the searches, whatever the number of differences, and the
+matches are yielded in order, so the hunks are written as they are found.
+"""
+from itertools import chain
+
+CONTEXT = 3  # The number of unchanged lines around a change in a hunk.
+
+
+def _middle_snake(a, a_low, a_high, b, b_low, b_high):
+    """Find the middle snake of a comparison.
+
+    a[a_low:a_high] and b[b_low:b_high] must differ at their first and at
+    their last line.
+
+    Returns:
+        The start (x, y) and the end (u, v) of the snake, relative to
+            a_low and b_low: a[a_low + x:a_low + u] equals
+            b[b_low + y:b_low + v].
+    """
+    n = a_high - a_low
+    m = b_high - b_low
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2
+    offset = max_d + 1
+    forward = [0] * (2 * offset + 1)  # The furthest x on each diagonal.
+    backward = [0] * (2 * offset + 1)  # The same, from the end.
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] <
+                           forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a_low + x] == b[b_low + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            # If the forward path reaches the backward one on diagonal k:
+            if odd and -d < delta - k < d and (
+                    x + backward[offset + delta - k] >= n):
+                return start_x, start_y, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] <
+                           backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and (
+                    a[a_high - 1 - x] == b[b_high - 1 - y]):
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            # If the backward path reaches the forward one on diagonal k:
+            if not odd and -d <= delta - k <= d and (
+                    x + forward[offset + delta - k] >= n):
+                return n - x, m - y, n - start_x, m - start_y
+    raise AssertionError('no middle snake')  # Only for different inputs.
+
+
+def iter_matches(a, b):
+    """Yield the runs of lines kept from a to b, in order.
+
+    Args:
+        a, b: The lists of lines (any comparable and hashable items).
+
+    Yields:
+        (i, j, length): a[i:i + length] equals b[j:j + length].
+    """
+    # Compare small integers instead of lines:
+    numbers = {}
+    a = [numbers.setdefault(line, len(numbers)) for line in a]
+    b = [numbers.setdefault(line, len(numbers)) for line in b]
+    # A stack of comparisons (a_low, a_high, b_low, b_high) and of matches
+    # (i, j, length) still to yield, the next one at the end:
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if len(item) == 3:
+            if item[2]:
+                yield item
+            continue
+        a_low, a_high, b_low, b_high = item
+        prefix = 0
+        while (a_low + prefix < a_high and b_low + prefix < b_high and
+               a[a_low + prefix] == b[b_low + prefix]):
+            prefix += 1
+        suffix = 0
+        while (a_low + prefix < a_high - suffix and
+               b_low + prefix < b_high - suffix and
+               a[a_high - 1 - suffix] == b[b_high - 1 - suffix]):
+            suffix += 1
+        stack.append((a_high - suffix, b_high - suffix, suffix))
+        a_high -= suffix
+        b_high -= suffix
+        if a_low + prefix < a_high and b_low + prefix < b_high:
+            x, y, u, v = _middle_snake(a, a_low + prefix, a_high,
+                                       b, b_low + prefix, b_high)
+            x += a_low + prefix
+            u += a_low + prefix
+            y += b_low + prefix
+            v += b_low + prefix
+            stack.append((u, a_high, v, b_high))
+            stack.append((x, y, u - x))
+            stack.append((a_low + prefix, x, b_low + prefix, y))
+        if prefix:
+            yield a_low, b_low, prefix
+
+
+def iter_changes(a, b):
+    """Yield the regions which differ between two lists of lines.
+
+    Yields:
+        (a_low, a_high, b_low, b_high): a[a_low:a_high] was replaced by
+            b[b_low:b_high] (one of them may be empty).
+    """
+    i = j = 0
+    for next_i, next_j, length in chain(iter_matches(a, b),
+                                        [(len(a), len(b), 0)]):
+        if next_i > i or next_j > j:
+            yield i, next_i, j, next_j
+        i, j = next_i + length, next_j + length
+
+
+def iter_hunks(a, b, context=CONTEXT):
+    """Yield the hunks of a unified diff, as the changes are found.
+
+    Yields:
+        (a_start, a_count, b_start, b_count, lines): the hunk replaces
+            a_count lines of a from a_start (from 0) by b_count lines of b
+            from b_start; the lines are (' ', '-' or '+', line).
+    """
+    group = []  # The changes close enough to be in the same hunk.
+    for change in chain(iter_changes(a, b), [None]):
+        if change is not None and (
+                not group or change[0] - group[-1][1] <= 2 * context):
+            group.append(change)
+            continue
+        if group:
+            a_start = max(group[0][0] - context, 0)
+            b_start = group[0][2] - (group[0][0] - a_start)
+            a_end = min(group[-1][1] + context, len(a))
+            b_end = group[-1][3] + (a_end - group[-1][1])
+            lines = []
+            position = a_start
+            for a_low, a_high, b_low, b_high in group:
+                lines += [(' ', line) for line in a[position:a_low]]
+                lines += [('-', line) for line in a[a_low:a_high]]
+                lines += [('+', line) for line in b[b_low:b_high]]
+                position = a_high
+            lines += [(' ', line) for line in a[position:a_end]]
+            yield (a_start, a_end - a_start, b_start, b_end - b_start,
+                   lines)
+        group = [change]
+
+
+def _format_range(start, count):
+    """Format the range of a hunk like 'diff -u' does."""
+    if count == 1:
+        return '%d' % (start + 1)
+    if count == 0:
+        return '%d,0' % start
+    return '%d,%d' % (start + 1, count)
+
+
+def iter_unified_diff(path, old_contents, new_contents, old_hash=None,
+                      new_hash=None, context=CONTEXT):
+    """Yield the lines of the diff of a file, in git's format.
+
+    Args:
+        path: The pathname of the file.
+        old_contents, new_contents: The contents (bytes) of the versions,
+            None for no file.
+        old_hash, new_hash: The SHA1s of the versions, if known.
+    """
+    yield 'diff --git a/%s b/%s' % (path, path)
+    if old_contents is None:
+        yield 'new file'
+    elif new_contents is None:
+        yield 'deleted file'
+    if old_hash or new_hash:
+        yield 'index %s..%s' % ((old_hash or '0' * 40)[:7],
+                                (new_hash or '0' * 40)[:7])
+    # An empty file is still a file:
+    old_name = '/dev/null' if old_contents is None else 'a/' + path
+    new_name = '/dev/null' if new_contents is None else 'b/' + path
+    old_contents = old_contents or b''
+    new_contents = new_contents or b''
+    if b'\0' in old_contents or b'\0' in new_contents:
+        yield 'Binary files %s and %s differ' % (old_name, new_name)
+        return
+    old_lines = old_contents.splitlines(keepends=True)
+    new_lines = new_contents.splitlines(keepends=True)
+    header = False
+    for a_start, a_count, b_start, b_count, lines in iter_hunks(
+            old_lines, new_lines, context):
+        if not header:
+            yield '--- %s' % old_name
+            yield '+++ %s' % new_name
+            header = True
+        yield '@@ -%s +%s @@' % (_format_range(a_start, a_count),
+                                 _format_range(b_start, b_count))
+        for tag, line in lines:
+            text = line.decode(errors='replace')
+            if text.endswith('\n'):
+                yield tag + text[:-1]
+            else:
+                yield tag + text
+                yield '\\ No newline at end of file'
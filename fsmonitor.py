@@ -0,0 +1,453 @@
+"""Watch the working directory, so commands only look at changed paths.
+
+'lgit fsmonitor start' runs a watcher in the background. It is told of the
+changes in the working directory by inotify, or finds them by comparing the
+stat data of the whole tree where inotify isn't available (or with --poll).
+Each batch of changes is numbered, and the commands ask the watcher over a
+unix socket (.lgit/fsmonitor.sock) for the paths changed since a token:
+
+    request:    a JSON object on one line, {"command": "query", "token":
+                    <token of the last query or null>}, {"command":
+                    "status"} or {"command": "stop"}
+    reply:      a JSON object on one line, for a query {"token": <new
+                    token>, "paths": <list of pathnames or null>}
+
+A pathname ending with '/' stands for a directory and everything in it
+(created, removed or renamed), the other ones for a file or a directory
+whose content changed. The paths are null when the watcher can't tell what
+changed since the token (it was restarted, its queue overflowed...), then
+the whole tree has to be checked.
+
+The token of the last query is kept in the index, so a command that asked
+for the changes has to check all of them before the index is written.
+"""
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from errno import ENOENT, ENOTDIR
+from json import dumps, loads
+from os import (O_RDWR, _exit, chdir, close, dup2, fork, fsdecode, getpid,
+                open as open_fd, read, scandir, setsid, stat, strerror,
+                unlink)
+from os.path import relpath
+from selectors import EVENT_READ, DefaultSelector
+from socket import AF_UNIX, SOCK_STREAM, socket
+from struct import Struct
+from time import sleep, time_ns
+
+from functions import BUF_SIZE
+from tracing import traced
+
+SOCKET_NAME = '.lgit/fsmonitor.sock'
+CLIENT_TIMEOUT = 5  # Seconds to wait for an answer of the watcher.
+START_TIMEOUT = 10  # Seconds to wait for a new watcher to listen.
+CHECK_INTERVAL = 60  # Seconds between the checks that .lgit still exists.
+MAX_CHANGES = 1000000  # More changed paths and the whole tree is checked.
+
+# See inotify(7):
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_EXCL_UNLINK = 0x4000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR |
+              IN_EXCL_UNLINK)
+LINK_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+EVENT = Struct('iIII')  # wd, mask, cookie, length of the name
+
+
+def _list_directory(directory):
+    """Get the entries of a directory, without the .lgit directory."""
+    with scandir(directory or '.') as entries:
+        return [entry for entry in entries
+                if directory or entry.name != '.lgit']
+
+
+def _join(directory, name):
+    """Get the pathname of a file in a directory ('' for the top)."""
+    return directory + '/' + name if directory else name
+
+
+class InotifyWatcher:
+    """Watch every directory of the working tree with inotify.
+
+    Raises:
+        OSError: inotify isn't available, or there are too many directories
+            to watch (see /proc/sys/fs/inotify/max_user_watches).
+    """
+
+    name = 'inotify'
+
+    def __init__(self):
+        libc = CDLL(find_library('c'), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except AttributeError:
+            raise OSError('inotify is not available')
+        if self.fd < 0:
+            raise OSError(get_errno(), strerror(get_errno()))
+        self.directories = {}  # The directory of each watch descriptor.
+        try:
+            self._watch_tree('')
+        except OSError:
+            close(self.fd)
+            raise
+
+    def close(self):
+        """Stop watching."""
+        close(self.fd)
+
+    def _watch_tree(self, top):
+        """Watch a directory and all its subdirectories."""
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            wd = self._add_watch(self.fd, (directory or '.').encode(),
+                                 WATCH_MASK)
+            if wd < 0:
+                error = get_errno()
+                if error not in (ENOENT, ENOTDIR):
+                    raise OSError(error, strerror(error), directory)
+                continue  # Removed in the meantime, an event will tell.
+            self.directories[wd] = directory
+            try:
+                entries = _list_directory(directory)
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+            stack.extend(_join(directory, entry.name) for entry in entries
+                         if entry.is_dir(follow_symlinks=False))
+
+    def _unwatch_tree(self, top):
+        """Stop watching a directory (renamed away) and its subdirectories."""
+        for wd, directory in list(self.directories.items()):
+            if directory == top or directory.startswith(top + '/'):
+                self._rm_watch(self.fd, wd)
+                del self.directories[wd]
+
+    def read_changes(self):
+        """Read all the events already queued.
+
+        Returns:
+            The list of the changed paths, or None if some were lost.
+        """
+        changes = []
+        overflow = False
+        while True:
+            try:
+                data = read(self.fd, BUF_SIZE)
+            except BlockingIOError:  # No more events.
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                start = offset + EVENT.size
+                name = fsdecode(data[start:start + length].rstrip(b'\0'))
+                offset = start + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_IGNORED:  # The directory is no longer watched.
+                    self.directories.pop(wd, None)
+                    continue
+                directory = self.directories.get(wd)
+                if directory is None or (not directory and name == '.lgit'):
+                    continue
+                path = _join(directory, name)
+                if not mask & IN_ISDIR:
+                    changes.append(path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path)
+                    changes.append(path + '/')
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._unwatch_tree(path)
+                    changes.append(path + '/')
+                if mask & LINK_EVENTS:  # The directory listing changed.
+                    changes.append(directory)
+        return None if overflow else changes
+
+
+class PollingWatcher:
+    """Find the changes by comparing the stat data of the whole tree.
+
+    This is as slow as checking the tree in the command itself, it is only
+    there so the commands work the same where inotify isn't available.
+    """
+
+    name = 'polling'
+    fd = None
+
+    def __init__(self):
+        self.files, self.directories = self._scan()
+
+    def close(self):
+        """Stop watching."""
+
+    @staticmethod
+    def _scan():
+        """Get the stat data of all the files and directories."""
+        files = {}
+        directories = {}
+        stack = ['']
+        while stack:
+            directory = stack.pop()
+            try:
+                directories[directory] = stat(directory or '.').st_mtime_ns
+                entries = _list_directory(directory)
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+            for entry in entries:
+                path = _join(directory, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                    continue
+                try:
+                    file_stat = entry.stat()
+                except OSError:  # A broken symbolic link.
+                    file_stat = entry.stat(follow_symlinks=False)
+                files[path] = (file_stat.st_mtime_ns, file_stat.st_size,
+                               file_stat.st_ino, file_stat.st_ctime_ns)
+        return files, directories
+
+    def read_changes(self):
+        """Scan the tree again.
+
+        Returns:
+            The list of the paths changed since the last scan.
+        """
+        files, directories = self._scan()
+        changes = [path for path in self.files.keys() | files.keys()
+                   if self.files.get(path) != files.get(path)]
+        for directory in self.directories.keys() | directories.keys():
+            if (directory not in self.directories or
+                    directory not in directories):
+                changes.append(directory + '/')
+            if self.directories.get(directory) != directories.get(directory):
+                changes.append(directory)
+        self.files, self.directories = files, directories
+        return changes
+
+
+class FSMonitor:
+    """The watcher process: number the changes and answer the queries."""
+
+    def __init__(self, poll=False):
+        self.watcher = None
+        if not poll:
+            try:
+                self.watcher = InotifyWatcher()
+            except OSError:
+                pass
+        if self.watcher is None:
+            self.watcher = PollingWatcher()
+        self.instance = '%x.%x' % (getpid(), time_ns())
+        self.sequence = 0
+        self.reset = 0  # The changes before it were forgotten.
+        self.changes = {}  # The sequence of the last change of each path.
+        self.selector = DefaultSelector()
+
+    def update(self):
+        """Record the changes the watcher has seen."""
+        try:
+            changes = self.watcher.read_changes()
+        except OSError:  # Too many directories for inotify now.
+            self.selector.unregister(self.watcher.fd)
+            self.watcher.close()
+            self.watcher = PollingWatcher()
+            changes = None
+        self.sequence += 1
+        if changes is None or len(self.changes) + len(changes) > MAX_CHANGES:
+            self.changes.clear()
+            self.reset = self.sequence
+            return
+        for path in changes:
+            self.changes[path] = self.sequence
+
+    def query(self, token):
+        """Get the paths changed since a token (see the module docstring)."""
+        self.update()
+        instance, _, sequence = (token or '').partition(':')
+        paths = None
+        if instance == self.instance and int(sequence) >= self.reset:
+            paths = sorted(path for path, changed in self.changes.items()
+                           if changed > int(sequence))
+        return {'token': '%s:%d' % (self.instance, self.sequence),
+                'paths': paths}
+
+    def serve(self):
+        """Answer the commands until asked to stop."""
+        server = socket(AF_UNIX, SOCK_STREAM)
+        try:
+            unlink(SOCKET_NAME)
+        except FileNotFoundError:
+            pass
+        server.bind(SOCKET_NAME)
+        server.listen()
+        socket_inode = stat(SOCKET_NAME).st_ino
+        self.selector.register(server, EVENT_READ)
+        if self.watcher.fd is not None:
+            self.selector.register(self.watcher.fd, EVENT_READ)
+        running = True
+        while running:
+            for key, _ in self.selector.select(CHECK_INTERVAL):
+                if key.fileobj is server:
+                    running = self._answer(server.accept()[0]) and running
+                elif self.watcher.fd is not None:
+                    self.update()  # Keep the queue of inotify short.
+            try:
+                running = running and (stat(SOCKET_NAME).st_ino ==
+                                       socket_inode)
+            except FileNotFoundError:  # .lgit (or the socket) was removed.
+                running = False
+        self.watcher.close()
+        server.close()
+        try:
+            if stat(SOCKET_NAME).st_ino == socket_inode:
+                unlink(SOCKET_NAME)
+        except FileNotFoundError:
+            pass
+
+    def _answer(self, connection):
+        """Answer a request.
+
+        Returns:
+            False if the watcher was asked to stop, else True.
+        """
+        with connection:
+            connection.settimeout(CLIENT_TIMEOUT)
+            try:
+                request = loads(_receive_line(connection))
+                command = request.get('command')
+                if command == 'query':
+                    reply = self.query(request.get('token'))
+                elif command == 'status':
+                    reply = {'watcher': self.watcher.name,
+                             'changes': len(self.changes)}
+                else:
+                    reply = {}
+                connection.sendall(dumps(reply).encode() + b'\n')
+            except (OSError, ValueError, AttributeError):
+                return True
+        return command != 'stop'
+
+
+def _receive_line(connection):
+    """Receive bytes from a socket up to the end of a line."""
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = connection.recv(BUF_SIZE)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _request(lgit_path, request):
+    """Send a request to the watcher of a lgit directory.
+
+    Returns:
+        The reply, or None if no watcher is running.
+    """
+    client = socket(AF_UNIX, SOCK_STREAM)
+    client.settimeout(CLIENT_TIMEOUT)
+    try:
+        # Unix socket names are short, a relative one fits more often:
+        client.connect(relpath(lgit_path + '/' + SOCKET_NAME))
+        client.sendall(dumps(request).encode() + b'\n')
+        return loads(_receive_line(client))
+    except (OSError, ValueError):
+        return None
+    finally:
+        client.close()
+
+
+def get_fsmonitor_status(lgit_path):
+    """Get the status of the watcher, or None if no watcher is running."""
+    return _request(lgit_path, {'command': 'status'})
+
+
+def start_fsmonitor(lgit_path, poll=False):
+    """Start a watcher in the background.
+
+    Returns:
+        True if the watcher is running, False if it didn't start in time.
+    """
+    if fork() == 0:
+        # Detach from the terminal, the watcher outlives the command:
+        setsid()
+        null = open_fd('/dev/null', O_RDWR)
+        for fd in range(3):
+            dup2(null, fd)
+        try:
+            chdir(lgit_path)
+            FSMonitor(poll).serve()
+        finally:
+            _exit(0)
+    for _ in range(START_TIMEOUT * 10):
+        if get_fsmonitor_status(lgit_path) is not None:
+            return True
+        sleep(0.1)
+    return False
+
+
+def stop_fsmonitor(lgit_path):
+    """Stop the watcher.
+
+    Returns:
+        True/False: if a watcher was running.
+    """
+    return _request(lgit_path, {'command': 'stop'}) is not None
+
+
+class ChangedPaths:
+    """The paths the watcher reported changed since the last query."""
+
+    def __init__(self, paths):
+        self.paths = {path for path in paths if not path.endswith('/')}
+        self.prefixes = tuple(path for path in paths if path.endswith('/'))
+
+    def __contains__(self, path):
+        return path in self.paths or path.startswith(self.prefixes)
+
+    def directory_changed(self, directory):
+        """Check if files were created/removed/renamed in a directory."""
+        return (directory in self.paths or
+                (directory + '/').startswith(self.prefixes))
+
+
+@traced('query fsmonitor')
+def query_changed_paths(lgit_path, index, complete=True):
+    """Ask the watcher for the paths changed since the token of the index.
+
+    The new token is set in the index: the caller has to check all the
+    changed paths before it flushes the index.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        index: The Index.
+        complete: False if the caller only checks some of the paths (like
+            'lgit status <pathspec>'): the token is kept, so the next query
+            reports the changed paths again.
+
+    Returns:
+        The ChangedPaths, or None if every path has to be checked.
+    """
+    reply = _request(lgit_path, {'command': 'query',
+                                 'token': index.fsmonitor_token})
+    token = reply and reply.get('token')
+    if complete and token != index.fsmonitor_token:
+        index.fsmonitor_token = token
+        index.changed = True
+    if reply is None or reply.get('paths') is None:
+        return None
+    return ChangedPaths(reply['paths'])
@@ -1,10 +1,54 @@
 """Make some useful functions for the main program."""
 from datetime import datetime
+from fcntl import ioctl
 from hashlib import sha1
-from os import getcwd, makedirs, walk
-from os.path import isdir, isfile, dirname, join, getmtime, relpath
+from os import (SEEK_SET, fchmod, fstat, getcwd, lseek, makedirs, sendfile,
+                stat, umask)
+from os.path import isdir, isfile, dirname
+from tempfile import NamedTemporaryFile
+
+from tracing import count, traced
+
+try:
+    from os import copy_file_range
+except ImportError:  # Before Python 3.8, or not on Linux.
+    copy_file_range = None
 
 BUF_SIZE = 65536  # Let's read stuff in 64Kb chunks!
+EMPTY_HASH = ' ' * 40
+EMPTY_STAT = (0, 0, 0, 0)
+HEX_DIGITS = set('0123456789abcdef')
+FICLONE = 0x40049409  # The ioctl sharing the blocks of a file (reflink).
+COPY_SIZE = 1 << 30  # The most bytes copied by the kernel at once.
+
+
+class LgitError(Exception):
+    """A lgit command failed."""
+
+
+def _read_umask():
+    """Get the umask of the process (it is only read by setting it)."""
+    mask = umask(0o022)
+    umask(mask)
+    return mask
+
+
+UMASK = _read_umask()  # Read once, before any command starts threads.
+
+
+def create_temp_file(directory, prefix, mode=0o666):
+    """Create a temporary file, kept when it is closed.
+
+    NamedTemporaryFile creates the file with the mode 0600, which replace()
+    would keep: the file gets mode less the umask instead, like open().
+
+    Returns:
+        The file, open to write bytes.
+    """
+    temp = NamedTemporaryFile('wb', dir=directory, prefix=prefix,
+                              delete=False)
+    fchmod(temp.fileno(), mode & ~UMASK)
+    return temp
 
 
 def read_file(file_name):
@@ -19,6 +63,7 @@ def read_file(file_name):
     try:
         with open(file_name, 'r') as file:
             content = file.read()
+        count('bytes_read', len(content))
         return content
     except (PermissionError, FileNotFoundError):
         pass
@@ -42,6 +87,7 @@ def write_file(file_name, content):
     try:
         with open(file_name, 'w') as file:
             file.write(content)
+        count('bytes_written', len(content))
     except PermissionError:
         pass
 
@@ -63,6 +109,7 @@ def find_lgit_directory():
     return None
 
 
+@traced('hash file')
 def hashing_sha1_file(path_file):
     """Hashing a file with SHA1.
 
@@ -77,7 +124,9 @@ def hashing_sha1_file(path_file):
                 data = file.read(BUF_SIZE)
                 if not data:  # end of file reached
                     break
+                count('bytes_read', len(data))
                 sha1_hash.update(data)
+        count('files_hashed')
         return sha1_hash.hexdigest()
     except (PermissionError, FileNotFoundError):
         pass
@@ -93,10 +142,61 @@ def format_mtime(path_file):
         The formatted timestamp of the file's modification time
             represent year, month, day, hour, minute and second.
     """
-    timestamp = datetime.fromtimestamp(getmtime(path_file))
+    return format_timestamp(stat(path_file).st_mtime_ns)
+
+
+def format_timestamp(time_ns):
+    """Convert a time in nanoseconds to a formatted string.
+
+    Args:
+        time_ns: The time since the epoch in nanoseconds.
+
+    Returns:
+        The formatted timestamp represent year, month, day, hour, minute
+            and second.
+    """
+    timestamp = datetime.fromtimestamp(time_ns // 10**9)
     return timestamp.strftime('%Y%m%d%H%M%S')
 
 
+def get_stat_data(path_file):
+    """Get the stat data used to detect changes of a file without hashing it.
+
+    Args:
+        path_file: The file to be stat'ed.
+
+    Returns:
+        A tuple (mtime in ns, size, inode, ctime in ns), or None if the file
+            can not be stat'ed.
+    """
+    count('files_stated')
+    try:
+        info = stat(path_file)
+    except (PermissionError, FileNotFoundError):
+        return None
+    return info.st_mtime_ns, info.st_size, info.st_ino, info.st_ctime_ns
+
+
+def is_stat_clean(stat_data, current_stat, index_mtime_ns):
+    """Check if a file can be trusted unchanged from its stat data.
+
+    A file modified in the same second as the index was written is "racy":
+    a later change within that second may keep the very same stat data, so
+    it must be hashed again until the index is written at a later time.
+
+    Args:
+        stat_data: The stat data recorded in the index.
+        current_stat: The stat data of the file in the working directory.
+        index_mtime_ns: The modification time of the index file in ns.
+
+    Returns:
+        True if the file doesn't need to be hashed again.
+    """
+    if stat_data == EMPTY_STAT or stat_data != current_stat:
+        return False
+    return current_stat[0] // 10**9 < index_mtime_ns // 10**9
+
+
 def get_timestamp_of_current_time():
     """Get the timestamp of the current time.
 
@@ -112,49 +212,86 @@ def get_timestamp_of_current_time():
     return timestamp, ms_timestamp
 
 
+def _copy_in_kernel(source_fd, destination_fd):
+    """Copy a file with copy_file_range(), or sendfile() if the kernel or
+    the file systems can't, so the data never goes through Python.
+
+    Returns: The number of bytes copied.
+
+    Raises:
+        OSError: Neither can copy these files.
+    """
+    copy_range = copy_file_range
+    offset = 0
+    while True:
+        try:
+            if copy_range:
+                copied = copy_range(source_fd, destination_fd, COPY_SIZE,
+                                    offset, offset)
+            else:
+                lseek(destination_fd, offset, SEEK_SET)
+                copied = sendfile(destination_fd, source_fd, offset,
+                                  COPY_SIZE)
+        except OSError:
+            # If copy_file_range() fails (across file systems on old
+            # kernels...), sendfile() goes on from the same offset:
+            if copy_range is None:
+                raise
+            copy_range = None
+            continue
+        if not copied:  # end of file reached
+            return offset
+        offset += copied
+
+
+def copy_file_data(source, destination):
+    """Copy the contents of an open file into another (empty) open file.
+
+    The blocks of the source are shared with the destination (a reflink)
+    if the file system can, else the kernel copies them; the contents are
+    only read and written by Python if the kernel can't copy them.
+
+    Returns: The number of bytes copied.
+    """
+    destination.flush()
+    size = fstat(source.fileno()).st_size
+    try:
+        ioctl(destination.fileno(), FICLONE, source.fileno())
+        count('bytes_cloned', size)
+        return size
+    except OSError:
+        pass
+    try:
+        copied = _copy_in_kernel(source.fileno(), destination.fileno())
+        count('bytes_copied', copied)
+        return copied
+    except OSError:
+        pass
+    source.seek(0)
+    destination.seek(0)
+    destination.truncate()
+    copied = 0
+    while True:
+        data = source.read(BUF_SIZE)
+        if not data:  # end of file reached
+            break
+        destination.write(data)
+        copied += len(data)
+    count('bytes_read', copied)
+    count('bytes_written', copied)
+    return copied
+
+
+@traced('copy file')
 def copy_file_to_another(source, destination):
     """Copy the contents of source file to destination."""
     try:
         with open(source, 'rb') as src, open(destination, 'wb+') as dst:
-            while True:
-                data = src.read(BUF_SIZE)
-                if not data:  # end of file reached
-                    break
-                dst.write(data)
+            copy_file_data(src, dst)
     except (PermissionError, FileNotFoundError):
         pass
 
 
-def get_files_skip_lgit(directory='.'):
-    """ Get all files in a directory.
-
-    This function will generate the file names in a directory
-    tree by walking the tree either top-down. For each directory
-    in the tree rooted at directory top (including top itself),
-    it yields a 3-tuple (dirpath, dirnames, filenames).
-
-    Args:
-        directory: The directory tree to get files.
-
-    Returns:
-        The list of file in a directory tree (skip .lgit directory).
-    """
-    file_paths = []  # List which will store all of the relative filepath.
-
-    # Walk the tree.
-    for root, dirs, files in walk(directory, topdown=True):
-        dirs[:] = [d for d in dirs if d != '.lgit']
-        for file_name in files:
-            rel_dir = relpath(root, directory)
-            if rel_dir == '.':
-                rel_file = file_name
-            else:
-                # Join the two strings in order to form the relative filepath:
-                rel_file = join(rel_dir, file_name)
-            file_paths.append(rel_file)  # Add it to the list.
-    return sorted(file_paths)  # Self-explanatory.
-
-
 def get_readable_date(timestamp):
     """Format the timestamp to a human-readable date.
 
@@ -170,12 +307,3 @@ def get_readable_date(timestamp):
     second = int(timestamp[12:14])
     return datetime(year, month, day, hour, minute,
                     second).strftime('%a %b %d %H:%M:%S %Y')
-
-
-def get_current_branch(head_file):
-    """Get the current lgit branch from head_file
-
-    Returns: Name of the current lgit branch.
-    """
-    content_head = read_file(head_file)
-    return content_head.strip('\n').split('/')[-1]
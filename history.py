@@ -0,0 +1,225 @@
+"""Find the commits which changed a file without reading every snapshot.
+
+.lgit/path-history lists, for each pathname, the commits which changed it,
+sorted by pathname, after a header with the number of commits indexed:
+
+    # path-history <number of commits>
+    <pathname>\t<commit> <commit> ...
+    ...
+
+A commit changed a file if the file differs between its snapshot and the
+snapshot of each of its parents: a merge only changed the files which
+differ from both sides (the commits of the merged branch changed the
+others). The line of a file is found with a binary search on the mapped
+file, the lines of a directory are the range which follows it.
+
+A new commit is appended to .lgit/path-history-log, a line with its name
+then a line '\t<pathname>' for each file it changed, so a commit costs the
+files it changed. When the log grows over LOG_SIZE bytes, it is merged
+into path-history. If the number of commits indexed doesn't match the
+commit-graph (commits made by older versions of lgit, pruned commits),
+path-history is written again from all the snapshots, as 'lgit
+rebuild-path-history' (and 'lgit gc') does.
+"""
+from collections import defaultdict
+from mmap import ACCESS_READ, mmap
+from os import listdir, replace, unlink
+
+from commits import CommitGraph
+from functions import read_file, write_file
+from tracing import count, traced
+from trees import diff_snapshots
+
+HISTORY_HEADER = '# path-history %d\n'
+LOG_SIZE = 64 * 1024
+
+
+def _find_changed_paths(lgit_path, commit, parents):
+    """Get the set of the files changed by a commit."""
+    if not parents:
+        return {path for path, _, _ in diff_snapshots(lgit_path, None,
+                                                      commit)}
+    changed_paths = None
+    for parent in parents:
+        paths = {path for path, _, _ in diff_snapshots(lgit_path, parent,
+                                                       commit)}
+        changed_paths = (paths if changed_paths is None
+                         else changed_paths & paths)
+    return changed_paths
+
+
+def _read_log(lgit_path):
+    """Read the commits appended to path-history-log.
+
+    Returns:
+        The list of (commit, list of the files it changed).
+    """
+    commits = []
+    for line in (read_file(lgit_path + '/.lgit/path-history-log')
+                 or '').split('\n'):
+        if line.startswith('\t'):
+            commits[-1][1].append(line[1:])
+        elif line:
+            commits.append((line, []))
+    return commits
+
+
+def _write_history(lgit_path, history, commit_count):
+    """Write path-history and remove path-history-log.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        history: A dictionary of pathname -> list of commits.
+        commit_count: The number of commits indexed.
+    """
+    temp_name = lgit_path + '/.lgit/path-history.lock'
+    write_file(temp_name, HISTORY_HEADER % commit_count + ''.join(
+        '%s\t%s\n' % (path, ' '.join(sorted(commits)))
+        for path, commits in sorted(history.items(),
+                                    key=lambda item: item[0].encode())))
+    replace(temp_name, lgit_path + '/.lgit/path-history')
+    try:
+        unlink(lgit_path + '/.lgit/path-history-log')
+    except FileNotFoundError:
+        pass
+
+
+def _read_history(lgit_path):
+    """Read the whole path-history.
+
+    Returns:
+        A dictionary of pathname -> list of commits, and the number of
+            commits indexed.
+    """
+    content = read_file(lgit_path + '/.lgit/path-history') or ''
+    header, _, body = content.partition('\n')
+    history = {}
+    for line in body.split('\n'):
+        if line:
+            path, _, commits = line.partition('\t')
+            history[path] = commits.split(' ')
+    return history, _parse_header(header)
+
+
+def _parse_header(header):
+    """Get the number of commits of the header of path-history."""
+    try:
+        return int(header.rpartition(' ')[2])
+    except ValueError:
+        return 0
+
+
+@traced('write path-history')
+def write_path_history(lgit_path):
+    """Index the files changed by every commit.
+
+    Returns:
+        The number of commits indexed.
+    """
+    history = defaultdict(list)
+    graph = CommitGraph(lgit_path)
+    try:
+        commits = sorted(listdir(lgit_path + '/.lgit/commits'))
+        for commit in commits:
+            ancestry = graph.get(commit)
+            parents = ancestry[2] if ancestry else []
+            for path in _find_changed_paths(lgit_path, commit, parents):
+                history[path].append(commit)
+    finally:
+        graph.close()
+    _write_history(lgit_path, history, len(commits))
+    return len(commits)
+
+
+def add_to_path_history(lgit_path, commit, parents):
+    """Index the files changed by a new commit.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        commit: The name of the commit, whose snapshot is written.
+        parents: The names of its parents.
+    """
+    changed_paths = _find_changed_paths(lgit_path, commit, parents)
+    with open(lgit_path + '/.lgit/path-history-log', 'a') as log:
+        log.write(commit + '\n' + ''.join(
+            '\t%s\n' % path for path in sorted(changed_paths)))
+        size = log.tell()
+    if size > LOG_SIZE:
+        history, commit_count = _read_history(lgit_path)
+        log_commits = _read_log(lgit_path)
+        for log_commit, paths in log_commits:
+            for path in paths:
+                history.setdefault(path, []).append(log_commit)
+        _write_history(lgit_path, history, commit_count + len(log_commits))
+
+
+def _find_line(data, start, key):
+    """Find the first line of a sorted range whose pathname isn't lower.
+
+    Args:
+        data: The mapped path-history.
+        start: The offset of the first line after the header.
+        key: The pathname (bytes).
+
+    Returns:
+        The offset of the line (the size of data if there is none).
+    """
+    low, high = start, len(data)
+    while low < high:
+        # The start of the line around the middle, not before low:
+        middle = data.rfind(b'\n', low, (low + high) // 2) + 1 or low
+        end = data.find(b'\n', middle)
+        count('path_history_lines_read')
+        if data[middle:data.find(b'\t', middle, end)] < key:
+            low = end + 1
+        else:
+            high = middle
+    return low
+
+
+def find_path_commits(lgit_path, paths):
+    """Find the commits which changed files or anything in directories.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        paths: The pathnames of the files and directories.
+
+    Returns:
+        The set of the commits.
+    """
+    file_name = lgit_path + '/.lgit/path-history'
+    log_commits = _read_log(lgit_path)
+    graph = CommitGraph(lgit_path)
+    commit_count = graph.count
+    graph.close()
+    try:
+        with open(file_name, 'rb') as history:
+            commit_count -= _parse_header(history.readline().decode())
+    except FileNotFoundError:
+        commit_count = None
+    # If commits are missing from the index, or were pruned:
+    if commit_count != len(log_commits):
+        write_path_history(lgit_path)
+        log_commits = []
+    commits = set()
+    with open(file_name, 'rb') as history:
+        data = mmap(history.fileno(), 0, access=ACCESS_READ)
+    with data:
+        start = data.find(b'\n') + 1
+        for path in paths:
+            key = path.encode()
+            offset = _find_line(data, start, key)
+            # The file, then 'path.txt' or the like, then 'path/...':
+            while offset < len(data):
+                end = data.find(b'\n', offset)
+                line_path, _, line_commits = data[offset:end].partition(b'\t')
+                if line_path >= key + b'0':
+                    break
+                if line_path == key or line_path.startswith(key + b'/'):
+                    commits.update(line_commits.decode().split(' '))
+                offset = end + 1
+    for commit, changed_paths in log_commits:
+        if any(changed_path == path or changed_path.startswith(path + '/')
+               for path in paths for changed_path in changed_paths):
+            commits.add(commit)
+    return commits
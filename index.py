@@ -0,0 +1,500 @@
+"""Keep lgit's index in memory, shared by all commands of the process.
+
+The index file is written in a binary format (version 2), sorted by
+pathname:
+
+    header:     'LGIX', version, number of entries (2 unsigned 32-bit
+                    integers) and the SHA1 of everything after the header
+    offsets:    the offset of each entry in the file (unsigned 32-bit)
+    entries:    mtime in ns, size, inode, ctime in ns (4 64-bit integers),
+                    the 3 raw SHA1s (20 bytes each, zeros for no SHA1), the
+                    length of the pathname (unsigned 16-bit) and the pathname
+    extensions: a signature (4 bytes), the size of the data (unsigned
+                    32-bit) and the data. 'TREE' is the cache of the SHA1s
+                    of the tree objects: for each directory whose files
+                    didn't change since its tree was written, the pathname
+                    of the directory, a null byte and the raw SHA1.
+                    'FSMN' is the token of the last query to the file
+                    system monitor (see fsmonitor.py)
+
+All integers are big-endian. The text index of the first versions of lgit
+(one line per file) is still read, and replaced by the binary format the
+next time the index is written.
+"""
+from hashlib import sha1
+from mmap import ACCESS_READ, mmap
+from os import replace, stat
+from os.path import dirname
+from struct import Struct
+
+from functions import (EMPTY_HASH, EMPTY_STAT, HEX_DIGITS, LgitError,
+                       create_temp_file, format_timestamp, get_stat_data,
+                       hashing_sha1_file, is_stat_clean)
+from tracing import count, span, traced
+
+INDEX_SIGNATURE = b'LGIX'
+INDEX_VERSION = 2
+HEADER = Struct('>4sII20s')
+OFFSET = Struct('>I')
+PATH_LENGTH = Struct('>H')
+EXTENSION = Struct('>4sI')
+TREE_SIGNATURE = b'TREE'
+FSMONITOR_SIGNATURE = b'FSMN'
+ENTRY = Struct('>QQQQ20s20s20sH')
+NULL_SHA1 = bytes(20)
+
+
+def _hash_to_raw(hash_value):
+    """Convert a hexadecimal SHA1 (or EMPTY_HASH) to 20 bytes."""
+    if hash_value == EMPTY_HASH:
+        return NULL_SHA1
+    return bytes.fromhex(hash_value)
+
+
+def _raw_to_hash(raw):
+    """Convert 20 bytes to a hexadecimal SHA1 (or EMPTY_HASH)."""
+    if raw == NULL_SHA1:
+        return EMPTY_HASH
+    return raw.hex()
+
+
+class IndexEntry:
+    """The information of a tracked file in the index.
+
+    Attributes:
+        timestamp:      The timestamp of the file in the working directory.
+        working_hash:   The SHA1 of the content in the working directory.
+        staged_hash:    The SHA1 of the file content after it was added.
+        committed_hash: The SHA1 of the file content after it was committed.
+        stat_data:      (mtime in ns, size, inode, ctime in ns) of the file
+                            when working_hash was computed.
+        path:           The file pathname.
+    """
+
+    __slots__ = ('timestamp', 'working_hash', 'staged_hash', 'committed_hash',
+                 'stat_data', 'path')
+
+    def __init__(self, path, hash_value, stat_data,
+                 committed_hash=EMPTY_HASH):
+        self.path = path
+        self.working_hash = self.staged_hash = hash_value
+        self.committed_hash = committed_hash
+        self.set_stat_data(stat_data)
+
+    def set_stat_data(self, stat_data):
+        """Record the stat data (and the timestamp) of the file."""
+        self.stat_data = stat_data or EMPTY_STAT
+        self.timestamp = format_timestamp(self.stat_data[0])
+
+    @classmethod
+    def from_line(cls, line):
+        """Parse a line of the index file.
+
+        Each line is made of the timestamp, the SHA1 of the content in the
+        working directory, the SHA1 of the staged content, the SHA1 of the
+        committed content, the stat data (4 hexadecimal numbers of 16 digits)
+        and the file pathname. The lines written before the stat data was
+        recorded have the pathname right after the third SHA1.
+
+        Args:
+            line: A line of the index file (without the newline).
+
+        Returns:
+            The entry of the line.
+        """
+        stat_fields = line[138:205].split(' ')
+        if len(line) > 206 and len(stat_fields) == 4 and all(
+                len(field) == 16 and set(field) <= HEX_DIGITS
+                for field in stat_fields):
+            stat_data = tuple(int(field, 16) for field in stat_fields)
+            path = line[206:]
+        else:
+            stat_data = EMPTY_STAT
+            path = line[138:]
+        entry = cls(path, line[56:96], stat_data, line[97:137])
+        entry.timestamp = line[:14]
+        entry.working_hash = line[15:55]
+        return entry
+
+    @classmethod
+    def from_bytes(cls, data, offset):
+        """Parse an entry of the binary index.
+
+        Args:
+            data: The content of the index file (bytes or mmap).
+            offset: The offset of the entry in data.
+
+        Returns:
+            The entry at offset.
+        """
+        fields = ENTRY.unpack_from(data, offset)
+        start = offset + ENTRY.size
+        path = bytes(data[start:start + fields[7]]).decode()
+        entry = cls(path, _raw_to_hash(fields[5]), fields[:4],
+                    _raw_to_hash(fields[6]))
+        entry.working_hash = _raw_to_hash(fields[4])
+        return entry
+
+    def to_bytes(self):
+        """Format the entry for the binary index."""
+        path = self.path.encode()
+        return ENTRY.pack(*self.stat_data, _hash_to_raw(self.working_hash),
+                          _hash_to_raw(self.staged_hash),
+                          _hash_to_raw(self.committed_hash), len(path)) + path
+
+    def to_line(self):
+        """Format the entry as a line of the index file (with the newline)."""
+        stat_data = ' '.join('%016x' % number for number in self.stat_data)
+        return '%s %s %s %s %s %s\n' % (
+            self.timestamp, self.working_hash, self.staged_hash,
+            self.committed_hash, stat_data, self.path)
+
+
+class Index:
+    """The staging area, loaded once per process and flushed once.
+
+    The entries are kept in a dictionary keyed by the file pathname, so
+    commands change them in memory and write the index file a single time
+    with flush(), whatever the number of files they touch.
+    """
+
+    _loaded = {}  # The indexes already loaded, by lgit directory.
+
+    def __init__(self, lgit_path):
+        self.file_name = lgit_path + '/.lgit/index'
+        self.entries = {}
+        self.sorted_paths = None  # Sorted when needed, until a file is added.
+        self.cache_tree = {}  # The SHA1 of the tree of each directory.
+        self.fsmonitor_token = None
+        self.changed = False
+        self.mtime_ns = 0
+        # To tell if another process wrote the index since it was read:
+        self.file_stat = get_stat_data(self.file_name)
+        try:
+            self.mtime_ns = stat(self.file_name).st_mtime_ns
+            with open(self.file_name, 'rb') as index:
+                content = index.read()
+        except (PermissionError, FileNotFoundError):
+            return
+        count('bytes_read', len(content))
+        with span('read index'):
+            if content.startswith(INDEX_SIGNATURE):
+                self._read_binary(content)
+            else:
+                self._read_text(content.decode())
+
+    def _read_binary(self, content):
+        """Read the entries of an index in the binary format."""
+        signature, version, entry_count, checksum = HEADER.unpack_from(
+            content)
+        if version != INDEX_VERSION:
+            raise LgitError('fatal: unknown index file version %d'
+                            % version)
+        if sha1(content[HEADER.size:]).digest() != checksum:
+            raise LgitError('fatal: index file corrupt')
+        end = HEADER.size
+        for i in range(entry_count):
+            offset, = OFFSET.unpack_from(content,
+                                         HEADER.size + i * OFFSET.size)
+            entry = IndexEntry.from_bytes(content, offset)
+            self.entries[entry.path] = entry
+            end = offset + ENTRY.size + len(entry.path.encode())
+        while end < len(content):
+            signature, size = EXTENSION.unpack_from(content, end)
+            end += EXTENSION.size
+            if signature == TREE_SIGNATURE:
+                self._read_cache_tree(content[end:end + size])
+            elif signature == FSMONITOR_SIGNATURE:
+                self.fsmonitor_token = content[end:end + size].decode()
+            end += size
+
+    def _read_cache_tree(self, data):
+        """Read the 'TREE' extension of the index."""
+        start = 0
+        while start < len(data):
+            middle = data.index(b'\0', start)
+            directory = data[start:middle].decode()
+            self.cache_tree[directory] = data[middle + 1:middle + 21].hex()
+            start = middle + 21
+
+    def _read_text(self, content):
+        """Read the entries of an index in the text format."""
+        for line in content.split('\n'):
+            if line:
+                entry = IndexEntry.from_line(line)
+                self.entries[entry.path] = entry
+
+    @classmethod
+    def load(cls, lgit_path):
+        """Get the index of the lgit directory, reading it only once.
+
+        Args:
+            lgit_path: The directory that has .lgit directory in it.
+
+        Returns:
+            The Index of that directory.
+        """
+        if lgit_path not in cls._loaded:
+            cls._loaded[lgit_path] = cls(lgit_path)
+        return cls._loaded[lgit_path]
+
+    @classmethod
+    def forget_if_stale(cls, lgit_path):
+        """Forget the loaded index if it no longer matches the index file.
+
+        It happens when the index file was written by another process, or
+        when the index was changed in memory but not flushed. The index is
+        read again by the next load().
+        """
+        index = cls._loaded.get(lgit_path)
+        if index is not None and (
+                index.changed or
+                get_stat_data(index.file_name) != index.file_stat):
+            del cls._loaded[lgit_path]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def __iter__(self):
+        """Iterate over the entries sorted by their pathname."""
+        for path in self.paths():
+            yield self.entries[path]
+
+    def paths(self):
+        """Get the sorted list of the pathnames.
+
+        It is sorted once, and again only after files are added or removed.
+        """
+        if self.sorted_paths is None:
+            self.sorted_paths = sorted(self.entries)
+        return self.sorted_paths
+
+    def get(self, path):
+        """Get the entry of a file, or None if the file isn't tracked."""
+        return self.entries.get(path)
+
+    def touch(self, path):
+        """Mark the staged SHA1 of a file as changed.
+
+        The trees of the directories containing the file have to be
+        written again, the others are still valid.
+        """
+        self.changed = True
+        while path:
+            path = dirname(path)
+            self.cache_tree.pop(path, None)
+
+    def add(self, entry):
+        """Add (or replace) the entry of a file."""
+        if entry.path not in self.entries:
+            self.sorted_paths = None
+        self.entries[entry.path] = entry
+        self.touch(entry.path)
+
+    def remove(self, path):
+        """Remove the entry of a file.
+
+        Returns:
+            True/False: if the file was in the index.
+        """
+        if self.entries.pop(path, None) is None:
+            return False
+        self.sorted_paths = None
+        self.touch(path)
+        return True
+
+    @traced('refresh index')
+    def refresh(self, changed_paths=None, pathspec=None):
+        """Update the working SHA1s of the files changed in the working
+        directory.
+
+        Only the files whose stat data changed since the last refresh are
+        hashed again. A file which is missing gets empty stat data, so it
+        is known missing until it is reported changed.
+
+        Args:
+            changed_paths: The paths reported changed by the file system
+                monitor (see fsmonitor.py), or None to stat every file.
+            pathspec: The Pathspec (see pathspec.py) of the files to
+                refresh, or None for all of them.
+
+        Returns:
+            The entries of the files in the working directory.
+        """
+        if pathspec is None:
+            entries = self
+        else:
+            entries = [self.entries[path]
+                       for path in pathspec.select(self.paths())]
+        present_entries = []
+        for entry in entries:
+            if changed_paths is not None and entry.path not in changed_paths:
+                if entry.stat_data != EMPTY_STAT:
+                    present_entries.append(entry)
+                continue
+            file_stat = get_stat_data(entry.path)
+            if file_stat is None:  # The file was removed.
+                if entry.stat_data != EMPTY_STAT:
+                    entry.set_stat_data(None)
+                    self.changed = True
+                continue
+            present_entries.append(entry)
+            if is_stat_clean(entry.stat_data, file_stat, self.mtime_ns):
+                continue
+            entry.working_hash = hashing_sha1_file(entry.path)
+            entry.set_stat_data(file_stat)
+            # Write the index again so this file will not be racy anymore:
+            self.changed = True
+        return present_entries
+
+    def clear(self):
+        """Remove all the entries."""
+        self.entries.clear()
+        self.sorted_paths = None
+        self.cache_tree.clear()
+        self.changed = True
+
+    def to_bytes(self):
+        """Format the whole index in the binary format."""
+        entries = [entry.to_bytes() for entry in self]
+        offsets = []
+        offset = HEADER.size + OFFSET.size * len(entries)
+        for entry in entries:
+            offsets.append(OFFSET.pack(offset))
+            offset += len(entry)
+        cache_tree = b''.join(
+            directory.encode() + b'\0' + bytes.fromhex(hash_value)
+            for directory, hash_value in sorted(self.cache_tree.items()))
+        extensions = []
+        if cache_tree:
+            extensions.append(EXTENSION.pack(TREE_SIGNATURE,
+                                             len(cache_tree)) + cache_tree)
+        if self.fsmonitor_token:
+            token = self.fsmonitor_token.encode()
+            extensions.append(EXTENSION.pack(FSMONITOR_SIGNATURE,
+                                             len(token)) + token)
+        body = b''.join(offsets + entries + extensions)
+        return HEADER.pack(INDEX_SIGNATURE, INDEX_VERSION, len(entries),
+                           sha1(body).digest()) + body
+
+    def flush(self):
+        """Write the index file if it was changed.
+
+        The entries are written in a temporary file which then replaces the
+        index file, so the index is never left half-written.
+        """
+        if not self.changed:
+            return
+        try:
+            temp = create_temp_file(dirname(self.file_name), 'index.')
+        except PermissionError:
+            return
+        with span('write index', entries=len(self.entries)), temp:
+            content = self.to_bytes()
+            temp.write(content)
+        replace(temp.name, self.file_name)
+        self.file_stat = get_stat_data(self.file_name)
+        count('index_rewrites')
+        count('bytes_written', len(content))
+        self.mtime_ns = self.file_stat[0]
+        self.changed = False
+
+
+class IndexMap:
+    """A read-only view of a binary index file, mapped in memory.
+
+    Only the pathnames that are asked for are read: the offsets table is
+    sorted by pathname, so a file is found with a binary search. The
+    checksum isn't verified here, it is when the whole index is loaded.
+    """
+
+    def __init__(self, file_name):
+        self.map = None
+        self.count = 0
+        with open(file_name, 'rb') as index:
+            if stat(file_name).st_size < HEADER.size:
+                return
+            self.map = mmap(index.fileno(), 0, access=ACCESS_READ)
+        signature, version, self.count, _ = HEADER.unpack_from(self.map)
+        if signature != INDEX_SIGNATURE or version != INDEX_VERSION:
+            self.close()
+            raise ValueError('not a binary index: %s' % file_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Unmap the index file."""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.count = 0
+
+    def _offset(self, position):
+        """Get the offset of the entry at position (in pathname order)."""
+        return OFFSET.unpack_from(self.map,
+                                  HEADER.size + position * OFFSET.size)[0]
+
+    def _path_at(self, offset):
+        """Get the pathname (as bytes) of the entry at offset."""
+        start = offset + ENTRY.size
+        length, = PATH_LENGTH.unpack_from(self.map, start - 2)
+        return self.map[start:start + length]
+
+    def paths(self, low=0, high=None):
+        """Yield the pathnames of the index, sorted.
+
+        Args:
+            low, high: The positions of the first pathname and after the
+                last one (by default all of them).
+        """
+        for position in range(low, self.count if high is None else high):
+            yield self._path_at(self._offset(position)).decode()
+
+    def bisect(self, path):
+        """Get the position of the first pathname not lower than path."""
+        key = path.encode()
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._path_at(self._offset(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+def list_index_paths(lgit_path, pathspec=None):
+    """Get the sorted pathnames of the index without parsing every entry.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        pathspec: The Pathspec (see pathspec.py) of the files to list, or
+            None for all of them. Only the pathnames in the ranges of its
+            prefixes are read.
+
+    Returns:
+        The list of the tracked files.
+    """
+    if lgit_path not in Index._loaded:
+        try:
+            with IndexMap(lgit_path + '/.lgit/index') as index_map:
+                if pathspec is None:
+                    return list(index_map.paths())
+                return [path for low, high in pathspec.ranges(
+                            len(index_map), index_map.bisect)
+                        for path in index_map.paths(low, high)
+                        if pathspec.matches(path)]
+        except ValueError:
+            pass
+    paths = Index.load(lgit_path).paths()
+    return list(paths) if pathspec is None else pathspec.select(paths)
@@ -1,19 +1,37 @@
 #!/usr/bin/env python3
 """Code a lightweight version of git."""
 from argparse import ArgumentParser
+from os import environ
+from os.path import join
 
 from branches import (execute_lgit_branch, execute_lgit_checkout,
                       execute_lgit_merge, execute_lgit_stash)
 from commands import (config_lgit, display_lgit_status, execute_lgit_add,
-                      execute_lgit_commit, execute_lgit_init, execute_lgit_rm,
-                      list_lgit_files, show_lgit_log)
-from functions import find_lgit_directory
-
-
-def parse_arguments():
-    """Parse command-line to commands and options of lgit program."""
+                      execute_lgit_commit, execute_lgit_fsmonitor,
+                      execute_lgit_gc, execute_lgit_init,
+                      execute_lgit_pack_refs,
+                      execute_lgit_rebuild_path_history, execute_lgit_rm,
+                      list_lgit_files, show_lgit_diff, show_lgit_log)
+from functions import LgitError, find_lgit_directory
+from objects import DEFAULT_DEPTH
+from prune import DEFAULT_GRACE_PERIOD
+from server import serve_socket, serve_stdin
+from tracing import (DEFAULT_TRACE_FILE, is_tracing, span, start_tracing,
+                     stop_tracing)
+
+
+def parse_arguments(argv=None):
+    """Parse command-line to commands and options of lgit program.
+
+    Args:
+        argv: The arguments to parse, by default the ones of the program.
+    """
     # Create the top-level parser with an useful help messages:
     parser = ArgumentParser()
+    parser.add_argument('--trace', action='store_true',
+                        help='write the timings of the phases of the command '
+                        'and its I/O counters in $LGIT_TRACE (default: %s)'
+                        % DEFAULT_TRACE_FILE)
     subparsers = parser.add_subparsers(
         title='These are common lgit commands used',
         dest='command',
@@ -25,10 +43,15 @@ def parse_arguments():
     # Create the parser for the "add" command
     add_parser = subparsers.add_parser('add')
     add_parser.add_argument('files', type=str, nargs='+')
+    add_parser.add_argument('-j', '--jobs', type=int, metavar='<n>',
+                            help='number of files hashed and stored at once '
+                            '(default: depends on the number of cores)')
 
     # Create the parser for the "rm" command
     rm_parser = subparsers.add_parser('rm')
     rm_parser.add_argument('files', type=str, nargs='+')
+    rm_parser.add_argument('-r', action='store_true',
+                           help='allow recursive removal')
 
     # Create the parser for the "config" command
     config_parser = subparsers.add_parser('config')
@@ -39,13 +62,29 @@ def parse_arguments():
     commit_parser.add_argument('-m', metavar='<msg>', type=str, required=True)
 
     # Create the parser for the "status" command
-    subparsers.add_parser('status')
+    status_parser = subparsers.add_parser('status')
+    status_parser.add_argument('paths', type=str, nargs='*',
+                               metavar='<pathspec>')
 
     # Create the parser for the "ls-files" command
-    subparsers.add_parser('ls-files')
+    ls_files_parser = subparsers.add_parser('ls-files')
+    ls_files_parser.add_argument('paths', type=str, nargs='*',
+                                 metavar='<pathspec>')
 
     # Create the parser for the "log" command
-    subparsers.add_parser('log')
+    log_parser = subparsers.add_parser('log')
+    log_parser.add_argument('-n', '--max-count', type=int, metavar='<n>',
+                            help='limit the number of commits to show')
+    log_parser.add_argument('paths', type=str, nargs='*', metavar='<path>',
+                            help='only show the commits changing these '
+                            'files or directories (after --)')
+
+    # Create the parser for the "diff" command
+    diff_parser = subparsers.add_parser('diff')
+    diff_parser.add_argument('--cached', '--staged', action='store_true',
+                             help='compare the index with the last commit')
+    diff_parser.add_argument('commits', type=str, nargs='*',
+                             metavar='<commit>')
 
     # Create the parser for the "branch" command
     branch_parser = subparsers.add_parser('branch')
@@ -57,18 +96,71 @@ def parse_arguments():
         'branch_name', type=str, nargs='?', default='master')
 
     # Create the parser for the "merge" command
-    subparsers.add_parser('merge')
+    merge_parser = subparsers.add_parser('merge')
+    merge_parser.add_argument('branch_name', type=str)
 
     # Create the parser for the "stash" command
-    subparsers.add_parser('stash')
-
-    return parser.parse_args()
+    stash_parser = subparsers.add_parser('stash')
+    stash_parser.add_argument('action', type=str, nargs='?',
+                              choices=['push', 'pop', 'list'],
+                              default='push')
+
+    # Create the parser for the "gc" command
+    gc_parser = subparsers.add_parser('gc', aliases=['repack'])
+    gc_parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                           metavar='<n>', help='maximum length of a chain of '
+                           'deltas (default: %d)' % DEFAULT_DEPTH)
+    gc_parser.add_argument('--prune', action='store_true',
+                           help='delete the unreachable objects and commits')
+    gc_parser.add_argument('--grace-period', type=int,
+                           default=DEFAULT_GRACE_PERIOD, metavar='<seconds>',
+                           help='keep what is younger than that, reachable '
+                           'or not (default: %d)' % DEFAULT_GRACE_PERIOD)
+    gc_parser.add_argument('-n', '--dry-run', action='store_true',
+                           help='only report what --prune would delete')
+
+    # Create the parser for the "pack-refs" command
+    subparsers.add_parser('pack-refs')
+
+    # Create the parser for the "rebuild-path-history" command
+    subparsers.add_parser('rebuild-path-history')
+
+    # Create the parser for the "fsmonitor" command
+    fsmonitor_parser = subparsers.add_parser('fsmonitor')
+    fsmonitor_parser.add_argument('action', type=str, nargs='?',
+                                  choices=['start', 'stop', 'status'],
+                                  default='status')
+    fsmonitor_parser.add_argument('--poll', action='store_true',
+                                  help='compare the stat data of the tree '
+                                  'instead of using inotify')
+
+    # Create the parser for the "serve" command
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('--socket', type=str, metavar='<path>',
+                              help='read the commands from the clients of '
+                              'a unix socket instead of the standard input')
+
+    return parser.parse_args(argv)
+
+
+def execute_lgit_serve(args, lgit_path):
+    """Run the commands read from the standard input or a unix socket."""
+
+    def _dispatch(argv):
+        """Run a command of the server."""
+        command_args = parse_arguments(argv)
+        if command_args.command == 'serve':
+            exit('fatal: lgit serve is already running')
+        run_command(command_args, lgit_path)
+
+    if args.socket:
+        serve_socket(lgit_path, _dispatch, args.socket)
+    else:
+        serve_stdin(lgit_path, _dispatch)
 
 
-def main():
-    """Execute the main program."""
-    args = parse_arguments()
-    lgit_path = find_lgit_directory()
+def execute_command(args, lgit_path):
+    """Execute a lgit command."""
     if args.command == 'init':
         execute_lgit_init()
     elif lgit_path:
@@ -81,10 +173,17 @@ def main():
             "status": display_lgit_status,
             "ls-files": list_lgit_files,
             "log": show_lgit_log,
+            "diff": show_lgit_diff,
             "branch": execute_lgit_branch,
             "checkout": execute_lgit_checkout,
             "merge": execute_lgit_merge,
-            "stash": execute_lgit_stash
+            "stash": execute_lgit_stash,
+            "gc": execute_lgit_gc,
+            "repack": execute_lgit_gc,
+            "pack-refs": execute_lgit_pack_refs,
+            "rebuild-path-history": execute_lgit_rebuild_path_history,
+            "fsmonitor": execute_lgit_fsmonitor,
+            "serve": execute_lgit_serve
         }
         # Get the function from switcher dictionary:
         switcher[args.command](args, lgit_path)
@@ -92,5 +191,29 @@ def main():
         print('fatal: not a git repository (or any of the parent directories)')
 
 
+def run_command(args, lgit_path):
+    """Execute a lgit command, tracing it if asked.
+
+    A command run by a traced 'lgit serve' is only a span of its trace.
+    """
+    nested = is_tracing()
+    if not nested and (args.trace or environ.get('LGIT_TRACE')):
+        start_tracing(environ.get('LGIT_TRACE') or
+                      join(lgit_path or '.', DEFAULT_TRACE_FILE))
+    try:
+        with span('lgit %s' % args.command):
+            execute_command(args, lgit_path)
+    except LgitError as error:  # From the commands not using Repository.
+        exit(str(error))
+    finally:
+        if not nested:
+            stop_tracing()
+
+
+def main():
+    """Execute the main program."""
+    run_command(parse_arguments(), find_lgit_directory())
+
+
 if __name__ == "__main__":
     main()
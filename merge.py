@@ -0,0 +1,99 @@
+"""Merge the contents of a file changed on two branches (diff3).
+
+The versions of both branches are compared line by line with their common
+version (the base). The regions where the base matches both versions are
+stable; in between, a region changed on a single side takes that side, a
+region changed the same way on both sides is taken once, and anything else
+is a conflict, written between markers:
+
+    <<<<<<< ours
+    (the lines of the current branch)
+    =======
+    (the lines of the merged branch)
+    >>>>>>> theirs
+"""
+from diff import iter_matches
+
+
+def _match_lines(base, other):
+    """Map the lines of base to the lines of other they were kept as.
+
+    Returns:
+        A dictionary of line number in base -> line number in other.
+    """
+    matches = {}
+    for base_start, other_start, size in iter_matches(base, other):
+        for offset in range(size):
+            matches[base_start + offset] = other_start + offset
+    return matches
+
+
+def _with_newline(lines):
+    """Make sure a block of lines ends with a newline (before a marker)."""
+    if lines and not lines[-1].endswith(b'\n'):
+        return lines[:-1] + [lines[-1] + b'\n']
+    return lines
+
+
+def merge_lines(base, ours, theirs, labels=('ours', 'theirs')):
+    """Merge two versions of a text with their common version.
+
+    Args:
+        base, ours, theirs: The contents (bytes) of the versions.
+        labels: The names shown on the conflict markers.
+
+    Returns:
+        The merged contents and the number of conflicts.
+    """
+    base = base.splitlines(keepends=True)
+    ours = ours.splitlines(keepends=True)
+    theirs = theirs.splitlines(keepends=True)
+    ours_matches = _match_lines(base, ours)
+    theirs_matches = _match_lines(base, theirs)
+    # The lines of base kept on both sides, in order:
+    stable = [line for line in range(len(base))
+              if line in ours_matches and line in theirs_matches]
+    merged = []
+    conflicts = 0
+    i = j = k = 0  # The next line of base, ours and theirs.
+    for line in stable + [len(base)]:
+        if line < len(base):
+            next_j, next_k = ours_matches[line], theirs_matches[line]
+        else:
+            next_j, next_k = len(ours), len(theirs)
+        base_block = base[i:line]
+        ours_block, theirs_block = ours[j:next_j], theirs[k:next_k]
+        if ours_block == base_block or ours_block == theirs_block:
+            merged += theirs_block
+        elif theirs_block == base_block:
+            merged += ours_block
+        else:
+            conflicts += 1
+            merged.append(b'<<<<<<< %s\n' % labels[0].encode())
+            merged += _with_newline(ours_block)
+            merged.append(b'=======\n')
+            merged += _with_newline(theirs_block)
+            merged.append(b'>>>>>>> %s\n' % labels[1].encode())
+        if line < len(base):
+            merged.append(base[line])
+        i, j, k = line + 1, next_j + 1, next_k + 1
+    return b''.join(merged), conflicts
+
+
+def merge_contents(base, ours, theirs, labels=('ours', 'theirs')):
+    """Merge two versions of a file with their common version.
+
+    A binary file (with a null byte) isn't merged line by line: it is a
+    conflict unless a single side changed it.
+
+    Returns:
+        The merged contents (None for a binary conflict) and the number of
+            conflicts.
+    """
+    if ours == base or ours == theirs:
+        return theirs, 0
+    if theirs == base:
+        return ours, 0
+    if b'\0' in base + ours + theirs:
+        return None, 1
+    return merge_lines(base, ours, theirs, labels)
@@ -0,0 +1,515 @@
+"""Store and read the file contents in lgit's database.
+
+Each object is stored zlib-compressed in .lgit/objects/xx/yyyy...: its type
+and the length of its contents ('blob 13\\0'), then the contents. Objects
+stored by the first versions of lgit are plain copies of the files, they
+are still read as blobs. 'lgit gc' moves all the objects into a pack (see
+packs.py), which is looked up before the loose objects.
+
+A file bigger than the chunking threshold (see chunks.py) is stored as
+blobs of its chunks, shared by all the files and versions having them,
+and a manifest named like the blob of the whole file would be: its type is
+'chunked' and it lists the SHA1 and size of each chunk ('<SHA1> <size>'
+per line). The manifest is read as the blob of the whole file, streaming
+the chunks.
+
+With LGIT_STORAGE=raw, the blobs are stored uncompressed, like the objects
+of the first versions of lgit: the kernel then copies the files into the
+database and back into the working directory (or the file system shares
+their blocks, see copy_file_data()) instead of Python compressing them.
+Like all the objects (and packs), they are read-only. LGIT_STORAGE=hardlink
+also links them into the working directory instead of copying them: a
+file must then be replaced, not written in place (it is read-only too, but
+not for root), or the object would change with it.
+"""
+from collections import OrderedDict
+from hashlib import sha1
+from os import environ, fstat, link, listdir, replace, rmdir, unlink
+from os.path import basename, dirname, exists
+from zlib import compressobj, decompressobj, error as ZlibError
+
+from chunks import get_chunk_threshold, iter_chunks
+from functions import (BUF_SIZE, LgitError, copy_file_data, create_temp_file,
+                       make_directory)
+from packs import (create_delta, forget_packs, get_packs, remove_pack,
+                   write_pack)
+from tracing import count, traced
+
+COMPRESSION_LEVEL = 1  # Fast, the objects are compressed again in packs.
+OBJECT_TYPES = (b'blob', b'tree', b'commit', b'chunked')
+DEFAULT_DEPTH = 50  # The maximum length of a chain of deltas.
+DELTA_SIZE_LIMIT = 64 * 1024 * 1024  # Bigger blobs are never deltified.
+DELTA_CACHE_OBJECTS = 16  # The blobs kept in memory while packing.
+STORAGE_MODES = ('compressed', 'raw', 'hardlink')
+OBJECT_MODE = 0o444  # The objects never change.
+
+
+def get_storage_mode():
+    """Get how the blobs are stored and restored (see LGIT_STORAGE)."""
+    mode = environ.get('LGIT_STORAGE', 'compressed')
+    return mode if mode in STORAGE_MODES else 'compressed'
+
+
+def get_object_path(lgit_path, hash_value):
+    """Get the path of a loose object in the lgit database."""
+    return '%s/.lgit/objects/%s/%s' % (lgit_path, hash_value[:2],
+                                       hash_value[2:])
+
+
+def _create_temp_object(lgit_path):
+    """Create a temporary file in the lgit database."""
+    return create_temp_file(lgit_path + '/.lgit/objects', 'tmp_obj_',
+                            OBJECT_MODE)
+
+
+def object_exists(lgit_path, hash_value):
+    """Check if an object is in the lgit database (packed or loose)."""
+    for pack in get_packs(lgit_path):
+        if pack.find(hash_value) is not None:
+            return True
+    return exists(get_object_path(lgit_path, hash_value))
+
+
+def _install_object(lgit_path, temp_name, hash_value):
+    """Move a temporary file to the place of the object hash_value."""
+    if object_exists(lgit_path, hash_value):
+        unlink(temp_name)
+    else:
+        make_directory(get_object_path(lgit_path, hash_value)[:-39])
+        replace(temp_name, get_object_path(lgit_path, hash_value))
+
+
+def _store_contents(lgit_path, file, size):
+    """Copy the contents of a file into a temporary blob, hashing them.
+
+    Returns:
+        The SHA1 hash object, the number of bytes read and the temporary
+            file.
+    """
+    sha1_hash = sha1()
+    compressor = compressobj(COMPRESSION_LEVEL)
+    with _create_temp_object(lgit_path) as temp:
+        temp.write(compressor.compress(b'blob %d\0' % size))
+        read_size = 0
+        while True:
+            data = file.read(BUF_SIZE)
+            if not data:  # end of file reached
+                break
+            read_size += len(data)
+            sha1_hash.update(data)
+            temp.write(compressor.compress(data))
+        temp.write(compressor.flush())
+        count('bytes_written', temp.tell())
+    return sha1_hash, read_size, temp
+
+
+def _store_copy(lgit_path, file):
+    """Copy a file into a temporary raw blob in the kernel, then hash it.
+
+    The copy is hashed, not the file, so the SHA1 is the one of the stored
+    contents even if the file changes meanwhile.
+
+    Returns:
+        The SHA1 hash object, the number of bytes copied and the temporary
+            file.
+    """
+    sha1_hash = sha1()
+    with _create_temp_object(lgit_path) as temp:
+        copied = copy_file_data(file, temp)
+    with open(temp.name, 'rb') as copy:
+        while True:
+            data = copy.read(BUF_SIZE)
+            if not data:  # end of file reached
+                break
+            sha1_hash.update(data)
+    return sha1_hash, copied, temp
+
+
+def _store_chunks(lgit_path, file):
+    """Store the chunks of a file, then write its temporary manifest.
+
+    Returns:
+        The SHA1 hash object of the contents, the number of bytes read and
+            the temporary file.
+    """
+    sha1_hash = sha1()
+    read_size = 0
+    lines = []
+    for chunk in iter_chunks(file):
+        read_size += len(chunk)
+        sha1_hash.update(chunk)
+        lines.append(b'%s %d\n' % (store_object(lgit_path, chunk).encode(),
+                                   len(chunk)))
+    count('chunks', len(lines))
+    manifest = b''.join(lines)
+    compressor = compressobj(COMPRESSION_LEVEL)
+    with _create_temp_object(lgit_path) as temp:
+        temp.write(compressor.compress(b'chunked %d\0' % len(manifest)))
+        temp.write(compressor.compress(manifest))
+        temp.write(compressor.flush())
+        count('bytes_written', temp.tell())
+    return sha1_hash, read_size, temp
+
+
+@traced('store file')
+def store_file(lgit_path, file_name):
+    """Hash a file and store its contents as a blob.
+
+    A file bigger than the chunking threshold is stored as chunks and a
+    manifest, hashed while it is read. The other ones are compressed while
+    they are hashed, or, with a raw storage, copied by the kernel then
+    hashed from the copy (which is read back once).
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        file_name: The file to be stored.
+
+    Returns:
+        The SHA1 of the file contents, or None if the file can't be read.
+    """
+    threshold = get_chunk_threshold()
+    raw = get_storage_mode() != 'compressed'
+    try:
+        with open(file_name, 'rb') as file:
+            while True:
+                size = fstat(file.fileno()).st_size
+                if threshold is not None and size > threshold:
+                    sha1_hash, read_size, temp = _store_chunks(lgit_path,
+                                                               file)
+                elif raw:
+                    sha1_hash, read_size, temp = _store_copy(lgit_path, file)
+                else:
+                    sha1_hash, read_size, temp = _store_contents(
+                        lgit_path, file, size)
+                count('bytes_read', read_size)
+                if read_size == size:
+                    break
+                # The file changed while it was read, read it again:
+                unlink(temp.name)
+                file.seek(0)
+    except (PermissionError, FileNotFoundError):
+        return None
+    count('files_hashed')
+    hash_value = sha1_hash.hexdigest()
+    _install_object(lgit_path, temp.name, hash_value)
+    return hash_value
+
+
+def store_object(lgit_path, content, object_type='blob'):
+    """Store contents (bytes) as an object of the lgit database.
+
+    The blobs are named by the SHA1 of their contents, like the files in
+    the index; the other objects by the SHA1 of their header and contents.
+
+    Returns:
+        The SHA1 of the object.
+    """
+    header = b'%s %d\0' % (object_type.encode(), len(content))
+    if object_type == 'blob':
+        hash_value = sha1(content).hexdigest()
+    else:
+        hash_value = sha1(header + content).hexdigest()
+    if not object_exists(lgit_path, hash_value):
+        compressor = compressobj(COMPRESSION_LEVEL)
+        with _create_temp_object(lgit_path) as temp:
+            temp.write(compressor.compress(header))
+            temp.write(compressor.compress(content))
+            temp.write(compressor.flush())
+            count('bytes_written', temp.tell())
+        _install_object(lgit_path, temp.name, hash_value)
+    return hash_value
+
+
+def _iter_decompressed(file, decompressor):
+    """Yield the decompressed data of file, at most BUF_SIZE at once."""
+    data = decompressor.unconsumed_tail or file.read(BUF_SIZE)
+    while data:
+        yield decompressor.decompress(data, BUF_SIZE)
+        data = decompressor.unconsumed_tail or file.read(BUF_SIZE)
+    yield decompressor.flush()
+
+
+def open_object(lgit_path, hash_value, expand_chunks=True):
+    """Open an object of the lgit database to read its contents.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        hash_value: The SHA1 of the object.
+        expand_chunks: If a manifest is read as the blob of its chunks,
+            else as a 'chunked' object.
+
+    Returns:
+        The type of the object, its size and an iterator over its contents
+            (chunks of at most BUF_SIZE bytes).
+
+    Raises:
+        FileNotFoundError: The object isn't in the lgit database.
+    """
+    object_type, size, chunks = _open_stored_object(lgit_path, hash_value)
+    if object_type != 'chunked' or not expand_chunks:
+        return object_type, size, chunks
+    entries = _parse_manifest(b''.join(chunks))
+    return ('blob', sum(size for _, size in entries),
+            _iter_manifest(lgit_path, entries))
+
+
+def _parse_manifest(manifest):
+    """Get the (SHA1, size) of the chunks listed in a manifest."""
+    entries = []
+    for line in manifest.decode().split('\n'):
+        if line:
+            hash_value, size = line.split(' ')
+            entries.append((hash_value, int(size)))
+    return entries
+
+
+def _iter_manifest(lgit_path, entries):
+    """Yield the contents of the chunks of a manifest, in order."""
+    for hash_value, _ in entries:
+        yield from open_object(lgit_path, hash_value)[2]
+
+
+def read_manifest(lgit_path, hash_value):
+    """Read the chunks of an object, if it is a manifest.
+
+    Returns:
+        The list of the (SHA1, size) of the chunks, or None if the object
+            isn't a manifest.
+    """
+    for pack in get_packs(lgit_path):
+        offset = pack.find(hash_value)
+        if offset is not None:
+            if pack.type_at(offset) != 'chunked':
+                return None
+            break
+    object_type, _, chunks = _open_stored_object(lgit_path, hash_value)
+    if object_type != 'chunked':
+        chunks.close()
+        return None
+    return _parse_manifest(b''.join(chunks))
+
+
+def _read_loose_header(file):
+    """Read the header of a loose object.
+
+    Returns:
+        The type of the object, its size, the decompressor and the data
+            decompressed after the header; or None if the object is raw
+            (uncompressed).
+    """
+    data = file.read(BUF_SIZE)
+    decompressor = decompressobj()
+    try:
+        head = decompressor.decompress(data, BUF_SIZE)
+    except ZlibError:
+        head = b''
+    object_type, _, size = head.partition(b'\0')[0].partition(b' ')
+    if b'\0' not in head or object_type not in OBJECT_TYPES:
+        return None
+    return (object_type.decode(), int(size), decompressor,
+            head[head.index(b'\0') + 1:])
+
+
+def _open_stored_object(lgit_path, hash_value):
+    """Open an object as it is stored (see open_object)."""
+    for pack in get_packs(lgit_path):
+        offset = pack.find(hash_value)
+        if offset is not None:
+            return pack.open_at(offset)
+    file = open(get_object_path(lgit_path, hash_value), 'rb')
+    header = _read_loose_header(file)
+    if header is None:
+        # An uncompressed object (raw storage, or the first versions of
+        # lgit):
+        file.seek(0)
+        return 'blob', fstat(file.fileno()).st_size, _iter_file(file)
+    object_type, size, decompressor, start = header
+    chunks = _iter_decompressed(file, decompressor)
+    return object_type, size, _iter_chunks(file, [start], chunks)
+
+
+def _find_raw_object(lgit_path, hash_value):
+    """Get the path of an object if it is loose and uncompressed, or None.
+    """
+    for pack in get_packs(lgit_path):
+        if pack.find(hash_value) is not None:
+            return None
+    path = get_object_path(lgit_path, hash_value)
+    try:
+        with open(path, 'rb') as file:
+            if _read_loose_header(file) is None:
+                return path
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def _iter_file(file):
+    """Yield the contents of file by chunks, then close it."""
+    with file:
+        while True:
+            data = file.read(BUF_SIZE)
+            if not data:  # end of file reached
+                break
+            yield data
+
+
+def _iter_chunks(file, *iterables):
+    """Yield the non-empty chunks of iterables, then close file."""
+    with file:
+        for iterable in iterables:
+            for chunk in iterable:
+                if chunk:
+                    yield chunk
+
+
+def read_object(lgit_path, hash_value):
+    """Read the whole contents (bytes) of an object."""
+    return b''.join(open_object(lgit_path, hash_value)[2])
+
+
+@traced('copy object to file')
+def copy_object_to_file(lgit_path, hash_value, destination):
+    """Write the contents of an object into destination.
+
+    The object is found first, then written in a temporary file beside
+    destination, which it replaces: destination is left as it was if the
+    object is missing or corrupt, and is never written in place (it may be
+    a link to an object, see LGIT_STORAGE). A raw object is linked (with
+    the hardlink storage) or copied by the kernel.
+
+    Raises:
+        LgitError: The object is missing or corrupt.
+    """
+    mode = get_storage_mode()
+    raw_path = mode != 'compressed' and _find_raw_object(lgit_path,
+                                                         hash_value)
+    chunks = None
+    if not raw_path:
+        try:
+            chunks = open_object(lgit_path, hash_value)[2]
+        except FileNotFoundError:
+            raise LgitError('fatal: unable to read %s (%s)'
+                            % (hash_value, destination))
+    directory = dirname(destination) or '.'
+    prefix = '.%s.' % basename(destination)
+    try:
+        temp = create_temp_file(directory, prefix)
+    except PermissionError:
+        return
+    if raw_path and mode == 'hardlink':
+        # The temporary file only reserves a name for the link:
+        temp.close()
+        unlink(temp.name)
+        try:
+            link(raw_path, temp.name)
+        except OSError:  # Another file system...
+            temp = create_temp_file(directory, prefix)
+        else:
+            replace(temp.name, destination)
+            return
+    with temp:
+        try:
+            if raw_path:
+                with open(raw_path, 'rb') as source:
+                    copy_file_data(source, temp)
+            else:
+                for chunk in chunks:
+                    temp.write(chunk)
+                    count('bytes_written', len(chunk))
+        except (FileNotFoundError, ZlibError):  # A chunk, a delta base...
+            unlink(temp.name)
+            raise LgitError('fatal: object %s is corrupt (%s)'
+                            % (hash_value, destination))
+    replace(temp.name, destination)
+
+
+def list_loose_objects(lgit_path):
+    """Get the SHA1s of the loose objects of the lgit database."""
+    hash_values = []
+    objects_dir = lgit_path + '/.lgit/objects'
+    for name in listdir(objects_dir):
+        if len(name) != 2:  # Not a fan-out directory.
+            continue
+        for file_name in listdir(objects_dir + '/' + name):
+            if len(file_name) == 38:
+                hash_values.append(name + file_name)
+    return hash_values
+
+
+@traced('repack objects')
+def repack_objects(lgit_path, delta_bases=None, max_depth=DEFAULT_DEPTH,
+                   excluded=()):
+    """Move all the objects of the lgit database into a single pack.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        delta_bases: An ordered dictionary of SHA1 of a blob -> SHA1 of the
+            blob to try as its delta base (usually the previous version of
+            the same file). A base must come before the blobs using it.
+        max_depth: The maximum length of a chain of deltas.
+        excluded: The SHA1s of the objects to delete instead of packing
+            them.
+
+    Returns:
+        The number of objects in the new pack and how many are deltas.
+    """
+    delta_bases = delta_bases or {}
+    old_packs = [pack.pack_path for pack in get_packs(lgit_path)]
+    loose_objects = list_loose_objects(lgit_path)
+    hash_values = set(loose_objects)
+    for pack in get_packs(lgit_path):
+        hash_values.update(pack.hashes())
+    hash_values.difference_update(excluded)
+    if not hash_values and not excluded:
+        return 0, 0
+    depths = {}
+    cache = OrderedDict()  # The last blobs read, to be used as bases.
+
+    def _read_blob(hash_value):
+        """Read a blob, or None if it is too big or not a blob."""
+        if hash_value not in cache:
+            object_type, size, chunks = _open_stored_object(lgit_path,
+                                                            hash_value)
+            if object_type != 'blob' or size > DELTA_SIZE_LIMIT:
+                return None
+            cache[hash_value] = b''.join(chunks)
+            if len(cache) > DELTA_CACHE_OBJECTS:
+                cache.popitem(last=False)
+        return cache[hash_value]
+
+    def _get_delta(hash_value):
+        """Compute the delta of a blob against its base, if worth it."""
+        base_hash = delta_bases.get(hash_value)
+        if (base_hash not in hash_values or
+                depths.get(base_hash, 0) >= max_depth):
+            return None
+        base, target = _read_blob(base_hash), _read_blob(hash_value)
+        if base is None or target is None:
+            return None
+        delta = create_delta(base, target)
+        # A delta rebuilding most of the blob from inserts isn't worth it:
+        if len(delta) > len(target) // 2:
+            return None
+        depths[hash_value] = depths.get(base_hash, 0) + 1
+        return base_hash, delta
+
+    # The blobs with a base come in the order of delta_bases, after their
+    # bases, so the depth of a base is known before it is used:
+    order = [hash_value for hash_value in delta_bases
+             if hash_value in hash_values]
+    order += sorted(hash_values.difference(delta_bases))
+    # The manifests are packed as they are stored, like their chunks:
+    pack_path = order and write_pack(lgit_path, order, _open_stored_object,
+                                     _get_delta)
+    forget_packs(lgit_path)
+    for old_pack in old_packs:
+        if old_pack != pack_path:
+            remove_pack(old_pack)
+    for hash_value in loose_objects:
+        unlink(get_object_path(lgit_path, hash_value))
+        try:
+            rmdir(get_object_path(lgit_path, hash_value)[:-39])
+        except OSError:  # The directory isn't empty yet.
+            pass
+    return len(hash_values), len(depths)
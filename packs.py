@@ -0,0 +1,432 @@
+"""Pack the objects of lgit's database into a single file.
+
+A pack (.lgit/objects/pack/pack-<SHA1>.pack) is made of:
+
+    header:     'PACK', version and number of objects (2 unsigned 32-bit)
+    objects:    the type of the object (1 byte), the size of its contents
+                    (variable-length integer, 7 bits per byte) and the
+                    contents, zlib-compressed
+    trailer:    the SHA1 of everything before it
+
+An object can be stored as a delta against another object of the pack (its
+base): its type is then REF_DELTA, followed by the size of the delta, the
+raw SHA1 of the base and the delta, zlib-compressed. A delta is made of the
+sizes of the base and of the object, then instructions rebuilding the
+object: 0, a size and bytes to insert; or 1, an offset and a size of bytes
+to copy from the base.
+
+Its index (pack-<SHA1>.idx) finds an object in the pack:
+
+    header:     'LIDX' and version (unsigned 32-bit)
+    fan-out:    256 unsigned 32-bit integers, the number of objects whose
+                    SHA1 starts with a byte lower or equal to the position
+    SHA1s:      the raw SHA1s of the objects (20 bytes each), sorted
+    offsets:    the offset of each object in the pack (unsigned 64-bit)
+    trailer:    the SHA1 of the pack
+
+All integers are big-endian. Both files are read through mmap, so only the
+pages of the objects that are read are loaded.
+"""
+from collections import OrderedDict
+from hashlib import sha1
+from mmap import ACCESS_READ, mmap
+from os import listdir, replace, unlink
+from struct import Struct
+from zlib import compressobj, decompressobj
+
+from functions import (BUF_SIZE, create_temp_file, get_stat_data,
+                       make_directory)
+
+PACK_SIGNATURE = b'PACK'
+PACK_VERSION = 1
+PACK_HEADER = Struct('>4sII')
+IDX_SIGNATURE = b'LIDX'
+IDX_HEADER = Struct('>4sI')
+FAN_OUT = Struct('>256I')
+OFFSET = Struct('>Q')
+TYPE_CODES = {'blob': 1, 'tree': 2, 'commit': 3, 'chunked': 4}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+REF_DELTA = 7
+PACK_MODE = 0o444  # A pack never changes, it is replaced.
+DELTA_INSERT = 0
+DELTA_COPY = 1
+MIN_COPY_SIZE = 8  # Shorter matches are inserted, a copy isn't smaller.
+DELTA_BASE_CACHE_LIMIT = 16 * 1024 * 1024  # Bytes of objects kept.
+
+
+def encode_size(size):
+    """Encode a size as a variable-length integer (7 bits per byte)."""
+    data = bytearray()
+    while True:
+        byte = size & 0x7f
+        size >>= 7
+        if size:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+
+def decode_size(data, offset):
+    """Decode a variable-length integer.
+
+    Returns:
+        The integer and the offset of the byte after it.
+    """
+    size = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        size |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return size, offset
+
+
+def _match_size(base, base_offset, target, target_offset):
+    """Get the size of the common bytes of base and target at the offsets.
+
+    Args:
+        base, target: memoryviews of the data to compare.
+    """
+    limit = min(len(base) - base_offset, len(target) - target_offset)
+    size = 0
+    block = 4096
+    while block:
+        while size + block <= limit and (
+                base[base_offset + size:base_offset + size + block] ==
+                target[target_offset + size:target_offset + size + block]):
+            size += block
+        block //= 2
+    return size
+
+
+def create_delta(base, target):
+    """Compute a delta rebuilding target from base.
+
+    The lines of base are indexed, every line of target found in base
+    starts a copy, extended as long as the bytes match.
+
+    Args:
+        base, target: The contents (bytes) of the objects.
+
+    Returns:
+        The delta (bytes).
+    """
+    lines = {}
+    offset = 0
+    for line in base.splitlines(keepends=True):
+        if len(line) >= MIN_COPY_SIZE:
+            lines.setdefault(line, offset)
+        offset += len(line)
+    base_view, target_view = memoryview(base), memoryview(target)
+    delta = [encode_size(len(base)), encode_size(len(target))]
+    inserted = bytearray()
+    position = 0
+    while position < len(target):
+        end = target.find(b'\n', position) + 1 or len(target)
+        base_offset = lines.get(target[position:end])
+        size = 0
+        if base_offset is not None:
+            size = _match_size(base_view, base_offset, target_view, position)
+        if size < MIN_COPY_SIZE:
+            inserted += target[position:end]
+            position = end
+            continue
+        if inserted:
+            delta += [bytes([DELTA_INSERT]), encode_size(len(inserted)),
+                      bytes(inserted)]
+            inserted = bytearray()
+        delta += [bytes([DELTA_COPY]), encode_size(base_offset),
+                  encode_size(size)]
+        position += size
+    if inserted:
+        delta += [bytes([DELTA_INSERT]), encode_size(len(inserted)),
+                  bytes(inserted)]
+    return b''.join(delta)
+
+
+def apply_delta(base, delta):
+    """Rebuild an object from its base and a delta.
+
+    Returns:
+        The contents (bytes) of the object.
+    """
+    base_size, offset = decode_size(delta, 0)
+    target_size, offset = decode_size(delta, offset)
+    if base_size != len(base):
+        raise ValueError('delta base size mismatch')
+    target = bytearray()
+    while offset < len(delta):
+        instruction = delta[offset]
+        if instruction == DELTA_INSERT:
+            size, offset = decode_size(delta, offset + 1)
+            target += delta[offset:offset + size]
+            offset += size
+        else:
+            base_offset, offset = decode_size(delta, offset + 1)
+            size, offset = decode_size(delta, offset)
+            target += base[base_offset:base_offset + size]
+    if len(target) != target_size:
+        raise ValueError('delta result size mismatch')
+    return bytes(target)
+
+
+class Pack:
+    """A pack and its index, mapped in memory.
+
+    The objects rebuilt from deltas are kept in a small cache, so the
+    objects of a delta chain share the work of rebuilding their bases.
+    """
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        with open(pack_path[:-5] + '.idx', 'rb') as idx:
+            self.idx = mmap(idx.fileno(), 0, access=ACCESS_READ)
+        with open(pack_path, 'rb') as pack:
+            self.pack = mmap(pack.fileno(), 0, access=ACCESS_READ)
+        signature, _ = IDX_HEADER.unpack_from(self.idx)
+        if signature != IDX_SIGNATURE:
+            raise ValueError('not a pack index: %s' % pack_path)
+        self.fan_out = FAN_OUT.unpack_from(self.idx, IDX_HEADER.size)
+        self.count = self.fan_out[-1]
+        self.hashes_start = IDX_HEADER.size + FAN_OUT.size
+        self.offsets_start = self.hashes_start + 20 * self.count
+        self.cache = OrderedDict()  # Whole objects by offset.
+        self.cache_size = 0
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Unmap the pack and its index."""
+        self.idx.close()
+        self.pack.close()
+
+    def _raw_hash(self, position):
+        """Get the raw SHA1 of the object at position in the index."""
+        start = self.hashes_start + 20 * position
+        return self.idx[start:start + 20]
+
+    def hashes(self):
+        """Yield the SHA1s of the objects in the pack, sorted."""
+        for position in range(self.count):
+            yield self._raw_hash(position).hex()
+
+    def stored_sizes(self):
+        """Get the number of bytes each object takes in the pack.
+
+        Returns:
+            A dictionary of SHA1 -> size (header and compressed data).
+        """
+        offsets = sorted((OFFSET.unpack_from(
+            self.idx, self.offsets_start + 8 * position)[0], position)
+            for position in range(self.count))
+        ends = [offset for offset, _ in offsets[1:]] + [len(self.pack) - 20]
+        return {self._raw_hash(position).hex(): end - offset
+                for (offset, position), end in zip(offsets, ends)}
+
+    def find(self, hash_value):
+        """Find the offset of an object in the pack.
+
+        Args:
+            hash_value: The SHA1 of the object.
+
+        Returns:
+            The offset of the object, or None if it isn't in the pack.
+        """
+        key = bytes.fromhex(hash_value)
+        # The fan-out table gives the range of the SHA1s with that byte:
+        low = self.fan_out[key[0] - 1] if key[0] else 0
+        high = self.fan_out[key[0]]
+        while low < high:
+            middle = (low + high) // 2
+            current = self._raw_hash(middle)
+            if current == key:
+                return OFFSET.unpack_from(
+                    self.idx, self.offsets_start + 8 * middle)[0]
+            if current < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def open_at(self, offset):
+        """Open the object at offset to read its contents.
+
+        Returns:
+            The type of the object, its size and an iterator over its
+                contents (chunks of at most BUF_SIZE bytes).
+        """
+        type_code = self.pack[offset]
+        if type_code == REF_DELTA:
+            object_type, data = self._read_whole(offset)
+            return object_type, len(data), iter([data] if data else [])
+        size, offset = decode_size(self.pack, offset + 1)
+        return TYPE_NAMES[type_code], size, self._iter_data(offset)
+
+    def _read_whole(self, offset):
+        """Read the whole object at offset, rebuilding it from its delta.
+
+        Returns:
+            The type of the object and its contents (bytes).
+        """
+        if offset in self.cache:
+            self.cache.move_to_end(offset)
+            return self.cache[offset]
+        type_code = self.pack[offset]
+        _, data_offset = decode_size(self.pack, offset + 1)
+        if type_code == REF_DELTA:
+            base_hash = self.pack[data_offset:data_offset + 20].hex()
+            base_offset = self.find(base_hash)
+            if base_offset is None:
+                raise ValueError('missing delta base %s' % base_hash)
+            object_type, base = self._read_whole(base_offset)
+            delta = b''.join(self._iter_data(data_offset + 20))
+            data = apply_delta(base, delta)
+        else:
+            object_type = TYPE_NAMES[type_code]
+            data = b''.join(self._iter_data(data_offset))
+        self.cache[offset] = object_type, data
+        self.cache_size += len(data)
+        while self.cache_size > DELTA_BASE_CACHE_LIMIT and len(self.cache) > 1:
+            self.cache_size -= len(self.cache.popitem(last=False)[1][1])
+        return object_type, data
+
+    def type_at(self, offset):
+        """Get the type of the object at offset, without reading it."""
+        while self.pack[offset] == REF_DELTA:
+            _, data_offset = decode_size(self.pack, offset + 1)
+            base_hash = self.pack[data_offset:data_offset + 20].hex()
+            offset = self.find(base_hash)
+            if offset is None:
+                raise ValueError('missing delta base %s' % base_hash)
+        return TYPE_NAMES[self.pack[offset]]
+
+    def is_delta(self, offset):
+        """Check if the object at offset is stored as a delta."""
+        return self.pack[offset] == REF_DELTA
+
+    def _iter_data(self, offset):
+        """Yield the decompressed data starting at offset."""
+        decompressor = decompressobj()
+        while not decompressor.eof:
+            data = decompressor.unconsumed_tail
+            if not data:
+                data = self.pack[offset:offset + BUF_SIZE]
+                offset += len(data)
+            chunk = decompressor.decompress(data, BUF_SIZE)
+            if chunk:
+                yield chunk
+
+
+_packs = {}  # The packs already mapped, by lgit directory.
+_pack_directories = {}  # The stat data of the pack directory when listed.
+
+
+def get_packs(lgit_path):
+    """Get the packs of the lgit database, mapping them only once."""
+    if lgit_path not in _packs:
+        packs = []
+        _pack_directories[lgit_path] = get_stat_data(
+            lgit_path + '/.lgit/objects/pack')
+        try:
+            pack_names = sorted(listdir(lgit_path + '/.lgit/objects/pack'))
+        except FileNotFoundError:
+            pack_names = []
+        for name in pack_names:
+            # A pack is only visible once its index is installed:
+            if name.endswith('.idx'):
+                packs.append(Pack('%s/.lgit/objects/pack/%s.pack' %
+                                  (lgit_path, name[:-4])))
+        _packs[lgit_path] = packs
+    return _packs[lgit_path]
+
+
+def forget_packs(lgit_path):
+    """Unmap the packs, so they are listed again next time."""
+    for pack in _packs.pop(lgit_path, []):
+        pack.close()
+
+
+def forget_packs_if_changed(lgit_path):
+    """Unmap the packs if packs were added or removed since they were listed.
+    """
+    directory_stat = get_stat_data(lgit_path + '/.lgit/objects/pack')
+    if lgit_path in _packs and (_pack_directories.get(lgit_path) !=
+                                directory_stat):
+        forget_packs(lgit_path)
+
+
+def write_pack(lgit_path, hash_values, open_object, get_delta=None):
+    """Write a pack and its index with objects.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        hash_values: The SHA1s of the objects to be packed.
+        open_object: The function opening an object, it returns the type of
+            the object, its size and an iterator over its contents.
+        get_delta: The function giving the SHA1 of the base of an object
+            and the delta against it, or None to store the whole object.
+            The bases must be in hash_values.
+
+    Returns:
+        The path of the new pack.
+    """
+    pack_dir = lgit_path + '/.lgit/objects/pack'
+    make_directory(pack_dir)
+    entries = []
+    pack_hash = sha1()
+    with create_temp_file(pack_dir, 'tmp_pack_', PACK_MODE) as pack:
+
+        def _write(data):
+            pack_hash.update(data)
+            pack.write(data)
+
+        _write(PACK_HEADER.pack(PACK_SIGNATURE, PACK_VERSION,
+                                len(hash_values)))
+        for hash_value in hash_values:
+            entries.append((bytes.fromhex(hash_value), pack.tell()))
+            delta = get_delta and get_delta(hash_value)
+            if delta:
+                base_hash, delta = delta
+                _write(bytes([REF_DELTA]) + encode_size(len(delta)) +
+                       bytes.fromhex(base_hash))
+                chunks = [delta]
+            else:
+                object_type, size, chunks = open_object(lgit_path,
+                                                        hash_value)
+                _write(bytes([TYPE_CODES[object_type]]) + encode_size(size))
+            compressor = compressobj()
+            for chunk in chunks:
+                _write(compressor.compress(chunk))
+            _write(compressor.flush())
+        trailer = pack_hash.digest()
+        pack.write(trailer)
+    entries.sort()
+    fan_out = [0] * 256
+    for raw, _ in entries:
+        fan_out[raw[0]] += 1
+    for i in range(1, 256):
+        fan_out[i] += fan_out[i - 1]
+    with create_temp_file(pack_dir, 'tmp_idx_', PACK_MODE) as idx:
+        idx.write(IDX_HEADER.pack(IDX_SIGNATURE, 1))
+        idx.write(FAN_OUT.pack(*fan_out))
+        idx.write(b''.join(raw for raw, _ in entries))
+        idx.write(b''.join(OFFSET.pack(offset) for _, offset in entries))
+        idx.write(trailer)
+    name = sha1(b''.join(raw for raw, _ in entries)).hexdigest()
+    pack_path = '%s/pack-%s.pack' % (pack_dir, name)
+    # Install the pack before its index, the index makes it visible:
+    replace(pack.name, pack_path)
+    replace(idx.name, pack_path[:-5] + '.idx')
+    return pack_path
+
+
+def remove_pack(pack_path):
+    """Delete a pack and its index."""
+    for path in (pack_path[:-5] + '.idx', pack_path):
+        try:
+            unlink(path)
+        except FileNotFoundError:
+            pass
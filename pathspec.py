@@ -0,0 +1,181 @@
+"""Select files by the pathspecs given to add, rm, ls-files and status.
+
+A pathspec is a list of patterns, relative to the top of the working
+directory:
+
+    - a pathname matches the file or everything in the directory
+    - a glob ('*' and '?' match anything but '/', '**' any directories,
+      '[...]' a character) matches the pathnames it matches, and
+      everything in the directories it matches
+    - a pattern starting with ':!', ':^' or ':(exclude)' excludes what it
+      matches
+    - '.' matches everything
+
+A file is selected if it matches a pattern and no excluding pattern (with
+only excluding patterns, every file is a candidate).
+
+The literal part of a pattern, before its first wildcard, cut at its last
+'/', is the only directory which can hold matches: only these directories
+are walked, and only the range of sorted pathnames starting with them is
+looked at, so 'lgit status src/module/' costs what src/module holds, not
+what the working directory holds.
+"""
+from bisect import bisect_left
+from functools import partial
+from os.path import isdir, isfile
+from re import compile as compile_regex
+
+from worktree import get_files_skip_lgit, translate_glob
+
+EXCLUDE_PREFIXES = (':(exclude)', ':!', ':^')
+WILDCARDS = '*?['
+
+
+def normalize_path(pattern):
+    """Remove the '.', empty and trailing parts of a pattern."""
+    return '/'.join(part for part in pattern.split('/')
+                    if part not in ('', '.'))
+
+
+def is_literal(pattern):
+    """Check if a pattern names a single pathname (no wildcard)."""
+    return not any(wildcard in pattern for wildcard in WILDCARDS)
+
+
+def _compile(pattern):
+    """Compile a pattern.
+
+    Returns:
+        (prefix, regex): the directory (or file) holding every match
+            ('' for the whole working directory), and the compiled regex
+            matching the pathnames, None if the pattern is the prefix.
+    """
+    pattern = normalize_path(pattern)
+    positions = [pattern.find(wildcard) for wildcard in WILDCARDS]
+    positions = [position for position in positions if position >= 0]
+    if not positions:
+        return pattern, None
+    prefix = pattern[:min(positions)].rpartition('/')[0]
+    regex = '(?:%s)(?:/.*)?\\Z' % translate_glob(pattern)
+    return prefix, compile_regex(regex)
+
+
+def _match(spec, path):
+    """Check if a pathname matches a compiled pattern."""
+    prefix, regex = spec
+    if regex is not None:
+        return regex.match(path) is not None
+    return (not prefix or path == prefix or
+            path.startswith(prefix + '/'))
+
+
+class Pathspec:
+    """A compiled list of patterns.
+
+    Args:
+        patterns: The patterns, none to match everything.
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = []  # The including patterns, as given.
+        self.includes = []
+        self.excludes = []
+        for pattern in patterns:
+            for exclude_prefix in EXCLUDE_PREFIXES:
+                if pattern.startswith(exclude_prefix):
+                    self.excludes.append(
+                        _compile(pattern[len(exclude_prefix):]))
+                    break
+            else:
+                self.patterns.append(pattern)
+                self.includes.append(_compile(pattern))
+        if not self.includes:
+            self.includes.append(('', None))
+
+    def selects_all(self):
+        """Check if every pathname is selected."""
+        return self.includes == [('', None)] and not self.excludes
+
+    def matches(self, path):
+        """Check if a pathname is selected."""
+        return (any(_match(spec, path) for spec in self.includes) and
+                not any(_match(spec, path) for spec in self.excludes))
+
+    def prefixes(self):
+        """Get the fewest literal prefixes covering all the patterns.
+
+        A prefix inside the directory of another one is dropped.
+
+        Returns:
+            The sorted list of the prefixes (of pathnames, no trailing '/').
+        """
+        prefixes = []
+        for prefix in sorted({prefix for prefix, _ in self.includes}):
+            if any(not kept or prefix.startswith(kept + '/')
+                   for kept in prefixes):
+                continue
+            prefixes.append(prefix)
+        return prefixes
+
+    def select(self, paths):
+        """Get the selected pathnames of a sorted list.
+
+        Only the ranges of the list starting with the prefixes are looked
+        at: a prefix p covers the pathnames from p to p + '0' ('0' follows
+        '/'), and the few of them not in p (like 'p.txt') are filtered out
+        with the rest.
+
+        Returns:
+            The selected pathnames, sorted.
+        """
+        selected = []
+        for low, high in self.ranges(len(paths), partial(bisect_left, paths)):
+            selected.extend(path for path in paths[low:high]
+                            if self.matches(path))
+        return selected
+
+    def ranges(self, size, bisect):
+        """Find the positions of the prefixes in sorted pathnames.
+
+        Args:
+            size: The number of pathnames.
+            bisect: The function giving the position of the first pathname
+                not lower than a string, like bisect_left().
+
+        Yields:
+            (low, high): the pathnames to look at are the ones from low to
+                high (excluded), the ranges are sorted and don't overlap.
+        """
+        end = 0
+        for prefix in self.prefixes():
+            if not prefix:
+                yield 0, size
+                return
+            low = max(bisect(prefix), end)
+            high = bisect(prefix + '0')
+            if low < high:
+                yield low, high
+                end = high
+
+    def walk(self, cache=None):
+        """Get the selected files of the working directory.
+
+        Only the prefixes are walked. A file named by a pattern is selected
+        even if it is ignored, like 'lgit add' always did.
+
+        Args:
+            cache: The UntrackedCache to read the directories from, or None
+                to read all of them.
+
+        Returns:
+            The sorted list of the selected files.
+        """
+        file_paths = []
+        for prefix in self.prefixes():
+            if prefix and isfile(prefix):
+                file_paths.append(prefix)
+            elif not prefix or isdir(prefix):
+                file_paths.extend(
+                    prefix + '/' + path if prefix else path
+                    for path in get_files_skip_lgit(prefix or '.', cache))
+        return sorted(path for path in set(file_paths) if self.matches(path))
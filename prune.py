@@ -0,0 +1,157 @@
+"""Find the objects and the commits which can't be reached any more.
+
+'lgit gc --prune' keeps everything reachable from:
+
+    the branches (see refs.py) and MERGE_HEAD: their commits and
+        ancestors, with the trees and blobs of their snapshots
+    the stashes (see branches.py): their commit, the tree of their index
+        and their stored files
+    the index: the staged blobs and the trees of its cache
+    the manifests of the reachable blobs: their chunks
+
+and deletes the rest: the blobs added then replaced before a commit, the
+commits of deleted branches with their snapshots... The trees are walked
+once each: a subtree shared by many commits is only read the first time.
+
+The objects and commits younger than the grace period are kept, whether
+they are reachable or not: another lgit command may be writing them (a
+blob is stored before the index refers to it). The commits kept this way
+keep their snapshots too. A packed object is as old as its pack.
+"""
+from os import listdir, stat, unlink
+from time import time
+
+from branches import list_stashes, read_stash
+from commits import iter_history
+from functions import read_file
+from index import Index
+from objects import get_object_path, list_loose_objects, read_manifest
+from packs import get_packs
+from refs import list_branches
+from tracing import count, traced
+from trees import get_snapshot_tree, read_snapshot, read_tree
+
+DEFAULT_GRACE_PERIOD = 14 * 24 * 60 * 60  # Two weeks, in seconds.
+
+
+@traced('find reachable')
+def find_reachable(lgit_path, roots=()):
+    """Walk the history and the trees from the branches, stashes and index.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        roots: More commits to walk from.
+
+    Returns:
+        The set of the reachable commits and the set of the SHA1s of the
+            reachable objects.
+    """
+    objects = set()
+    blobs = set()
+
+    def _mark_tree(tree_hash):
+        """Mark a tree and everything in it, unless it was already seen."""
+        if not tree_hash or tree_hash in objects:
+            return
+        objects.add(tree_hash)
+        count('trees_walked')
+        for object_type, hash_value, _ in read_tree(lgit_path, tree_hash):
+            if object_type == 'tree':
+                _mark_tree(hash_value)
+            else:
+                blobs.add(hash_value)
+
+    heads = list(roots)
+    heads += list_branches(lgit_path).values()
+    heads.append((read_file(lgit_path + '/.lgit/MERGE_HEAD') or '').strip())
+    for name in list_stashes(lgit_path):
+        headers, files = read_stash(lgit_path, name)
+        heads.append(headers.get('head'))
+        _mark_tree(headers.get('index'))
+        for _, *hash_values in files:
+            blobs.update(hash_value for hash_value in hash_values
+                         if hash_value)
+    commits = set()
+    for head in heads:
+        if head and head not in commits:
+            commits.update(iter_history(lgit_path, head))
+    for commit in commits:
+        tree_hash = get_snapshot_tree(lgit_path, commit)
+        if tree_hash:
+            _mark_tree(tree_hash)
+        else:  # The snapshot is a list of files.
+            blobs.update(read_snapshot(lgit_path, commit).values())
+    index = Index.load(lgit_path)
+    blobs.update(entry.staged_hash for entry in index)
+    for tree_hash in index.cache_tree.values():
+        _mark_tree(tree_hash)
+    objects.update(blobs)
+    for hash_value in blobs:
+        try:
+            manifest = read_manifest(lgit_path, hash_value)
+        except FileNotFoundError:  # A blob missing from the database.
+            continue
+        if manifest:
+            objects.update(chunk_hash for chunk_hash, _ in manifest)
+    return commits, objects
+
+
+def _file_size(path):
+    """Get the size of a file, 0 if it doesn't exist."""
+    try:
+        return stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+@traced('find garbage')
+def find_garbage(lgit_path, grace_period=DEFAULT_GRACE_PERIOD):
+    """Find the unreachable commits and objects older than grace_period.
+
+    Returns:
+        A dictionary of unreachable commit -> bytes of its files, and one
+            of SHA1 of an unreachable object -> bytes it takes on disk.
+    """
+    expiry = time() - grace_period
+    old_commits = []
+    recent_commits = []
+    for commit in listdir(lgit_path + '/.lgit/commits'):
+        if stat(lgit_path + '/.lgit/commits/' + commit).st_mtime < expiry:
+            old_commits.append(commit)
+        else:
+            recent_commits.append(commit)
+    reachable_commits, reachable_objects = find_reachable(lgit_path,
+                                                          recent_commits)
+    garbage_commits = {}
+    for commit in old_commits:
+        if commit not in reachable_commits:
+            garbage_commits[commit] = (
+                _file_size(lgit_path + '/.lgit/commits/' + commit) +
+                _file_size(lgit_path + '/.lgit/snapshots/' + commit))
+    garbage_objects = {}
+    for hash_value in list_loose_objects(lgit_path):
+        if hash_value not in reachable_objects:
+            object_stat = stat(get_object_path(lgit_path, hash_value))
+            if object_stat.st_mtime < expiry:
+                garbage_objects[hash_value] = object_stat.st_size
+    for pack in get_packs(lgit_path):
+        if stat(pack.pack_path).st_mtime >= expiry:
+            continue
+        for hash_value, size in pack.stored_sizes().items():
+            if hash_value not in reachable_objects:
+                garbage_objects[hash_value] = (
+                    garbage_objects.get(hash_value, 0) + size)
+    return garbage_commits, garbage_objects
+
+
+def remove_commits(lgit_path, commits):
+    """Delete commits with their snapshots.
+
+    The commit-graph has to be written again afterwards.
+    """
+    for commit in commits:
+        for directory in ('commits', 'snapshots'):
+            try:
+                unlink('%s/.lgit/%s/%s' % (lgit_path, directory, commit))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,161 @@
+"""Find the current branch and the last commit of the branches.
+
+A branch is a file of .lgit/refs/heads holding the name of its last commit
+(a loose ref), or a line of .lgit/packed-refs:
+
+    # pack-refs
+    <commit> refs/heads/<branch>
+    ...
+
+sorted by branch. A loose ref overrides the packed one: a branch is
+updated by writing its loose ref, and 'lgit pack-refs' (or 'lgit gc')
+moves the loose refs into packed-refs, so a repository with thousands of
+branches keeps only a few files in .lgit/refs/heads.
+
+HEAD ('ref: refs/heads/<branch>') and packed-refs are parsed once per
+process, and again only when their stat data changed. A file changed less
+than RACY_NS after it was parsed is parsed again each time: a change in
+the same tick of the clock would not change its stat data.
+"""
+from bisect import bisect_left
+from os import listdir, replace, unlink
+from time import time_ns
+
+from functions import get_stat_data, read_file, write_file
+from tracing import count
+
+PACKED_REFS_HEADER = '# pack-refs\n'
+RACY_NS = 1000000000
+
+_cache = {}  # (stat data, time parsed, value) by file name.
+
+
+def _read_cached(file_name, parse):
+    """Parse a file, or reuse what it was parsed to if it didn't change.
+
+    Args:
+        file_name: The file.
+        parse: The function parsing the contents of the file (None if the
+            file doesn't exist).
+    """
+    file_stat = get_stat_data(file_name)
+    cached = _cache.get(file_name)
+    if cached is not None and file_stat is not None and (
+            cached[0] == file_stat and file_stat[0] < cached[1] - RACY_NS):
+        return cached[2]
+    parsed_at = time_ns()
+    value = parse(read_file(file_name))
+    count('refs_parsed')
+    _cache[file_name] = (file_stat, parsed_at, value)
+    return value
+
+
+def _parse_head(content):
+    """Get the branch of the content of HEAD."""
+    return (content or '').strip('\n').split('/')[-1]
+
+
+def get_current_branch(lgit_path):
+    """Get the name of the current branch."""
+    return _read_cached(lgit_path + '/.lgit/HEAD', _parse_head)
+
+
+def set_current_branch(lgit_path, branch):
+    """Make a branch the current branch."""
+    write_file(lgit_path + '/.lgit/HEAD', 'ref: refs/heads/%s' % branch)
+
+
+def _parse_packed_refs(content):
+    """Get the sorted lists of the branches and of their commits."""
+    branches = []
+    commits = []
+    for line in (content or '').split('\n'):
+        if line and not line.startswith('#'):
+            commit, _, ref = line.partition(' ')
+            branches.append(ref[len('refs/heads/'):])
+            commits.append(commit)
+    return branches, commits
+
+
+def _get_packed_refs(lgit_path):
+    """Get the sorted lists of the packed branches and of their commits."""
+    return _read_cached(lgit_path + '/.lgit/packed-refs',
+                        _parse_packed_refs)
+
+
+def _read_loose_ref(lgit_path, branch):
+    """Read the loose ref of a branch.
+
+    Returns:
+        The commit ('' if the branch has none yet), or None if there is no
+            loose ref.
+    """
+    content = read_file(lgit_path + '/.lgit/refs/heads/%s' % branch)
+    if content is None:
+        return None
+    return content.split('\n')[0]
+
+
+def get_branch_commit(lgit_path, branch=None):
+    """Get the last commit of a branch (by default the current branch).
+
+    Returns:
+        The name of the commit, or None if the branch has no commit yet.
+    """
+    if branch is None:
+        branch = get_current_branch(lgit_path)
+    commit = _read_loose_ref(lgit_path, branch)
+    if commit is None:
+        branches, commits = _get_packed_refs(lgit_path)
+        position = bisect_left(branches, branch)
+        if position < len(branches) and branches[position] == branch:
+            commit = commits[position]
+    return commit or None
+
+
+def branch_exists(lgit_path, branch):
+    """Check if a branch has a ref, loose or packed."""
+    if _read_loose_ref(lgit_path, branch) is not None:
+        return True
+    branches, _ = _get_packed_refs(lgit_path)
+    position = bisect_left(branches, branch)
+    return position < len(branches) and branches[position] == branch
+
+
+def update_branch(lgit_path, branch, commit):
+    """Set the last commit of a branch (creating the branch)."""
+    write_file(lgit_path + '/.lgit/refs/heads/%s' % branch, commit)
+
+
+def list_branches(lgit_path):
+    """Get the last commit of every branch.
+
+    Returns:
+        A dictionary of branch -> commit ('' for no commit yet), sorted.
+    """
+    branches, commits = _get_packed_refs(lgit_path)
+    refs = dict(zip(branches, commits))
+    for branch in listdir(lgit_path + '/.lgit/refs/heads'):
+        commit = _read_loose_ref(lgit_path, branch)
+        if commit is not None:
+            refs[branch] = commit
+    return dict(sorted(refs.items()))
+
+
+def pack_refs(lgit_path):
+    """Move the loose refs into packed-refs.
+
+    Returns:
+        The number of packed branches.
+    """
+    refs = list_branches(lgit_path)
+    temp_name = lgit_path + '/.lgit/packed-refs.lock'
+    write_file(temp_name, PACKED_REFS_HEADER + ''.join(
+        '%s refs/heads/%s\n' % (commit, branch)
+        for branch, commit in refs.items() if commit))
+    replace(temp_name, lgit_path + '/.lgit/packed-refs')
+    for branch, commit in refs.items():
+        # A branch without commit yet keeps its loose ref:
+        if commit and _read_loose_ref(lgit_path, branch) == commit:
+            unlink(lgit_path + '/.lgit/refs/heads/%s' % branch)
+    return len(refs)
@@ -0,0 +1,358 @@
+"""Use lgit from Python: the commands return data instead of printing it.
+
+    repository = Repository('/path/to/working/directory')
+    repository.add(['.'])
+    commit = repository.commit('message')
+    for commit in repository.log(max_count=10):
+        print(commit.id, commit.message)
+    for change in repository.diff(cached=True):
+        print(change.path, change.old_hash, change.new_hash)
+
+The errors are raised as LgitError, with the message the command line
+prints (a corrupt index or commit-graph too). The methods reading the
+working directory (status(), add() and diff()) run from the top of the
+working directory: they change the current directory while they run if it
+isn't there, so a Repository is not meant to be used from several threads
+at once.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from os import chdir, getcwd, unlink
+from os.path import abspath, exists, isdir, isfile
+
+from commits import Commit, iter_history, read_commit, write_commit
+from fsmonitor import query_changed_paths
+from functions import (LgitError, get_stat_data,
+                       get_timestamp_of_current_time, read_file, write_file)
+from history import add_to_path_history, find_path_commits
+from index import Index, IndexEntry, list_index_paths
+from objects import store_file
+from pathspec import Pathspec, normalize_path
+from refs import (branch_exists, get_branch_commit, get_current_branch,
+                  list_branches, update_branch)
+from tracing import span
+from trees import diff_snapshot_and_tree, diff_snapshots, write_tree
+from worktree import UntrackedCache
+
+Status = namedtuple('Status', 'to_be_committed not_staged untracked')
+Change = namedtuple('Change', 'path old_hash new_hash in_working_directory')
+
+
+class Repository:
+    """A working directory tracked by lgit.
+
+    Args:
+        path: The top of the working directory (which has the .lgit
+            directory in it).
+
+    Raises:
+        LgitError: There is no .lgit directory in path.
+    """
+
+    def __init__(self, path='.'):
+        self.path = abspath(path)
+        if isfile(self.path + '/.lgit'):
+            raise LgitError('fatal: invalid gitfile format: %s/.lgit'
+                            % self.path)
+        if not isdir(self.path + '/.lgit'):
+            raise LgitError('fatal: not a git repository: %s' % self.path)
+
+    @contextmanager
+    def _in_working_directory(self):
+        """Run a block from the top of the working directory."""
+        previous = getcwd()
+        if previous == self.path:
+            yield
+            return
+        chdir(self.path)
+        try:
+            yield
+        finally:
+            chdir(previous)
+
+    def current_branch(self):
+        """Get the name of the current branch."""
+        return get_current_branch(self.path)
+
+    def head(self):
+        """Get the name of the last commit of the current branch, or None."""
+        return get_branch_commit(self.path)
+
+    def resolve_commit(self, name):
+        """Get the commit named by a branch or by the name of a commit.
+
+        Raises:
+            LgitError: name is neither a branch with commits nor a commit.
+        """
+        if branch_exists(self.path, name):
+            commit = get_branch_commit(self.path, name)
+            if commit:
+                return commit
+        elif exists(self.path + '/.lgit/commits/' + name):
+            return name
+        raise LgitError("fatal: ambiguous argument '%s': unknown revision "
+                        "or path not in the working tree." % name)
+
+    def status(self, paths=()):
+        """Compare the working directory, the index and the last commit.
+
+        Args:
+            paths: The pathspec (see pathspec.py) of the files to compare,
+                none for all of them. Only the directories of its prefixes
+                are walked.
+
+        Returns:
+            The Status: the files whose staged content differs from the
+                last commit, the files whose content differs from the staged
+                one, and the files which aren't tracked.
+        """
+        index = Index.load(self.path)
+        pathspec = Pathspec(paths)
+        to_be_committed = []
+        not_staged = []
+        with self._in_working_directory():
+            changed_paths = query_changed_paths(self.path, index,
+                                                pathspec.selects_all())
+            for entry in index.refresh(changed_paths, pathspec):
+                if entry.staged_hash != entry.working_hash:
+                    not_staged.append(entry.path)
+                if entry.committed_hash != entry.staged_hash:
+                    to_be_committed.append(entry.path)
+            index.flush()
+            cache = UntrackedCache(self.path, changed_paths)
+            untracked = [path for path in pathspec.walk(cache)
+                         if path not in index]
+            cache.flush()
+        return Status(to_be_committed, not_staged, untracked)
+
+    def diff(self, commits=(), cached=False):
+        """Find the files which differ between two versions of the tree.
+
+        The working directory is compared with the index, or with a commit
+        if there is one. With cached, the index is compared with the last
+        commit (or with the commit). Two commits are compared together.
+
+        The files whose SHA1s are equal are never read: the trees are
+        compared directory by directory, and the working files only when
+        their stat data changed.
+
+        Args:
+            commits: Zero, one or two branches or commits.
+            cached: If the new version is the index.
+
+        Yields:
+            The Changes sorted by pathname: the old and new SHA1s (None for
+                no file) and if the new contents is the working file (which
+                isn't stored).
+        """
+        commits = [self.resolve_commit(name) for name in commits]
+        if len(commits) > 2:
+            raise LgitError('usage: lgit diff [--cached] [<commit> '
+                            '[<commit>]]')
+        if len(commits) == 2:
+            for path, old_hash, new_hash in diff_snapshots(self.path,
+                                                           *commits):
+                yield Change(path, old_hash, new_hash, False)
+            return
+        index = Index.load(self.path)
+        staged_changes = {}
+        if cached or commits:
+            tree_hash = write_tree(self.path, index)
+            index.flush()
+            for path, old_hash, new_hash in diff_snapshot_and_tree(
+                    self.path, commits[0] if commits else self.head(),
+                    tree_hash):
+                staged_changes[path] = (old_hash, new_hash)
+            if cached:
+                for path, (old_hash, new_hash) in staged_changes.items():
+                    yield Change(path, old_hash, new_hash, False)
+                return
+        with self._in_working_directory():
+            # The untracked files aren't looked at: the changed paths are
+            # reported again to the next command, which may walk them.
+            present_paths = {entry.path for entry in index.refresh(
+                query_changed_paths(self.path, index, complete=False))}
+            index.flush()
+        working_changes = {}  # The working SHA1s which aren't staged.
+        for entry in index:
+            if entry.path not in present_paths:
+                working_changes[entry.path] = None
+            elif entry.working_hash != entry.staged_hash:
+                working_changes[entry.path] = entry.working_hash
+        for path in sorted(set(staged_changes) | set(working_changes)):
+            if path in staged_changes:
+                old_hash, new_hash = staged_changes[path]
+            else:
+                old_hash = new_hash = index.get(path).staged_hash
+            in_working_directory = path in working_changes
+            if in_working_directory:
+                new_hash = working_changes[path]
+                in_working_directory = new_hash is not None
+            if old_hash != new_hash:
+                yield Change(path, old_hash, new_hash, in_working_directory)
+
+    def ls_files(self, paths=()):
+        """Yield the pathnames of the tracked files, sorted.
+
+        Args:
+            paths: The pathspec (see pathspec.py) of the files to list, none
+                for all of them.
+        """
+        yield from list_index_paths(self.path, Pathspec(paths) if paths
+                                    else None)
+
+    def log(self, max_count=None, paths=()):
+        """Yield the Commits of the current branch, newest first.
+
+        With paths, only the commits which changed them are read: they are
+        found in the path history (see history.py), and the history of the
+        branch is walked without opening its commits, down to the oldest
+        of them.
+
+        Args:
+            max_count: The maximum number of commits, or None for all.
+            paths: The files and directories whose commits are wanted, none
+                for all commits.
+        """
+        if max_count is not None and max_count <= 0:
+            return
+        paths = [normalize_path(path) for path in paths]
+        selected = None  # The commits which changed paths.
+        if paths and '' not in paths:
+            selected = find_path_commits(self.path, paths)
+            if not selected:
+                return
+            oldest = min(selected)
+        number = 0
+        for commit_id in iter_history(self.path, self.head()):
+            if selected is not None:
+                # The commits are named by their time, the parents first:
+                if commit_id < oldest:
+                    break
+                if commit_id not in selected:
+                    continue
+            yield read_commit(self.path, commit_id)
+            number += 1
+            if number == max_count:
+                break
+
+    def add(self, paths, jobs=None):
+        """Add file contents to the index.
+
+        Args:
+            paths: The pathspec (see pathspec.py) of the files to add ('.'
+                for all).
+            jobs: The number of files hashed and stored at once (by default
+                depends on the number of cores).
+
+        Returns:
+            The list of the files which were stored.
+        """
+        if jobs is not None and jobs < 1:
+            raise LgitError('fatal: invalid number of jobs: %d' % jobs)
+        index = Index.load(self.path)
+
+        def _list_files():
+            """Get the files to add: the new and the changed ones."""
+            pathspec = Pathspec(paths)
+            changed_paths = query_changed_paths(self.path, index,
+                                                pathspec.selects_all())
+            index.refresh(changed_paths, pathspec)
+            cache = UntrackedCache(self.path, changed_paths)
+            # The tracked files which didn't change are already stored:
+            file_paths = []
+            for path in pathspec.walk(cache):
+                entry = index.get(path)
+                if entry is None or entry.working_hash != entry.staged_hash:
+                    file_paths.append(path)
+            cache.flush()
+            return file_paths
+
+        def _store_file(file_path):
+            """Hash a file and store its contents in the lgit database.
+
+            Returns: The file, its SHA1 and its stat data.
+            """
+            # Stat before hashing, so a change while hashing is seen later:
+            file_stat = get_stat_data(file_path)
+            return file_path, store_file(self.path, file_path), file_stat
+
+        def _update_index(file_path, hash_value, stat_data):
+            """Update the file information in the index."""
+            entry = index.get(file_path)
+            if entry is None:
+                index.add(IndexEntry(file_path, hash_value, stat_data))
+            else:
+                entry.working_hash = entry.staged_hash = hash_value
+                entry.set_stat_data(stat_data)
+                index.touch(file_path)
+
+        with self._in_working_directory():
+            file_paths = _list_files()
+            # Hashing and copying release the GIL, so threads use all
+            # cores; map() keeps the order of the files, so the index stays
+            # deterministic:
+            with span('store files', files=len(file_paths)), \
+                    ThreadPoolExecutor(max_workers=jobs) as executor:
+                for file_path, hash_value, file_stat in executor.map(
+                        _store_file, file_paths):
+                    _update_index(file_path, hash_value, file_stat)
+            index.flush()
+        return file_paths
+
+    def commit(self, message):
+        """Record the staged files as a new commit of the current branch.
+
+        Returns:
+            The new Commit.
+
+        Raises:
+            LgitError: Nothing was ever added, or there is no author.
+        """
+        index = Index.load(self.path)
+        if not index:
+            raise LgitError('nothing added to commit')
+        author = (read_file(self.path + '/.lgit/config') or '').strip('\n')
+        if not author:
+            raise LgitError('fatal: empty ident name not allowed')
+        timestamp, commit_id = get_timestamp_of_current_time()
+        parent = self.head()
+        parents = [parent] if parent else []
+        # The commit concluding a merge has the merged commit as parent:
+        merge_head = read_file(self.path + '/.lgit/MERGE_HEAD')
+        if merge_head:
+            parents.append(merge_head.strip('\n'))
+        commit = Commit(commit_id, author, timestamp, parents, message)
+        write_commit(self.path, commit)
+        tree_hash = write_tree(self.path, index)
+        write_file(self.path + '/.lgit/snapshots/%s' % commit_id,
+                   'tree %s\n' % tree_hash)
+        add_to_path_history(self.path, commit_id, parents)
+        for entry in index.entries.values():
+            entry.committed_hash = entry.staged_hash
+        index.changed = True
+        index.flush()
+        update_branch(self.path, self.current_branch(), commit_id)
+        if merge_head:
+            unlink(self.path + '/.lgit/MERGE_HEAD')
+        return commit
+
+    def branches(self):
+        """Get the names of the branches, sorted."""
+        return list(list_branches(self.path))
+
+    def create_branch(self, name):
+        """Create a branch at the last commit of the current branch.
+
+        Raises:
+            LgitError: There is no commit yet, or the branch exists.
+        """
+        head = self.head()
+        if head is None:
+            raise LgitError("fatal: Not a valid object name: '%s'."
+                            % self.current_branch())
+        if branch_exists(self.path, name):
+            raise LgitError("fatal: A branch named '%s' already exists."
+                            % name)
+        update_branch(self.path, name, head)
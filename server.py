@@ -0,0 +1,104 @@
+"""Run many lgit commands in a single process.
+
+'lgit serve' reads commands, one per line and quoted like in a shell
+('add "a file.txt"'), on its standard input or, with --socket <path>, from
+the clients of a unix socket. Each command gets a line of JSON in reply:
+
+    {"exit": <exit status>, "stdout": <output>, "stderr": <errors>}
+
+The index and the packs stay loaded between the commands. They are read
+again when the index file or the pack directory changed on disk (another
+lgit process wrote them), or when a command failed before writing the
+changes it made to the index.
+"""
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from json import dumps
+from os import unlink
+from shlex import split
+from socket import AF_UNIX, SOCK_STREAM, socket
+import sys
+from sys import stdin, stdout
+from traceback import format_exc
+
+from index import Index
+from packs import forget_packs_if_changed
+
+
+def run_request(lgit_path, dispatch, line):
+    """Run a command line, capturing its output.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        dispatch: The function running a command, from its arguments.
+        line: The command line (without the program name).
+
+    Returns:
+        The reply to the command (a line of JSON, without the newline).
+    """
+    Index.forget_if_stale(lgit_path)
+    forget_packs_if_changed(lgit_path)
+    try:
+        argv = split(line)
+    except ValueError as error:  # The quotes of the line don't match.
+        return dumps({'exit': 1, 'stdout': '',
+                      'stderr': 'fatal: %s\n' % error})
+    output, errors = StringIO(), StringIO()
+    status = 0
+    # exit() closes sys.stdin, the commands are read from the original one:
+    sys.stdin = StringIO()
+    with redirect_stdout(output), redirect_stderr(errors):
+        try:
+            dispatch(argv)
+        except SystemExit as error:  # exit() of the command or argparse.
+            if isinstance(error.code, int):
+                status = error.code
+            elif error.code is not None:
+                print(error.code, file=errors)
+                status = 1
+        except Exception:  # Keep serving the next commands.
+            errors.write(format_exc())
+            status = 1
+    sys.stdin = stdin
+    Index.forget_if_stale(lgit_path)
+    return dumps({'exit': status, 'stdout': output.getvalue(),
+                  'stderr': errors.getvalue()})
+
+
+def serve_stdin(lgit_path, dispatch):
+    """Run the commands of the standard input until its end."""
+    for line in iter(stdin.readline, ''):
+        if line.strip():
+            stdout.write(run_request(lgit_path, dispatch, line) + '\n')
+            stdout.flush()
+
+
+def serve_socket(lgit_path, dispatch, socket_name):
+    """Run the commands of the clients of a unix socket, one at a time.
+
+    The server stops when it is interrupted.
+    """
+    server = socket(AF_UNIX, SOCK_STREAM)
+    try:
+        unlink(socket_name)
+    except FileNotFoundError:
+        pass
+    server.bind(socket_name)
+    server.listen()
+    try:
+        while True:
+            connection = server.accept()[0]
+            with connection, connection.makefile('rw') as client:
+                try:
+                    for line in iter(client.readline, ''):
+                        if line.strip():
+                            client.write(run_request(lgit_path, dispatch,
+                                                     line) + '\n')
+                            client.flush()
+                except OSError:  # The client went away.
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        unlink(socket_name)
@@ -0,0 +1,5 @@
+"""Make the lgit modules importable from the tests."""
+from os.path import abspath, dirname
+import sys
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
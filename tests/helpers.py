@@ -0,0 +1,31 @@
+"""Run lgit in temporary working directories."""
+from os import environ, makedirs
+from os.path import abspath, dirname, join
+from subprocess import run
+import sys
+
+LGIT = join(dirname(dirname(abspath(__file__))), 'lgit.py')
+
+
+def lgit(directory, *args, check=True):
+    """Run a lgit command in a directory.
+
+    Returns:
+        The CompletedProcess, with its output as text.
+    """
+    return run([sys.executable, LGIT] + list(args), cwd=directory,
+               env=dict(environ, LOGNAME='tester'), capture_output=True,
+               text=True, check=check)
+
+
+def write_files(directory, contents):
+    """Write files (creating their directories).
+
+    Args:
+        directory: The working directory.
+        contents: A dictionary of pathname -> text.
+    """
+    for path, text in contents.items():
+        makedirs(dirname(join(directory, path)), exist_ok=True)
+        with open(join(directory, path), 'w') as file:
+            file.write(text)
@@ -0,0 +1,69 @@
+"""Test the chunking of big files and the chunks shared by versions."""
+from glob import glob
+from io import BytesIO
+from os import environ
+from os.path import join
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from chunks import MAX_CHUNK_SIZE, iter_chunks
+from helpers import lgit
+
+SIZE = 4 * 1024 * 1024
+
+
+def make_data(seed=21):
+    """Get random bytes (which don't compress)."""
+    return Random(seed).randbytes(SIZE)
+
+
+class ChunksTest(TestCase):
+
+    def test_chunks_rebuild_the_data(self):
+        data = make_data()
+        chunks = list(iter_chunks(BytesIO(data)))
+        self.assertEqual(b''.join(chunks), data)
+        self.assertGreater(len(chunks), 8)
+        self.assertLessEqual(max(map(len, chunks)), MAX_CHUNK_SIZE)
+
+    def test_insertion_changes_few_chunks(self):
+        data = make_data()
+        edited = data[:SIZE // 2] + b'inserted' + data[SIZE // 2:]
+        chunks = set(iter_chunks(BytesIO(data)))
+        new_chunks = [chunk for chunk in iter_chunks(BytesIO(edited))
+                      if chunk not in chunks]
+        self.assertLessEqual(len(new_chunks), 2)
+
+
+class ChunkedFileTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        self.enterContext(patch.dict(environ, LGIT_CHUNK_THRESHOLD='1048576'))
+        lgit(self.directory, 'init')
+
+    def write(self, data):
+        with open(join(self.directory, 'big'), 'wb') as file:
+            file.write(data)
+
+    def count_objects(self):
+        return len(glob(join(self.directory, '.lgit/objects/??/*')))
+
+    def test_edit_adds_only_a_few_objects(self):
+        data = make_data()
+        self.write(data)
+        lgit(self.directory, 'add', 'big')
+        lgit(self.directory, 'commit', '-m', 'first')
+        lgit(self.directory, 'branch', 'first')
+        first_count = self.count_objects()
+        self.assertGreater(first_count, 10)  # Stored as chunks.
+        self.write(data[:SIZE // 2] + b'inserted' + data[SIZE // 2:])
+        lgit(self.directory, 'add', 'big')
+        lgit(self.directory, 'commit', '-m', 'second')
+        # The new chunks, the manifest and the tree:
+        self.assertLessEqual(self.count_objects() - first_count, 4)
+        lgit(self.directory, 'checkout', 'first')
+        with open(join(self.directory, 'big'), 'rb') as file:
+            self.assertEqual(file.read(), data)
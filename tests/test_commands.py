@@ -0,0 +1,155 @@
+"""Test the lgit commands through the command line."""
+from os import chmod, getuid, mkdir
+from os.path import exists, join
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipIf
+
+from helpers import lgit, write_files
+
+
+class RmTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        write_files(self.directory, {'a': 'a', 'b': 'b', 'd/c': 'c'})
+        lgit(self.directory, 'add', '.')
+
+    def test_only_exclusions_need_recursive(self):
+        result = lgit(self.directory, 'rm', ':!a', check=False)
+        self.assertIn("not removing '.' recursively", result.stderr)
+        self.assertEqual(lgit(self.directory, 'ls-files').stdout,
+                         'a\nb\nd/c\n')
+        self.assertTrue(exists(join(self.directory, 'b')))
+
+    def test_only_exclusions_with_recursive(self):
+        lgit(self.directory, 'rm', '-r', ':!a')
+        self.assertEqual(lgit(self.directory, 'ls-files').stdout, 'a\n')
+        self.assertFalse(exists(join(self.directory, 'd/c')))
+
+
+@skipIf(getuid() == 0, 'root reads any directory')
+class UnreadableDirectoryTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        write_files(self.directory, {'a': 'a\n', 'd/b': 'b\n'})
+        mkdir(join(self.directory, 'locked'), 0)
+        self.addCleanup(chmod, join(self.directory, 'locked'), 0o755)
+
+    def test_status_skips_the_directory(self):
+        status = lgit(self.directory, 'status').stdout
+        self.assertIn('a\n', status)
+        self.assertIn('d/b\n', status)
+
+    def test_add_skips_the_directory(self):
+        lgit(self.directory, 'add', '.')
+        self.assertEqual(lgit(self.directory, 'ls-files').stdout,
+                         'a\nd/b\n')
+        # Read again once it is readable:
+        chmod(join(self.directory, 'locked'), 0o755)
+        write_files(self.directory, {'locked/c': 'c\n'})
+        lgit(self.directory, 'add', '.')
+        self.assertEqual(lgit(self.directory, 'ls-files').stdout,
+                         'a\nd/b\nlocked/c\n')
+
+
+class StashTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        write_files(self.directory, {'a': 'a\n'})
+        lgit(self.directory, 'add', 'a')
+        lgit(self.directory, 'commit', '-m', 'first')
+        write_files(self.directory, {'a': 'stashed\n'})
+        lgit(self.directory, 'stash', 'push')
+
+    def test_pop_refuses_to_overwrite_changes(self):
+        write_files(self.directory, {'a': 'local\n'})
+        result = lgit(self.directory, 'stash', 'pop', check=False)
+        self.assertNotEqual(result.returncode, 0)
+        with open(join(self.directory, 'a')) as file:
+            self.assertEqual(file.read(), 'local\n')
+        self.assertTrue(lgit(self.directory, 'stash', 'list').stdout)
+
+
+class MergeTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        write_files(self.directory, {'a': 'a\n', 'b': 'b\n'})
+        lgit(self.directory, 'add', '.')
+        lgit(self.directory, 'commit', '-m', 'first')
+        lgit(self.directory, 'branch', 'other')
+        lgit(self.directory, 'checkout', 'other')
+        write_files(self.directory, {'a': 'a2\n'})
+        lgit(self.directory, 'add', 'a')
+        lgit(self.directory, 'commit', '-m', 'other')
+        lgit(self.directory, 'checkout', 'master')
+        write_files(self.directory, {'b': 'b2\n'})
+        lgit(self.directory, 'add', 'b')
+        lgit(self.directory, 'commit', '-m', 'master')
+
+    def test_staged_changes_are_refused(self):
+        write_files(self.directory, {'c': 'c\n'})
+        lgit(self.directory, 'add', 'c')
+        head = lgit(self.directory, 'log', '-n', '1').stdout
+        result = lgit(self.directory, 'merge', 'other', check=False)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('\tc\n', result.stdout)
+        self.assertFalse(exists(join(self.directory, '.lgit/MERGE_HEAD')))
+        self.assertEqual(lgit(self.directory, 'log', '-n', '1').stdout, head)
+
+    def test_clean_index_is_merged(self):
+        result = lgit(self.directory, 'merge', 'other')
+        self.assertIn("Merge made by the 'three-way' strategy.",
+                      result.stdout)
+        with open(join(self.directory, 'a')) as file:
+            self.assertEqual(file.read(), 'a2\n')
+
+    def test_overwritten_changes_are_refused(self):
+        write_files(self.directory, {'a': 'local\n'})
+        result = lgit(self.directory, 'merge', 'other', check=False)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('\ta\n', result.stdout)
+        with open(join(self.directory, 'a')) as file:
+            self.assertEqual(file.read(), 'local\n')
+        result = lgit(self.directory, 'checkout', 'other', check=False)
+        self.assertNotEqual(result.returncode, 0)
+
+    def test_conflict_is_left_to_resolve(self):
+        write_files(self.directory, {'a': 'a3\n'})
+        lgit(self.directory, 'add', 'a')
+        lgit(self.directory, 'commit', '-m', 'conflicting')
+        result = lgit(self.directory, 'merge', 'other', check=False)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('CONFLICT (content): Merge conflict in a',
+                      result.stdout)
+        with open(join(self.directory, 'a')) as file:
+            self.assertEqual(file.read(), '<<<<<<< master\na3\n=======\n'
+                             'a2\n>>>>>>> other\n')
+        self.assertTrue(exists(join(self.directory, '.lgit/MERGE_HEAD')))
+        result = lgit(self.directory, 'merge', 'other', check=False)
+        self.assertIn('You have not concluded your merge', result.stderr)
+        write_files(self.directory, {'a': 'a4\n'})
+        lgit(self.directory, 'add', 'a')
+        lgit(self.directory, 'commit', '-m', 'resolved')
+        self.assertFalse(exists(join(self.directory, '.lgit/MERGE_HEAD')))
+        # The merged commit is a parent of the resolution:
+        self.assertIn('    other\n', lgit(self.directory, 'log').stdout)
+
+
+class TraceTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        write_files(self.directory, {'d/a': 'a\n'})
+
+    def test_default_file_is_in_the_repository(self):
+        lgit(join(self.directory, 'd'), '--trace', 'status')
+        self.assertTrue(exists(join(self.directory, '.lgit/trace.json')))
+        self.assertFalse(exists(join(self.directory, 'd/.lgit')))
@@ -0,0 +1,94 @@
+"""Test the line diff and its unified format."""
+from itertools import product
+from random import Random
+from unittest import TestCase
+
+from diff import iter_hunks, iter_matches, iter_unified_diff
+
+
+def lcs_length(a, b):
+    """Get the length of the longest common subsequence of two lists."""
+    previous = [0] * (len(b) + 1)
+    for item in a:
+        current = [0]
+        for j, other in enumerate(b):
+            current.append(previous[j] + 1 if item == other
+                           else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def small_cases():
+    """Yield every pair of lists of at most 4 lines out of 3."""
+    lists = [list(items) for length in range(5)
+             for items in product('abc', repeat=length)]
+    return product(lists, lists)
+
+
+def random_cases(count=200):
+    """Yield pairs of longer lists, the second one edited from the first."""
+    random = Random(19)
+    for _ in range(count):
+        a = [random.choice('abcde') for _ in range(random.randrange(40))]
+        b = list(a)
+        for _ in range(random.randrange(8)):
+            position = random.randrange(len(b) + 1)
+            if b and random.random() < 0.5:
+                del b[position:position + random.randrange(1, 4)]
+            else:
+                b[position:position] = random.choice('abcdef')
+        yield a, b
+
+
+class MatchesTest(TestCase):
+
+    def check(self, a, b):
+        """Check the matches are in order and as many as the LCS."""
+        i = j = matched = 0
+        for match_i, match_j, length in iter_matches(a, b):
+            self.assertGreater(length, 0)
+            self.assertGreaterEqual(match_i, i)
+            self.assertGreaterEqual(match_j, j)
+            self.assertEqual(a[match_i:match_i + length],
+                             b[match_j:match_j + length])
+            i, j = match_i + length, match_j + length
+            matched += length
+        self.assertEqual(matched, lcs_length(a, b), (a, b))
+
+    def test_small_cases_match_lcs(self):
+        for a, b in small_cases():
+            self.check(a, b)
+
+    def test_random_cases_match_lcs(self):
+        for a, b in random_cases():
+            self.check(a, b)
+
+    def test_hunks_rebuild_the_new_version(self):
+        for a, b in random_cases():
+            for context in (0, 3):
+                rebuilt = []
+                position = 0
+                for a_start, a_count, _, _, lines in iter_hunks(
+                        a, b, context):
+                    rebuilt += a[position:a_start]
+                    rebuilt += [line for tag, line in lines if tag != '-']
+                    position = a_start + a_count
+                self.assertEqual(rebuilt + a[position:], b, (a, b))
+
+
+class UnifiedDiffTest(TestCase):
+
+    def test_empty_file_is_not_dev_null(self):
+        lines = list(iter_unified_diff('e', b'', b'x\n'))
+        self.assertIn('--- a/e', lines)
+        self.assertIn('+++ b/e', lines)
+        self.assertNotIn('new file', lines)
+
+    def test_new_file_is_dev_null(self):
+        lines = list(iter_unified_diff('n', None, b'x\n'))
+        self.assertIn('new file', lines)
+        self.assertIn('--- /dev/null', lines)
+
+    def test_deleted_binary_file(self):
+        lines = list(iter_unified_diff('b', b'\0', None))
+        self.assertEqual(lines[-1], 'Binary files a/b and /dev/null differ')
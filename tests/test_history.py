@@ -0,0 +1,50 @@
+"""Test 'lgit log -- <path>' and the path history behind it."""
+from os import unlink
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from helpers import lgit, write_files
+
+
+class PathLogTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        for message, files in (('add a', {'a': '1\n'}),
+                               ('add d/b', {'d/b': '1\n'}),
+                               ('add d.txt', {'d.txt': '1\n'}),
+                               ('change a, d/b', {'a': '2\n', 'd/b': '2\n'}),
+                               ('add d/e/f', {'d/e/f': '1\n'})):
+            write_files(self.directory, files)
+            lgit(self.directory, 'add', '.')
+            lgit(self.directory, 'commit', '-m', message)
+
+    def messages(self, *paths):
+        """Get the messages of the commits listed by 'log -- paths'."""
+        output = lgit(self.directory, 'log', '--', *paths).stdout
+        return [line[4:] for line in output.split('\n')
+                if line.startswith('    ')]
+
+    def test_file(self):
+        self.assertEqual(self.messages('a'), ['change a, d/b', 'add a'])
+
+    def test_directory(self):
+        self.assertEqual(self.messages('d'),
+                         ['add d/e/f', 'change a, d/b', 'add d/b'])
+        self.assertEqual(self.messages('d/e'), ['add d/e/f'])
+
+    def test_several_paths(self):
+        self.assertEqual(self.messages('d.txt', 'd/e/f'),
+                         ['add d/e/f', 'add d.txt'])
+
+    def test_untracked_path(self):
+        self.assertEqual(self.messages('missing'), [])
+
+    def test_rebuilt_history(self):
+        expected = self.messages('d')
+        lgit(self.directory, 'gc')
+        self.assertEqual(self.messages('d'), expected)
+        unlink(join(self.directory, '.lgit/path-history'))
+        self.assertEqual(self.messages('d'), expected)
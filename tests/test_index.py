@@ -0,0 +1,56 @@
+"""Test the binary index file and its mapped lookups."""
+from bisect import bisect_left
+from hashlib import sha1
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from helpers import lgit
+from index import Index, IndexEntry, IndexMap, list_index_paths
+from pathspec import Pathspec
+
+PATHS = ['a', 'a.txt', 'a/b', 'a/c/d', 'b-c', 'b/c', 'z', 'é/f']
+
+
+class IndexFileTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        index = Index(self.directory)
+        for number, path in enumerate(reversed(PATHS)):
+            index.add(IndexEntry(path, sha1(path.encode()).hexdigest(),
+                                 (number, number * 10, number + 1, number),
+                                 committed_hash=sha1(b'old').hexdigest()))
+        index.flush()
+
+    def test_entries_are_read_back(self):
+        index = Index(self.directory)
+        self.assertEqual(index.paths(), sorted(PATHS))
+        for number, path in enumerate(reversed(PATHS)):
+            entry = index.get(path)
+            self.assertEqual(entry.staged_hash,
+                             sha1(path.encode()).hexdigest())
+            self.assertEqual(entry.committed_hash, sha1(b'old').hexdigest())
+            self.assertEqual(entry.stat_data,
+                             (number, number * 10, number + 1, number))
+
+    def test_map_lists_the_sorted_paths(self):
+        with IndexMap(self.directory + '/.lgit/index') as index_map:
+            self.assertEqual(len(index_map), len(PATHS))
+            self.assertEqual(list(index_map.paths()), sorted(PATHS))
+            self.assertEqual(list(index_map.paths(2, 4)), sorted(PATHS)[2:4])
+
+    def test_map_bisect(self):
+        keys = sorted(PATHS)
+        with IndexMap(self.directory + '/.lgit/index') as index_map:
+            for key in PATHS + ['', '0', 'a/', 'a0', 'b', 'zz', 'é']:
+                self.assertEqual(index_map.bisect(key),
+                                 bisect_left(keys, key), key)
+
+    def test_pathspec_reads_only_its_ranges(self):
+        self.assertEqual(list_index_paths(self.directory, Pathspec(['a'])),
+                         ['a', 'a/b', 'a/c/d'])
+        self.assertEqual(
+            list_index_paths(self.directory, Pathspec(['*/c*', ':!a'])),
+            ['b/c'])
+        self.assertEqual(list_index_paths(self.directory), sorted(PATHS))
@@ -0,0 +1,61 @@
+"""Test the storage of the objects and packs."""
+from glob import glob
+from hashlib import sha1
+from os import listdir, stat, umask, unlink
+from os.path import join
+from stat import S_IMODE
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from helpers import lgit, write_files
+
+
+class ModeTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        previous = umask(0o022)
+        self.addCleanup(umask, previous)
+
+    def mode(self, path):
+        return S_IMODE(stat(join(self.directory, path)).st_mode)
+
+    def test_files_follow_the_umask(self):
+        lgit(self.directory, 'init')
+        write_files(self.directory, {'a': 'a\n'})
+        lgit(self.directory, 'add', 'a')
+        lgit(self.directory, 'commit', '-m', 'first')
+        self.assertEqual(self.mode('.lgit/index'), 0o644)
+        objects = glob(join(self.directory, '.lgit/objects/??/*'))
+        self.assertTrue(objects)
+        for path in objects:
+            self.assertEqual(self.mode(path), 0o444)
+        lgit(self.directory, 'gc')
+        for path in glob(join(self.directory, '.lgit/objects/pack/*')):
+            self.assertEqual(self.mode(path), 0o444)
+
+
+class CheckoutTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        write_files(self.directory, {'a': 'first\n'})
+        lgit(self.directory, 'add', 'a')
+        lgit(self.directory, 'commit', '-m', 'first')
+        lgit(self.directory, 'branch', 'b')
+        lgit(self.directory, 'checkout', 'b')
+        write_files(self.directory, {'a': 'second\n'})
+        lgit(self.directory, 'add', 'a')
+        lgit(self.directory, 'commit', '-m', 'second')
+
+    def test_missing_object_keeps_the_working_file(self):
+        hash_value = sha1(b'first\n').hexdigest()
+        unlink(join(self.directory, '.lgit/objects', hash_value[:2],
+                    hash_value[2:]))
+        result = lgit(self.directory, 'checkout', 'master', check=False)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn(hash_value, result.stderr)
+        with open(join(self.directory, 'a')) as file:
+            self.assertEqual(file.read(), 'second\n')
+        self.assertEqual(sorted(listdir(self.directory)), ['.lgit', 'a'])
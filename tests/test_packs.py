@@ -0,0 +1,76 @@
+"""Test the packs and the deltas between the versions of a file."""
+from glob import glob
+from hashlib import sha1
+from os.path import join
+from re import search
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from helpers import lgit, write_files
+from objects import read_object
+from packs import apply_delta, create_delta, forget_packs
+
+LINES = ['line %d of the file, long enough to be copied\n' % number
+         for number in range(200)]
+
+
+def make_version(number):
+    """Get the text of a version of the file, one line changed each time."""
+    lines = list(LINES)
+    for changed in range(number):
+        lines[changed * 10] = 'version %d\n' % changed
+    return ''.join(lines)
+
+
+class DeltaTest(TestCase):
+
+    def test_round_trip(self):
+        base = make_version(0).encode()
+        for target in (make_version(3).encode(), base, b'', b'new\n',
+                       base[:100], base + b'no newline'):
+            self.assertEqual(apply_delta(base, create_delta(base, target)),
+                             target)
+        self.assertEqual(apply_delta(b'', create_delta(b'', base)), base)
+
+    def test_delta_of_a_small_change_is_small(self):
+        base = make_version(0).encode()
+        target = make_version(1).encode()
+        self.assertLess(len(create_delta(base, target)), 100)
+
+
+class RepackTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        for number in range(5):
+            write_files(self.directory, {'f': make_version(number)})
+            lgit(self.directory, 'add', 'f')
+            lgit(self.directory, 'commit', '-m', 'version %d' % number)
+
+    def repack(self, depth):
+        """Pack the objects, then check every version can be read.
+
+        Returns:
+            The number of objects stored as deltas.
+        """
+        output = lgit(self.directory, 'gc', '--depth', str(depth)).stdout
+        self.assertFalse(glob(join(self.directory, '.lgit/objects/??')))
+        self.assertEqual(
+            len(glob(join(self.directory, '.lgit/objects/pack/*.pack'))), 1)
+        # The pack written by gc, not the one mapped before:
+        forget_packs(self.directory)
+        for number in range(5):
+            text = make_version(number).encode()
+            self.assertEqual(read_object(self.directory,
+                                         sha1(text).hexdigest()), text)
+        return int(search(r'\(delta (\d+)\)', output).group(1))
+
+    def test_depth_limits_the_chains(self):
+        # A chain of depth d, then a whole version, then a new chain:
+        self.assertEqual(self.repack(0), 0)
+        self.assertEqual(self.repack(1), 2)
+        self.assertEqual(self.repack(2), 3)
+        self.assertEqual(self.repack(10), 4)
+        self.assertEqual(lgit(self.directory, 'log').stdout.count(
+            'version '), 5)
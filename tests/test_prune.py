@@ -0,0 +1,60 @@
+"""Test deleting the unreachable objects with 'lgit gc --prune'."""
+from hashlib import sha1
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from helpers import lgit, write_files
+from objects import object_exists
+from packs import forget_packs
+
+
+def blob_hash(text):
+    """Get the SHA1 of a blob (the SHA1 of its contents)."""
+    return sha1(text.encode()).hexdigest()
+
+
+class PruneTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.enterContext(TemporaryDirectory())
+        lgit(self.directory, 'init')
+        write_files(self.directory, {'a': 'first\n', 'd/b': 'b\n'})
+        lgit(self.directory, 'add', '.')
+        lgit(self.directory, 'commit', '-m', 'first')
+        # Added, then replaced before any commit:
+        write_files(self.directory, {'a': 'replaced\n'})
+        lgit(self.directory, 'add', 'a')
+        write_files(self.directory, {'a': 'second\n'})
+        lgit(self.directory, 'add', 'a')
+        lgit(self.directory, 'commit', '-m', 'second')
+        write_files(self.directory, {'a': 'stashed\n'})
+        lgit(self.directory, 'stash', 'push')
+        write_files(self.directory, {'d/b': 'staged\n'})
+        lgit(self.directory, 'add', 'd/b')
+
+    def exists(self, text):
+        forget_packs(self.directory)
+        return object_exists(self.directory, blob_hash(text))
+
+    def test_only_unreachable_objects_are_pruned(self):
+        result = lgit(self.directory, 'gc', '--prune', '--grace-period', '0')
+        self.assertIn('Pruning 1 objects and 0 commits', result.stdout)
+        self.assertFalse(self.exists('replaced\n'))
+        for text in ('first\n', 'second\n', 'b\n', 'stashed\n', 'staged\n'):
+            self.assertTrue(self.exists(text), text)
+        self.assertEqual(lgit(self.directory, 'log').stdout.count(
+            'Author: '), 2)
+        lgit(self.directory, 'stash', 'pop')
+        with open(self.directory + '/a') as file:
+            self.assertEqual(file.read(), 'stashed\n')
+
+    def test_grace_period_keeps_new_objects(self):
+        result = lgit(self.directory, 'gc', '--prune')
+        self.assertIn('Pruning 0 objects', result.stdout)
+        self.assertTrue(self.exists('replaced\n'))
+
+    def test_dry_run_deletes_nothing(self):
+        result = lgit(self.directory, 'gc', '--prune', '-n',
+                      '--grace-period', '0')
+        self.assertIn('Would prune 1 objects', result.stdout)
+        self.assertTrue(self.exists('replaced\n'))
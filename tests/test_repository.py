@@ -0,0 +1,23 @@
+"""Test the Python API of lgit."""
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from helpers import lgit, write_files
+from repository import LgitError, Repository
+
+
+class ErrorTest(TestCase):
+
+    def test_corrupt_index_raises_lgit_error(self):
+        with TemporaryDirectory() as directory:
+            lgit(directory, 'init')
+            write_files(directory, {'a': 'a'})
+            lgit(directory, 'add', 'a')
+            with open(join(directory, '.lgit/index'), 'r+b') as index:
+                index.seek(-1, 2)
+                index.write(b'!')
+            with self.assertRaisesRegex(LgitError, 'index file corrupt'):
+                Repository(directory).status()
+            result = lgit(directory, 'status', check=False)
+            self.assertEqual(result.stderr, 'fatal: index file corrupt\n')
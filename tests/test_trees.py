@@ -0,0 +1,21 @@
+"""Test the trees written for the snapshots of the commits."""
+from os import listdir
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from helpers import lgit, write_files
+from trees import read_snapshot
+
+
+class WriteTreeTest(TestCase):
+
+    def test_nested_sibling_directories(self):
+        with TemporaryDirectory() as directory:
+            lgit(directory, 'init')
+            write_files(directory, {'x/a/z': 'z', 'x/b': 'b'})
+            lgit(directory, 'add', '.')
+            lgit(directory, 'commit', '-m', 'nested')
+            commit, = listdir(join(directory, '.lgit/commits'))
+            self.assertEqual(sorted(read_snapshot(directory, commit)),
+                             ['x/a/z', 'x/b'])
@@ -0,0 +1,133 @@
+"""Measure where the time of a command goes.
+
+With 'lgit --trace <command>' or LGIT_TRACE=<file>, the phases of the
+command (walking the working directory, hashing, copying, reading and
+writing the index...) are timed, and the I/O is counted: files stat'ed and
+hashed, directories read, bytes read and written, index rewrites.
+
+The trace is written when the command ends, in the file of LGIT_TRACE (by
+default .lgit/trace.json of the repository, out of the files lgit tracks),
+in the Chrome trace event format: open it in chrome://tracing or
+https://ui.perfetto.dev. Each phase is a complete event ("ph": "X") of the
+thread which ran it, the counters are a counter event ("ph": "C") at the
+end and are also in "otherData". A trace which can't be written is
+reported, the command still succeeds.
+
+Tracing is off by default, then span() and count() do nearly nothing.
+"""
+from functools import wraps
+from json import dump
+from os import getpid
+from sys import argv, stderr
+from threading import Lock, get_ident
+from time import perf_counter_ns, time
+
+DEFAULT_TRACE_FILE = '.lgit/trace.json'
+
+_trace = None  # The Trace being recorded, if any.
+
+
+class Trace:
+    """The spans and counters recorded since tracing started."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.start_ns = perf_counter_ns()
+        self.start_time = time()
+        self.events = []
+        self.counters = {}
+        self.lock = Lock()  # The commands hash files in threads.
+
+    def add_span(self, name, begin_ns, end_ns, args):
+        """Record a phase which ran from begin_ns to end_ns."""
+        event = {'name': name, 'ph': 'X', 'pid': getpid(),
+                 'tid': get_ident(), 'ts': (begin_ns - self.start_ns) / 1000,
+                 'dur': (end_ns - begin_ns) / 1000}
+        if args:
+            event['args'] = args
+        with self.lock:
+            self.events.append(event)
+
+    def count(self, name, value):
+        """Add value to a counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def write(self):
+        """Write the trace file."""
+        end = (perf_counter_ns() - self.start_ns) / 1000
+        events = self.events + [{'name': 'io', 'ph': 'C', 'pid': getpid(),
+                                 'ts': end, 'args': self.counters}]
+        try:
+            with open(self.file_name, 'w') as trace_file:
+                dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                      'otherData': {'command': ' '.join(argv[1:]),
+                                    'start_time': self.start_time,
+                                    'counters': self.counters}},
+                     trace_file)
+        except OSError as error:
+            print('warning: unable to write the trace: %s' % error,
+                  file=stderr)
+
+
+def start_tracing(file_name=DEFAULT_TRACE_FILE):
+    """Start recording the spans and counters of the process."""
+    global _trace
+    _trace = Trace(file_name)
+
+
+def is_tracing():
+    """Check if the spans and counters are being recorded."""
+    return _trace is not None
+
+
+def stop_tracing():
+    """Stop recording, and write the trace file if tracing was started."""
+    global _trace
+    if _trace is not None:
+        _trace.write()
+        _trace = None
+
+
+class span:
+    """Time a phase of a command, as a context manager.
+
+    Args:
+        name: The name of the phase.
+        **args: Details of the phase to show in the trace.
+    """
+
+    __slots__ = ('name', 'args', 'begin_ns')
+
+    def __init__(self, name, **args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        if _trace is not None:
+            self.begin_ns = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        if _trace is not None:
+            _trace.add_span(self.name, self.begin_ns, perf_counter_ns(),
+                            self.args)
+
+
+def traced(name):
+    """Time each call of a function, as a decorator."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _trace is None:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """Add value to a counter (files_hashed, bytes_read...)."""
+    if _trace is not None:
+        _trace.count(name, value)
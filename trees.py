@@ -0,0 +1,192 @@
+"""Record the snapshots of the commits as trees of objects.
+
+A tree object lists the content of a directory, one line per file or
+subdirectory, sorted by name: 'blob <SHA1> <name>' or 'tree <SHA1> <name>'.
+A directory whose files didn't change keeps the same tree, so a commit only
+writes the trees of the directories that changed.
+
+The snapshot of a commit (.lgit/snapshots/<commit>) is then the line
+'tree <SHA1>' of the root tree. The snapshots of the first versions of lgit
+list every file ('<SHA1> <pathname>' per line), they are still read.
+"""
+from os.path import dirname
+
+from functions import read_file
+from objects import read_object, store_object
+from tracing import traced
+
+
+@traced('write tree')
+def write_tree(lgit_path, index):
+    """Write the trees of the staged files.
+
+    The trees still in the cache of the index are reused, the other ones
+    are written and added to the cache.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        index: The Index of the lgit directory.
+
+    Returns:
+        The SHA1 of the root tree.
+    """
+    # The files and the subdirectories of each directory:
+    files = {}
+    subdirectories = {}
+    registered = set()
+    for entry in index.entries.values():
+        directory = dirname(entry.path)
+        files.setdefault(directory, []).append(entry)
+        # Register the directory in its parents:
+        while directory and directory not in registered:
+            registered.add(directory)
+            parent = dirname(directory)
+            subdirectories.setdefault(parent, []).append(directory)
+            directory = parent
+
+    def _write_directory(directory):
+        """Write the tree of a directory (after the ones it contains)."""
+        if directory in index.cache_tree:
+            return index.cache_tree[directory]
+        lines = [('blob', entry.staged_hash, entry.path.rsplit('/', 1)[-1])
+                 for entry in files.get(directory, [])]
+        for subdirectory in subdirectories.get(directory, []):
+            lines.append(('tree', _write_directory(subdirectory),
+                          subdirectory.rsplit('/', 1)[-1]))
+        lines.sort(key=lambda line: line[2])
+        content = ''.join('%s %s %s\n' % line for line in lines)
+        hash_value = store_object(lgit_path, content.encode(), 'tree')
+        index.cache_tree[directory] = hash_value
+        index.changed = True
+        return hash_value
+
+    return _write_directory('')
+
+
+def read_tree(lgit_path, tree_hash):
+    """Read a tree object.
+
+    Returns:
+        The list of (type, SHA1, name) of the tree, sorted by name.
+    """
+    lines = read_object(lgit_path, tree_hash).decode().split('\n')
+    return [tuple(line.split(' ', 2)) for line in lines if line]
+
+
+def _read_tree_names(lgit_path, tree_hash):
+    """Read a tree object (or None for no tree) by name.
+
+    Returns:
+        A dictionary of name -> (type, SHA1).
+    """
+    if not tree_hash:
+        return {}
+    return {name: (object_type, hash_value) for object_type, hash_value, name
+            in read_tree(lgit_path, tree_hash)}
+
+
+def iter_tree_files(lgit_path, tree_hash, prefix=''):
+    """Yield the (pathname, SHA1) of the files in a tree, recursively."""
+    for object_type, hash_value, name in read_tree(lgit_path, tree_hash):
+        if object_type == 'tree':
+            yield from iter_tree_files(lgit_path, hash_value,
+                                       prefix + name + '/')
+        else:
+            yield prefix + name, hash_value
+
+
+def get_snapshot_tree(lgit_path, commit):
+    """Get the SHA1 of the root tree of a commit.
+
+    Returns:
+        The SHA1, or None if the snapshot is a list of files.
+    """
+    content = read_file(lgit_path + '/.lgit/snapshots/%s' % commit) or ''
+    if content.startswith('tree '):
+        return content[5:45]
+    return None
+
+
+def read_snapshot(lgit_path, commit):
+    """Read the files of the snapshot of a commit.
+
+    Returns:
+        A dictionary of pathname -> SHA1.
+    """
+    if not commit:
+        return {}
+    content = read_file(lgit_path + '/.lgit/snapshots/%s' % commit) or ''
+    if content.startswith('tree '):
+        return dict(iter_tree_files(lgit_path, content[5:45]))
+    return {line[41:]: line[:40] for line in content.split('\n') if line}
+
+
+def diff_trees(lgit_path, old_tree, new_tree, prefix=''):
+    """Compare two trees, skipping the subtrees with the same SHA1.
+
+    Args:
+        lgit_path: The directory that has .lgit directory in it.
+        old_tree, new_tree: The SHA1s of the trees (or None for no tree).
+        prefix: The pathname of the directory of the trees.
+
+    Yields:
+        (pathname, old SHA1, new SHA1) of the files which differ, with None
+            for a file missing in a tree.
+    """
+    if old_tree == new_tree:
+        return
+    old_lines = _read_tree_names(lgit_path, old_tree)
+    new_lines = _read_tree_names(lgit_path, new_tree)
+    for name in sorted(set(old_lines) | set(new_lines)):
+        if old_lines.get(name) == new_lines.get(name):
+            continue
+        old_type, old_hash = old_lines.get(name, (None, None))
+        new_type, new_hash = new_lines.get(name, (None, None))
+        path = prefix + name
+        # A subtree is compared recursively, a blob directly:
+        yield from diff_trees(lgit_path,
+                              old_hash if old_type == 'tree' else None,
+                              new_hash if new_type == 'tree' else None,
+                              path + '/')
+        if old_type == 'blob' or new_type == 'blob':
+            yield (path, old_hash if old_type == 'blob' else None,
+                   new_hash if new_type == 'blob' else None)
+
+
+def diff_snapshot_and_tree(lgit_path, commit, tree_hash):
+    """Compare the snapshot of a commit (or None for no commit) with a tree.
+
+    Yields:
+        (pathname, SHA1 in the commit, SHA1 in the tree) of the files which
+            differ, with None for a file missing on a side.
+    """
+    commit_tree = commit and get_snapshot_tree(lgit_path, commit)
+    if commit_tree or not commit:
+        yield from diff_trees(lgit_path, commit_tree, tree_hash)
+        return
+    # The snapshot is a list of files:
+    old_files = read_snapshot(lgit_path, commit)
+    new_files = dict(iter_tree_files(lgit_path, tree_hash))
+    for path in sorted(set(old_files) | set(new_files)):
+        if old_files.get(path) != new_files.get(path):
+            yield path, old_files.get(path), new_files.get(path)
+
+
+def diff_snapshots(lgit_path, old_commit, new_commit):
+    """Compare the snapshots of two commits (or None for no commit).
+
+    Yields:
+        (pathname, old SHA1, new SHA1) of the files which differ, with None
+            for a file missing in a snapshot.
+    """
+    old_tree = old_commit and get_snapshot_tree(lgit_path, old_commit)
+    new_tree = new_commit and get_snapshot_tree(lgit_path, new_commit)
+    if (old_tree or not old_commit) and (new_tree or not new_commit):
+        yield from diff_trees(lgit_path, old_tree, new_tree)
+        return
+    # One of the snapshots is a list of files:
+    old_files = read_snapshot(lgit_path, old_commit)
+    new_files = read_snapshot(lgit_path, new_commit)
+    for path in sorted(set(old_files) | set(new_files)):
+        if old_files.get(path) != new_files.get(path):
+            yield path, old_files.get(path), new_files.get(path)
@@ -0,0 +1,261 @@
+"""Walk the working directory, skipping the ignored files.
+
+A .lgitignore file in any directory lists patterns of files to be ignored,
+one per line, like git's .gitignore:
+
+    - blank lines and lines starting with '#' are skipped
+    - a pattern starting with '!' re-includes the files it matches
+    - a pattern ending with '/' only matches directories
+    - a pattern containing a '/' (not at its end) matches pathnames relative
+      to the directory of the .lgitignore, any other pattern matches names
+      at any depth
+    - '*' and '?' match anything but '/', '**' matches any directories
+
+The last matching pattern wins, the patterns of a deeper .lgitignore win
+over the ones of its parents. An ignored directory is never walked, so
+nothing in it can be re-included.
+
+The untracked cache (.lgit/untracked-cache) remembers the content of each
+directory with its modification time: a directory whose modification time
+didn't change (no file was created, removed or renamed in it) isn't read
+again.
+"""
+from json import dump, load
+from os import replace, scandir, stat
+from os.path import join
+from re import compile as compile_regex, escape
+
+from tracing import count, traced
+
+IGNORE_FILE = '.lgitignore'
+CACHE_VERSION = 1
+
+
+def translate_glob(pattern):
+    """Translate a glob pattern to a regular expression (as a string)."""
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            content = pattern[i + 1:end].replace('\\', '\\\\')
+            if content.startswith('!'):
+                content = '^' + content[1:]
+            regex += '[%s]' % content
+            i = end + 1
+        else:
+            regex += escape(pattern[i])
+            i += 1
+    return regex
+
+
+class IgnoreRules:
+    """The patterns of the .lgitignore files of a directory and its parents.
+
+    Each pattern is stored as (regular expression, is negated, only matches
+    directories), with the directory of its .lgitignore.
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = list(patterns)
+
+    def add_file(self, directory):
+        """Get the rules with the patterns of directory/.lgitignore added.
+
+        Args:
+            directory: The directory, relative to the working directory
+                ('' for the working directory itself).
+
+        Returns:
+            These rules if there is no .lgitignore file, else new rules.
+        """
+        try:
+            with open(join(directory, IGNORE_FILE)) as ignore_file:
+                lines = ignore_file.read().split('\n')
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return self
+        patterns = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            only_directory = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            if '/' in line:
+                regex = translate_glob(line.lstrip('/'))
+                if directory:
+                    regex = escape(directory + '/') + regex
+            else:
+                regex = '(?:.*/)?' + translate_glob(line)
+                if directory:
+                    regex = escape(directory + '/') + regex
+            patterns.append((compile_regex(regex + '$'), negated,
+                             only_directory))
+        return IgnoreRules(self.patterns + patterns)
+
+    @classmethod
+    def for_directory(cls, directory):
+        """Get the rules of a directory, read from all its .lgitignore."""
+        rules = cls().add_file('')
+        parts = [part for part in directory.split('/')
+                 if part not in ('', '.')]
+        for i in range(len(parts)):
+            rules = rules.add_file('/'.join(parts[:i + 1]))
+        return rules
+
+    def is_ignored(self, path, is_directory=False):
+        """Check if a pathname, relative to the working directory, is ignored.
+        """
+        ignored = False
+        for regex, negated, only_directory in self.patterns:
+            if only_directory and not is_directory:
+                continue
+            if regex.match(path):
+                ignored = not negated
+        return ignored
+
+
+class UntrackedCache:
+    """The content of the directories at their last walk."""
+
+    def __init__(self, lgit_path, changed_paths=None):
+        self.file_name = lgit_path + '/.lgit/untracked-cache'
+        self.changed_paths = changed_paths
+        self.directories = {}
+        self.written_ns = 0
+        self.changed = False
+        try:
+            with open(self.file_name) as cache:
+                content = load(cache)
+            if content.get('version') == CACHE_VERSION:
+                self.directories = content['directories']
+                self.written_ns = stat(self.file_name).st_mtime_ns
+        except (FileNotFoundError, PermissionError, ValueError):
+            pass
+
+    def list_directory(self, directory):
+        """Get the names of the files and subdirectories of a directory.
+
+        The cached content is used if the directory didn't change since it
+        was cached (and wasn't changed in the same second as the cache was
+        written, a later change in that second would keep the same time).
+        With the changed paths of the file system monitor, the directories
+        it didn't report aren't even stat'ed.
+
+        Returns:
+            The list of the files and the list of the subdirectories.
+        """
+        cached = self.directories.get(directory)
+        if (cached and self.changed_paths is not None and
+                not self.changed_paths.directory_changed(directory)):
+            return cached[1], cached[2]
+        count('files_stated')
+        try:
+            mtime_ns = stat(directory or '.').st_mtime_ns
+        except (NotADirectoryError, FileNotFoundError):
+            return [], []
+        if (cached and cached[0] == mtime_ns and
+                mtime_ns // 10**9 < self.written_ns // 10**9):
+            return cached[1], cached[2]
+        files, subdirectories = _scan_directory(directory)
+        # An empty directory may only be unreadable, and chmod doesn't
+        # change its time, so it is read again:
+        if files or subdirectories:
+            self.directories[directory] = [mtime_ns, files, subdirectories]
+            self.changed = True
+        return files, subdirectories
+
+    def flush(self):
+        """Write the cache if it was changed."""
+        if not self.changed:
+            return
+        try:
+            with open(self.file_name + '.lock', 'w') as cache:
+                dump({'version': CACHE_VERSION,
+                      'directories': self.directories}, cache)
+            replace(self.file_name + '.lock', self.file_name)
+        except PermissionError:
+            return
+        self.changed = False
+
+
+def _scan_directory(directory):
+    """Read the names of the files and subdirectories of a directory.
+
+    A directory which can't be read (or was removed meanwhile) is empty.
+    """
+    files = []
+    subdirectories = []
+    count('directories_read')
+    try:
+        with scandir(directory or '.') as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # Like os.walk, a link to a directory isn't walked:
+                    if not entry.is_symlink():
+                        subdirectories.append(entry.name)
+                else:
+                    files.append(entry.name)
+    except (PermissionError, NotADirectoryError, FileNotFoundError):
+        return [], []
+    return files, subdirectories
+
+
+@traced('walk working directory')
+def get_files_skip_lgit(directory='.', cache=None):
+    """Get all files in a directory, skipping .lgit and the ignored files.
+
+    Args:
+        directory: The directory tree to get files.
+        cache: The UntrackedCache to read the directories from, or None to
+            read all of them.
+
+    Returns:
+        The sorted list of files in a directory tree, relative to it.
+    """
+    start = '/'.join(part for part in directory.split('/')
+                     if part not in ('', '.'))
+    file_paths = []  # List which will store all of the relative filepath.
+
+    def _walk(current, rules):
+        """Add the files of the directory current, then walk its children."""
+        if cache is None:
+            files, subdirectories = _scan_directory(current)
+        else:
+            files, subdirectories = cache.list_directory(current)
+        # Only open the .lgitignore files which are listed:
+        if IGNORE_FILE in files:
+            rules = rules.add_file(current)
+        prefix = current + '/' if current else ''
+        for file_name in files:
+            if not rules.is_ignored(prefix + file_name):
+                file_paths.append(prefix + file_name)
+        for name in subdirectories:
+            # Prune the ignored directories before walking them:
+            if name != '.lgit' and not rules.is_ignored(prefix + name, True):
+                _walk(prefix + name, rules)
+
+    if start:
+        _walk(start, IgnoreRules.for_directory(start.rpartition('/')[0]))
+    else:
+        _walk(start, IgnoreRules())
+    if start:
+        file_paths = [path[len(start) + 1:] for path in file_paths]
+    return sorted(file_paths)  # Self-explanatory.